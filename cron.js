@@ -1,10 +1,12 @@
 const cron = require('node-cron');
 const fs = require('fs');
 const path = require('path');
+const os = require('os');
 const crypto = require('crypto');
 const { spawn } = require('child_process');
 const { runDailyUrlChecks } = require('./lib/url_checker');
 const { runCommentChecks } = require('./lib/offensive_checker');
+const tfidfSearch = require('./lib/tfidf_search');
 
 function createBackupDB(sourceDbPath, backupDir, encryptionKeyHex) {
     return new Promise((resolve, reject) => {
@@ -54,6 +56,14 @@ function startCronJobs(options = {}) {
     const debugging = !!options.debugging;
     const encryptionKey = options.encryptionKey || process.env.ENCRYPTION_KEY;
     const appRoot = options.appRoot || __dirname;
+    // Procesos de tokenización para el reindexado nocturno (por defecto, todos los núcleos menos uno)
+    const tfidfWorkers = options.tfidfWorkers || process.env.TFIDF_WORKERS || Math.max(1, os.cpus().length - 1);
+    // 'recalc': reindexado completo cada noche; 'check': comprueba los contadores
+    // incrementales de doc_freq/total_docs, reindexa solo si hay deriva y si no
+    // refresca las normas (recalc_idf.py --refresh-norms)
+    const tfidfNightly = options.tfidfNightly || process.env.TFIDF_NIGHTLY || 'recalc';
+    // Código de salida de recalc_idf.py --check con contadores desviados (DRIFT_EXIT)
+    const TFIDF_DRIFT_EXIT = 3;
 
     // Horas concretas de ejecución:
     const REBUILD_IDF_AT = '0 2 * * *';
@@ -61,13 +71,62 @@ function startCronJobs(options = {}) {
     const VERIFY_COMMENTS_AT = '0 4 * * *';
     const RESET_WEEKLY_UPLOADS_AT = '0 0 * * 0';
     const MONTHLY_BACKUP_AT = '0 0 1 * *';
+    const REFRESH_RELATED_AT = '*/5 * * * *';
 
-    // Se ejecuta todos los días a las 02:00: recalcula IDF.
-    cron.schedule(REBUILD_IDF_AT, () => {
+    // Se ejecuta todos los días a las 02:00: recalcula IDF (o comprueba los contadores).
+    const runRecalc = () => {
         console.log('Recalculando IDF...');
-        const python = spawn('python3', ['tf-idf/recalc_idf.py']);
+        const python = spawn('python3', ['tf-idf/recalc_idf.py', '--workers', String(tfidfWorkers)]);
         python.stdout.on('data', (data) => console.log(data.toString()));
         python.stderr.on('data', (data) => console.error(data.toString()));
+        python.on('close', (code) => {
+            if (code !== 0) return;
+            tfidfSearch.reload().catch(err => console.error('Error recargando índice TF-IDF:', err && err.message));
+            // Con el IDF nuevo, recalcular las fuentes relacionadas (related_sources)
+            const related = spawn('python3', ['tf-idf/related_sources.py', '--workers', String(tfidfWorkers)]);
+            related.stdout.on('data', (data) => console.log(data.toString()));
+            related.stderr.on('data', (data) => console.error(data.toString()));
+        });
+    };
+    cron.schedule(REBUILD_IDF_AT, () => {
+        if (tfidfNightly !== 'check') return runRecalc();
+        console.log('Comprobando contadores TF-IDF...');
+        const python = spawn('python3', ['tf-idf/recalc_idf.py', '--check']);
+        python.stdout.on('data', (data) => console.log(data.toString()));
+        python.stderr.on('data', (data) => console.error(data.toString()));
+        python.on('close', (code) => {
+            // 3 = contadores desviados: el reindexado completo los corrige.
+            // Cualquier otro código es un fallo de la comprobación, no deriva
+            if (code === TFIDF_DRIFT_EXIT) return runRecalc();
+            if (code !== 0) {
+                console.error(`La comprobación de contadores TF-IDF falló (código ${code}); no se reindexa`);
+                return;
+            }
+            // Contadores al día: basta con llevar las normas al IDF vigente
+            const refresh = spawn('python3', ['tf-idf/recalc_idf.py', '--refresh-norms']);
+            refresh.stdout.on('data', (data) => console.log(data.toString()));
+            refresh.stderr.on('data', (data) => console.error(data.toString()));
+            refresh.on('close', (refreshCode) => {
+                if (refreshCode !== 0) return;
+                tfidfSearch.reload().catch(err => console.error('Error recargando índice TF-IDF:', err && err.message));
+            });
+        });
+    });
+
+    // Se ejecuta cada 5 minutos: aplica a related_sources las fuentes indexadas o
+    // retiradas desde la última vez (fuera de la transacción de la subida).
+    let refreshingRelated = false;
+    cron.schedule(REFRESH_RELATED_AT, () => {
+        if (refreshingRelated) return;
+        refreshingRelated = true;
+        const python = spawn('python3', ['tf-idf/related_sources.py', '--pending']);
+        python.stdout.on('data', (data) => { if (debugging) console.log(data.toString()); });
+        python.stderr.on('data', (data) => console.error(data.toString()));
+        python.on('close', () => { refreshingRelated = false; });
+        python.on('error', (err) => {
+            refreshingRelated = false;
+            console.error('Error actualizando fuentes relacionadas:', err && err.message);
+        });
     });
 
     // Se ejecuta todos los días a las 03:00: verifica URLs rotas.
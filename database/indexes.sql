@@ -21,9 +21,9 @@ CREATE INDEX IF NOT EXISTS idx_sources_doi ON sources(doi) WHERE doi IS NOT NULL
 -- 3) Ratings: aggregations and lookups by source
 CREATE INDEX IF NOT EXISTS idx_ratings_source ON ratings(source_id);
 
--- 4) TF-IDF tables: essential for semantic search performance
-CREATE INDEX IF NOT EXISTS idx_tfidf_term ON tfidf_vectors(term);
-CREATE INDEX IF NOT EXISTS idx_tfidf_source_term ON tfidf_vectors(source_id, term);
+-- 4) TF-IDF tables: sus índices se crean con cada generación del índice
+--    (idx_postings_g<N>_source, ver database/init.sql y tf-idf/db_utils.py);
+--    crearlos aquí los duplicaría tras cada reconstrucción.
 
 -- 5) URLs: lookups and maintenance by source
 CREATE INDEX IF NOT EXISTS idx_source_urls_source ON source_urls(source_id);
@@ -196,6 +196,10 @@ CREATE TABLE IF NOT EXISTS related_sources (
     FOREIGN KEY (related_source_id) REFERENCES sources(id) ON DELETE CASCADE
 );
 
+-- Listas de fuentes relacionadas que contienen una fuente (tf-idf/related_sources.py las
+-- pone al día al indexarla). Lleva la generación del cálculo completo en el nombre
+CREATE INDEX IF NOT EXISTS idx_related_sources_r0 ON related_sources(related_source_id);
+
 -- ============================================
 -- MODULE 4: RATINGS AND COMMENTS
 -- ============================================
@@ -419,15 +423,26 @@ CREATE TABLE IF NOT EXISTS reports (
 -- MODULE 9: TF-IDF AND SEARCH
 -- ============================================
 
-CREATE TABLE IF NOT EXISTS tfidf_vectors (
+-- Diccionario de términos del índice: los postings guardan el término como entero
+CREATE TABLE IF NOT EXISTS tfidf_terms (
+    term_id INTEGER PRIMARY KEY,
+    term VARCHAR(100) NOT NULL UNIQUE
+);
+
+-- Listas de postings por término ya ordenadas por fuente (clave (term_id, source_id)).
+-- tf es el número de apariciones del término en el documento virtual de la fuente;
+-- el IDF está en global_idf y la búsqueda usa tf / norm.
+CREATE TABLE IF NOT EXISTS tfidf_postings (
+    term_id INTEGER NOT NULL,
     source_id INTEGER NOT NULL,
-    term VARCHAR(100) NOT NULL,
-    tf REAL NOT NULL,
-    idf REAL NOT NULL,
-    weight REAL NOT NULL,
-    PRIMARY KEY (source_id, term),
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term_id, source_id),
     FOREIGN KEY (source_id) REFERENCES sources(id) ON DELETE CASCADE
-);
+) WITHOUT ROWID;
+
+-- Vector de cada fuente. Lleva el número de generación del índice:
+-- recalc_idf.py crea uno nuevo con cada reconstrucción.
+CREATE INDEX IF NOT EXISTS idx_postings_g0_source ON tfidf_postings(source_id);
 
 CREATE TABLE IF NOT EXISTS equivalent_domains (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -453,9 +468,124 @@ CREATE TABLE global_idf (
 
 CREATE TABLE source_norms (
     source_id INTEGER PRIMARY KEY,
-    norm REAL NOT NULL,                -- √(∑ weight²) para similitud de coseno rápida
+    norm REAL NOT NULL,                -- √(∑ (tf × idf)²) para similitud de coseno rápida
+    FOREIGN KEY (source_id) REFERENCES sources(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS term_max_weights (
+    term VARCHAR(100) PRIMARY KEY,
+    max_weight REAL NOT NULL           -- cota superior de tf / norm del término (poda MaxScore)
+);
+
+-- Fuentes reindexadas desde la última instantánea del índice (tf-idf/index_snapshot.py)
+CREATE TABLE IF NOT EXISTS tfidf_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    source_id INTEGER NOT NULL,
+    changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Metadatos del índice: 'generation' aumenta con cada reconstrucción completa;
+-- 'total_docs' es el número de fuentes indexadas (junto con global_idf.doc_freq da el IDF)
+CREATE TABLE IF NOT EXISTS tfidf_meta (
+    key VARCHAR(50) PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+-- Los atributos con los que se filtra y se cuentan facetas (tf-idf/source_attrs.py)
+-- también cambian la versión del índice: el servidor de búsqueda los recarga en
+-- el siguiente sondeo y la caché deja de servir resultados con los valores antiguos
+CREATE TRIGGER IF NOT EXISTS trg_tfidf_attrs_change
+AFTER UPDATE OF source_type_id, category_id, subcategory_id, publication_year, overall_rating, is_active ON sources
+WHEN NEW.source_type_id IS NOT OLD.source_type_id OR NEW.category_id IS NOT OLD.category_id
+    OR NEW.subcategory_id IS NOT OLD.subcategory_id OR NEW.publication_year IS NOT OLD.publication_year
+    OR NEW.overall_rating IS NOT OLD.overall_rating OR NEW.is_active IS NOT OLD.is_active
+BEGIN
+    INSERT INTO tfidf_changes (source_id) VALUES (NEW.id);
+END;
+
+-- Registro de presentación de cada fuente para los resultados de búsqueda (JSON
+-- compacto: título, autores en orden, año, tipo, nombre de quien la subió y
+-- valoración). Los triggers lo mantienen al día cuando cambian la fuente, sus
+-- autores o el nombre del usuario; tf-idf/display_records.py lo reconstruye entero.
+CREATE TABLE IF NOT EXISTS source_display (
+    source_id INTEGER PRIMARY KEY,
+    record TEXT NOT NULL,
     FOREIGN KEY (source_id) REFERENCES sources(id) ON DELETE CASCADE
 );
+CREATE VIEW IF NOT EXISTS source_display_view AS
+SELECT s.id AS source_id, json_object(
+    'title', s.title,
+    'authors', (SELECT json_group_array(full_name) FROM (
+        SELECT a.full_name FROM source_authors sa JOIN authors a ON a.id = sa.author_id
+        WHERE sa.source_id = s.id ORDER BY sa.sort_order, sa.rowid)),
+    'year', s.publication_year,
+    'type', st.name,
+    'uploader_id', s.uploaded_by,
+    'uploader', COALESCE(u.full_name, u.username),
+    'rating', s.overall_rating,
+    'ratings', s.total_ratings
+) AS record
+FROM sources s
+LEFT JOIN source_types st ON st.id = s.source_type_id
+LEFT JOIN users u ON u.id = s.uploaded_by;
+CREATE TRIGGER IF NOT EXISTS trg_source_display_insert AFTER INSERT ON sources BEGIN
+    INSERT OR REPLACE INTO source_display SELECT * FROM source_display_view WHERE source_id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_source_display_update
+AFTER UPDATE OF title, publication_year, source_type_id, uploaded_by, overall_rating, total_ratings ON sources BEGIN
+    INSERT OR REPLACE INTO source_display SELECT * FROM source_display_view WHERE source_id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_source_display_delete AFTER DELETE ON sources BEGIN
+    DELETE FROM source_display WHERE source_id = OLD.id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_source_display_author_add AFTER INSERT ON source_authors BEGIN
+    INSERT OR REPLACE INTO source_display SELECT * FROM source_display_view WHERE source_id = NEW.source_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_source_display_author_remove AFTER DELETE ON source_authors BEGIN
+    INSERT OR REPLACE INTO source_display SELECT * FROM source_display_view WHERE source_id = OLD.source_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_source_display_author_order AFTER UPDATE ON source_authors BEGIN
+    INSERT OR REPLACE INTO source_display SELECT * FROM source_display_view
+    WHERE source_id IN (OLD.source_id, NEW.source_id);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_source_display_author_name AFTER UPDATE OF full_name ON authors BEGIN
+    INSERT OR REPLACE INTO source_display SELECT * FROM source_display_view
+    WHERE source_id IN (SELECT source_id FROM source_authors WHERE author_id = NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_source_display_uploader AFTER UPDATE OF full_name, username ON users BEGIN
+    INSERT OR REPLACE INTO source_display SELECT * FROM source_display_view
+    WHERE source_id IN (SELECT id FROM sources WHERE uploaded_by = NEW.id);
+END;
+
+-- Casi duplicados por título (tf-idf/near_duplicates.py): título normalizado y
+-- año y firma MinHash (64 enteros de 32 bits) de cada fuente, y el cubo LSH de cada
+-- una de sus 48 bandas; una fuente nueva solo consulta los cubos de sus bandas.
+-- Sin claves foráneas: un ON DELETE CASCADE sobre los cubos necesitaría un
+-- índice por source_id (32 filas por fuente). Las consultas cruzan con sources
+-- y el scan completo borra las firmas y cubos de las fuentes que ya no existen.
+CREATE TABLE IF NOT EXISTS title_signatures (
+    source_id INTEGER PRIMARY KEY,
+    normalized TEXT NOT NULL,
+    publication_year INTEGER,
+    signature BLOB NOT NULL
+);
+-- títulos de un año: candidatos de la regla de distancia de edición
+CREATE INDEX IF NOT EXISTS idx_title_signatures_year ON title_signatures(publication_year);
+CREATE TABLE IF NOT EXISTS title_lsh_buckets (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    source_id INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, source_id)
+) WITHOUT ROWID;
+
+-- huella (hash de 64 bits de título, autores y edición normalizados) de cada
+-- fuente: un duplicado exacto es una búsqueda en idx_source_fingerprints_fingerprint.
+-- La calculan tf-idf/fingerprints.py y lib/duplicate_checker.js.
+CREATE TABLE IF NOT EXISTS source_fingerprints (
+    source_id INTEGER PRIMARY KEY,
+    fingerprint INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_source_fingerprints_fingerprint ON source_fingerprints(fingerprint);
 
 -- ============================================
 -- MODULE 10: SECURITY AND LOGS
@@ -695,6 +825,8 @@ INSERT INTO system_config (config_key, config_value, description) VALUES
 ('max_sources_per_list', '50', 'Maximum sources in a list'),
 ('search_results_per_page', '20', 'Number of results per search page');
 
+INSERT INTO tfidf_meta (key, value) VALUES ('generation', 0), ('total_docs', 0);
+
 INSERT INTO chats (chat_type, group_name, created_by) VALUES 
 ('group', 'Artícora Notifications', NULL);
 
@@ -959,16 +959,15 @@ class ArticoraDataPopulator:
                 all_terms = terms + random.sample(extra_terms, 2)
                 
                 for term in all_terms:
-                    # Valores TF-IDF simulados
-                    tf = round(random.uniform(0.1, 1.0), 3)
-                    idf = round(random.uniform(1.0, 3.0), 3)
-                    weight = round(tf * idf, 3)
+                    # Apariciones simuladas del término
+                    tf = random.randint(1, 5)
                     
                     try:
+                        self.cursor.execute('INSERT OR IGNORE INTO tfidf_terms (term) VALUES (?)', (term,))
                         self.cursor.execute('''
-                            INSERT OR IGNORE INTO tfidf_vectors (source_id, term, tf, idf, weight)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (source['id'], term, tf, idf, weight))
+                            INSERT OR IGNORE INTO tfidf_postings (term_id, source_id, tf)
+                            SELECT term_id, ?, ? FROM tfidf_terms WHERE term = ?
+                        ''', (source['id'], tf, term))
                         
                         if self.cursor.rowcount > 0:
                             vector_count += 1
@@ -1078,7 +1077,7 @@ class ArticoraDataPopulator:
             'users', 'sources', 'ratings', 'curatorial_lists', 
             'list_sources', 'user_readings', 'contact_requests',
             'confirmed_contacts', 'chats', 'messages', 'reports',
-            'tfidf_vectors', 'autocomplete_dictionary'
+            'tfidf_postings', 'autocomplete_dictionary'
         ]
         
         total_records = 0
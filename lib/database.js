@@ -1,5 +1,6 @@
 const path = require('path');
 const fs = require('fs');
+const { spawnSync } = require('child_process');
 require('dotenv').config();
 
 // Usamos better-sqlite3
@@ -171,6 +172,26 @@ function migrateListViewTracking() {
     }
 }
 
+// Tablas, triggers e índices de TF-IDF que falten en una base creada con un
+// init.sql anterior (y migración del formato antiguo de postings): una vez al
+// arrancar, no en cada subida (tf-idf/db_utils.py, ensure_schema)
+function migrateTfidfSchema() {
+    console.log('\n🔎 Verificando esquema TF-IDF...');
+    const script = path.join(__dirname, '..', 'tf-idf', 'db_utils.py');
+    const result = spawnSync('python3', [script], { encoding: 'utf-8' });
+    if (result.error || result.status !== 0) {
+        console.error('⚠️ Error migrando el esquema TF-IDF:', (result.error && result.error.message) || result.stderr);
+        return;
+    }
+    try {
+        const { created } = JSON.parse(result.stdout.trim().split('\n').pop());
+        if (created.length) console.log(`✅ Esquema TF-IDF: creados ${created.join(', ')}`);
+        else console.log('📋 Esquema TF-IDF al día');
+    } catch (e) {
+        console.warn('⚠️ Respuesta inesperada de la migración TF-IDF:', result.stdout);
+    }
+}
+
 function createConfigurationTables() {
     console.log('\n⚙️ Creando tablas de configuración...');
 
@@ -218,6 +239,8 @@ async function initialize() {
     await new Promise(resolve => setTimeout(resolve, 100));
     migrateListViewTracking();
     await new Promise(resolve => setTimeout(resolve, 100));
+    migrateTfidfSchema();
+    await new Promise(resolve => setTimeout(resolve, 100));
     createIndexes();
     await new Promise(resolve => setTimeout(resolve, 100));
     // Ensure migration: add weekly_file_uploads column to users if missing
@@ -1,85 +1,66 @@
-const normalize = (s) => {
-  if (!s) return '';
-  try {
-    return s.toString().toLowerCase()
-      .normalize('NFD')
-      .replace(/\p{Diacritic}/gu, '')
-      .replace(/[^a-z0-9\s]/g, ' ')
-      .replace(/\s+/g, ' ')
-      .trim();
-  } catch (e) {
-    // fallback for environments without \p{Diacritic}
-    return s.toString().toLowerCase()
-      .normalize('NFD')
-      .replace(/[\u0300-\u036f]/g, '')
-      .replace(/[^a-z0-9\s]/g, ' ')
-      .replace(/\s+/g, ' ')
-      .trim();
-  }
-};
-
-function tokensFromTitle(title) {
-  const n = normalize(title);
-  if (!n) return new Set();
-  const parts = n.split(' ').filter(Boolean).filter(w => w.length > 2);
-  return new Set(parts);
-}
-
-function jaccard(aSet, bSet) {
-  if (!aSet.size || !bSet.size) return 0;
-  let inter = 0;
-  aSet.forEach(v => { if (bSet.has(v)) inter++; });
-  const uni = new Set([...aSet, ...bSet]).size;
-  return uni === 0 ? 0 : (inter / uni);
+const path = require('path');
+const { spawn } = require('child_process');
+const crypto = require('crypto');
+
+// Detección de casi duplicados por título con MinHash + LSH (tf-idf/near_duplicates.py).
+// Python genera los pares candidatos de todo el corpus con las bandas LSH y solo a esos
+// les aplica Jaccard y distancia de edición; aquí se agrupan en componentes conexas y se
+// crean las alertas.
+const NEAR_DUPLICATES_SCRIPT = path.join(__dirname, '..', 'tf-idf', 'near_duplicates.py');
+
+function runNearDuplicates(args) {
+  return new Promise((resolve, reject) => {
+    const py = spawn('python3', [NEAR_DUPLICATES_SCRIPT, ...args], { cwd: path.join(__dirname, '..') });
+    let output = '';
+    let errOutput = '';
+    py.stdout.on('data', (data) => { output += data.toString(); });
+    py.stderr.on('data', (data) => { errOutput += data.toString(); });
+    py.on('error', (err) => reject(err));
+    py.on('close', (code) => {
+      if (code !== 0) return reject(new Error(`near_duplicates.py terminó con código ${code}: ${errOutput}`));
+      try {
+        resolve(JSON.parse(output));
+      } catch (e) {
+        reject(new Error('near_duplicates.py: salida no válida'));
+      }
+    });
+  });
 }
 
-function levenshtein(a, b) {
-  const la = a.length, lb = b.length;
-  if (la === 0) return lb;
-  if (lb === 0) return la;
-  const dp = Array(la + 1).fill(null).map(() => Array(lb + 1).fill(0));
-  for (let i = 0; i <= la; i++) dp[i][0] = i;
-  for (let j = 0; j <= lb; j++) dp[0][j] = j;
-  for (let i = 1; i <= la; i++) {
-    for (let j = 1; j <= lb; j++) {
-      const cost = a[i - 1] === b[j - 1] ? 0 : 1;
-      dp[i][j] = Math.min(dp[i-1][j] + 1, dp[i][j-1] + 1, dp[i-1][j-1] + cost);
+// Crea una alerta para el grupo de fuentes salvo que ya haya una sin resolver con el mismo conjunto
+function createGroupAlert(db, idsArr, similarity) {
+  // Check if there's already an unresolved alert that mentions the exact set (parse details server-side to avoid false matches)
+  const unresolvedAlerts = db.prepare("SELECT id, details FROM system_alerts WHERE alert_type = 'duplicate-detection' AND resolved_at IS NULL").all();
+  for (const a of unresolvedAlerts) {
+    try {
+      const d = a.details ? JSON.parse(a.details) : {};
+      const existingIds = d.sourceIds || d.ids || d.source_ids || [];
+      if (Array.isArray(existingIds)) {
+        const sortedExisting = existingIds.map(Number).sort((x,y)=>x-y);
+        if (JSON.stringify(sortedExisting) === JSON.stringify(idsArr)) return false;
+      }
+    } catch (e) {
+      // ignore parse errors
     }
   }
-  return dp[la][lb];
+
+  const agg = Math.round(similarity * 100);
+  const description = `Posible duplicado detectado entre fuentes ${idsArr.map(i => '#' + i).join(', ')} (similitud ${agg}%). Revisa y fusiona si corresponde.`;
+  const titleRows = db.prepare(`SELECT id, title FROM sources WHERE id IN (${idsArr.map(() => '?').join(',')})`).all(...idsArr);
+  const titleMap = new Map(titleRows.map(r => [r.id, r.title || '']));
+  const titles = idsArr.map(id => titleMap.get(id) || '');
+  const details = JSON.stringify({ sourceIds: idsArr, titles, similarity: agg });
+  db.prepare('INSERT INTO system_alerts (alert_type, severity, description, details, created_at) VALUES (?, ?, ?, ?, datetime(\'now\'))').run('duplicate-detection', 'medium', description, details);
+  return true;
 }
 
 async function runDuplicateChecks(db) {
   try {
     if (!db) throw new Error('database instance required');
 
-    // Load active sources (limit to 1000 to avoid O(n^2) explosion)
-    const rows = db.prepare('SELECT id, title, publication_year FROM sources WHERE is_active = 1 ORDER BY id DESC LIMIT 1000').all();
-
-    // Precompute tokens
-    const items = rows.map(r => ({ id: r.id, title: r.title || '', year: r.publication_year || null, tokens: tokensFromTitle(r.title) }));
-
-    const pairEdges = []; // {a,b,score,levSim}
-
-    // Build candidate edges
-    for (let i = 0; i < items.length; i++) {
-      for (let j = i + 1; j < items.length; j++) {
-        const a = items[i];
-        const b = items[j];
-        const score = jaccard(a.tokens, b.tokens);
-        const normA = normalize(a.title || '');
-        const normB = normalize(b.title || '');
-        const lev = levenshtein(normA, normB);
-        const maxL = Math.max(1, Math.max(normA.length, normB.length));
-        const levSim = 1 - (lev / maxL);
-
-        // Heuristics for an edge
-        const isEdge = ((a.year && b.year && a.year === b.year && (score >= 0.35 || levSim >= 0.75)) || score >= 0.70);
-        if (isEdge) {
-          pairEdges.push({ a: a.id, b: b.id, score, levSim });
-        }
-      }
-    }
+    // Pares casi duplicados entre todas las fuentes activas
+    const scan = await runNearDuplicates(['--scan']);
+    const pairEdges = scan.pairs.map(p => ({ a: p.a, b: p.b, score: p.jaccard, levSim: p.edit_similarity }));
 
     // Build adjacency and find connected components using BFS
     const adj = {};
@@ -115,39 +96,66 @@ async function runDuplicateChecks(db) {
       const idsArr = Array.from(groups[root]).sort((a,b) => a - b);
       if (idsArr.length < 2) return;
 
-      // Check if there's already an unresolved alert that mentions the exact set (parse details server-side to avoid false matches)
-      const unresolvedAlerts = db.prepare("SELECT id, details FROM system_alerts WHERE alert_type = 'duplicate-detection' AND resolved_at IS NULL").all();
-      let already = false;
-      for (const a of unresolvedAlerts) {
-        try {
-          const d = a.details ? JSON.parse(a.details) : {};
-          const existingIds = d.sourceIds || d.ids || d.source_ids || [];
-          if (Array.isArray(existingIds)) {
-            const sortedExisting = existingIds.map(Number).sort((x,y)=>x-y);
-            const sortedIds = idsArr.slice().sort((x,y)=>x-y);
-            if (JSON.stringify(sortedExisting) === JSON.stringify(sortedIds)) { already = true; break; }
-          }
-        } catch (e) {
-          // ignore parse errors
-        }
+      // Compute an aggregate similarity (max of pair scores)
+      const members = groups[root];
+      const relevantPairs = pairEdges.filter(pe => members.has(pe.a) && members.has(pe.b));
+      const similarity = relevantPairs.length ? Math.max(...relevantPairs.map(p => p.score)) : 0;
+      if (createGroupAlert(db, idsArr, similarity)) {
+        createdAlerts.push({ ids: idsArr, similarity: Math.round(similarity * 100) });
       }
-      if (already) return;
-
-      // Compute an aggregate similarity (max of pair scores * 100)
-      const relevantPairs = pairEdges.filter(pe => idsArr.includes(pe.a) && idsArr.includes(pe.b));
-      const agg = relevantPairs.length ? Math.round(Math.max(...relevantPairs.map(p => p.score)) * 100) : 0;
-      const description = `Posible duplicado detectado entre fuentes ${idsArr.map(i => '#' + i).join(', ')} (similitud ${agg}%). Revisa y fusiona si corresponde.`;
-      const titles = idsArr.map(id => (items.find(it => it.id === id) || {}).title || '');
-      const details = JSON.stringify({ sourceIds: idsArr, titles, similarity: agg });
-      db.prepare('INSERT INTO system_alerts (alert_type, severity, description, details, created_at) VALUES (?, ?, ?, ?, datetime(\'now\'))').run('duplicate-detection', 'medium', description, details);
-      createdAlerts.push({ ids: idsArr, similarity: agg });
     });
 
-    return { success: true, created: createdAlerts.length, alerts: createdAlerts };
+    return { success: true, created: createdAlerts.length, alerts: createdAlerts,
+      scanned: scan.sources, candidates: scan.candidates };
   } catch (e) {
     console.error('duplicate_checker error', e && e.message);
     return { success: false, error: String(e && e.message) };
   }
 }
 
-module.exports = { runDuplicateChecks };
+// Alerta para una fuente recién indexada con los casi duplicados que devuelve
+// index_source.py (comprobación incremental: solo los cubos LSH de sus bandas)
+function alertNearDuplicates(db, sourceId, matches) {
+  try {
+    if (!db || !Array.isArray(matches) || !matches.length) return false;
+    const idsArr = [Number(sourceId), ...matches.map(m => Number(m.source_id))].sort((a,b) => a - b);
+    return createGroupAlert(db, idsArr, Math.max(...matches.map(m => m.jaccard || 0)));
+  } catch (e) {
+    console.error('duplicate_checker error', e && e.message);
+    return false;
+  }
+}
+
+// Casi duplicados de un título que aún no se ha subido: [{source_id, title, jaccard, edit_similarity}]
+function checkTitle(title, year = null) {
+  const args = ['--title', String(title || '')];
+  if (year) args.push('--year', String(year));
+  return runNearDuplicates(args).then(result => result.matches);
+}
+
+// Misma normalización que near_duplicates.normalize_title
+function normalizeText(text) {
+  return String(text || '').toLowerCase().normalize('NFD').replace(/[\u0300-\u036f]/g, '')
+    .replace(/[^a-z0-9\s]/g, ' ').replace(/\s+/g, ' ').trim();
+}
+
+// Huella de duplicado exacto (título + autores + edición) tal como la calcula
+// tf-idf/fingerprints.py y la guarda source_fingerprints: BigInt de 64 bits con signo
+function sourceFingerprint(title, authors, edition) {
+  const names = [...new Set((authors || []).map(normalizeText).filter(n => n))].sort();
+  let ed = edition === null || edition === undefined ? '' : String(edition).trim();
+  if (/^[0-9]+$/.test(ed)) ed = String(BigInt(ed));
+  const canonical = [normalizeText(title), names.join('\x1e'), ed].join('\x1f');
+  return crypto.createHash('sha256').update(canonical, 'utf8').digest().readBigInt64BE(0);
+}
+
+// Fuentes con exactamente ese título + autores + edición (una búsqueda en el índice de huellas)
+function findExactDuplicates(db, title, authors, edition) {
+  return db.prepare(`
+    SELECT s.id, s.title, s.edition FROM source_fingerprints f
+    JOIN sources s ON s.id = f.source_id
+    WHERE f.fingerprint = ? ORDER BY s.id
+  `).all(sourceFingerprint(title, authors, edition));
+}
+
+module.exports = { runDuplicateChecks, alertNearDuplicates, checkTitle, sourceFingerprint, findExactDuplicates };
@@ -0,0 +1,205 @@
+const path = require('path');
+const readline = require('readline');
+const { spawn } = require('child_process');
+
+// Cliente del servidor residente de búsqueda TF-IDF (tf-idf/search_server.py).
+// Mantiene un único proceso Python abierto y le envía peticiones JSON por líneas;
+// el protocolo está documentado en el propio script y en RESUMEN.MD.
+const SERVER_SCRIPT = path.join(__dirname, '..', 'tf-idf', 'search_server.py');
+const UNINDEX_SCRIPT = path.join(__dirname, '..', 'tf-idf', 'unindex_source.py');
+const REQUEST_TIMEOUT_MS = 15000;
+
+let proc = null;
+let nextId = 1;
+const pending = new Map();
+
+function failPending(err) {
+    for (const entry of pending.values()) {
+        clearTimeout(entry.timer);
+        entry.reject(err);
+    }
+    pending.clear();
+}
+
+function startServer() {
+    if (proc) return proc;
+
+    const child = spawn('python3', [SERVER_SCRIPT], { cwd: path.join(__dirname, '..') });
+    proc = child;
+
+    const lines = readline.createInterface({ input: child.stdout });
+    lines.on('line', (line) => {
+        let msg;
+        try {
+            msg = JSON.parse(line);
+        } catch (e) {
+            console.error('Respuesta no válida del servidor TF-IDF:', line);
+            return;
+        }
+        if (msg.event === 'ready') {
+            if (global.debugging) console.log('Servidor TF-IDF listo', msg);
+            return;
+        }
+        if (msg.event === 'reloaded') {
+            if (!msg.ok) console.error('Error recargando índice TF-IDF:', msg.error);
+            else if (global.debugging) console.log('Índice TF-IDF recargado', msg);
+            return;
+        }
+        const entry = pending.get(msg.id);
+        if (!entry) return;
+        pending.delete(msg.id);
+        clearTimeout(entry.timer);
+        if (msg.ok) entry.resolve(msg);
+        else entry.reject(new Error(msg.error || 'Error en el servidor TF-IDF'));
+    });
+
+    child.stderr.on('data', (data) => console.error(`TF-IDF server: ${data}`));
+
+    const onExit = (err) => {
+        if (proc === child) proc = null;
+        failPending(err);
+    };
+    child.on('error', (err) => onExit(err));
+    // Escribir en un proceso que ya cerró stdin (caído a mitad de petición) emite EPIPE
+    // en el stream: sin este manejador el error tumbaría el proceso de Node entero
+    child.stdin.on('error', (err) => onExit(err));
+    child.on('exit', (code, signal) => onExit(new Error(`Servidor TF-IDF terminó (code ${code}, signal ${signal})`)));
+
+    return child;
+}
+
+function request(payload) {
+    return new Promise((resolve, reject) => {
+        try {
+            const child = startServer();
+            const id = nextId++;
+            const timer = setTimeout(() => {
+                pending.delete(id);
+                reject(new Error('Tiempo de espera agotado en el servidor TF-IDF'));
+                // Un servidor que no responde se mata para que la siguiente petición arranque
+                // otro, en lugar de agotar el tiempo de espera en todas a partir de ahora
+                if (proc === child) {
+                    proc = null;
+                    failPending(new Error('Servidor TF-IDF reiniciado tras no responder'));
+                    child.kill();
+                }
+            }, REQUEST_TIMEOUT_MS);
+            pending.set(id, { resolve, reject, timer });
+            child.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+        } catch (e) {
+            reject(e);
+        }
+    });
+}
+
+// filters (opcional): { source_type_id, category_id, subcategory_id, year_from, year_to,
+// rating_min, rating_max, is_active, exclude_ids, exclude_list }; se aplican al puntuar,
+// así que se reciben hasta topK resultados que ya cumplen los filtros.
+// Con { hydrate: true } cada resultado trae también display: { title, authors, year, type,
+// uploader_id, uploader, rating, ratings } (tf-idf/display_records.py), sin más consultas.
+function search(query, topK = 20, filters = null, { hydrate = false } = {}) {
+    const payload = { op: 'search', query: String(query || ''), top_k: topK };
+    if (filters) payload.filters = filters;
+    if (hydrate) payload.hydrate = true;
+    return request(payload).then(msg => msg.results);
+}
+
+// Como search, pero devuelve { results, facets }: conteos por category_id, subcategory_id,
+// source_type_id y tramo de año (year) de todas las fuentes que cumplen los filtros con
+// puntuación >= minScore, más matched (cuántas son). Las claves de cada faceta son ids.
+function searchFacets(query, topK = 20, filters = null, { minScore = 0, yearBucket = 10, hydrate = false } = {}) {
+    const payload = { op: 'search', query: String(query || ''), top_k: topK, facets: true, min_score: minScore, year_bucket: yearBucket };
+    if (filters) payload.filters = filters;
+    if (hydrate) payload.hydrate = true;
+    return request(payload).then(msg => ({ results: msg.results, facets: msg.facets }));
+}
+
+// Paginación profunda: sin cursor puntúa el ranking completo (hasta --page-depth), lo guarda
+// en el servidor y devuelve { results, offset, total, cursor, nextCursor } con la primera página;
+// con el nextCursor anterior devuelve la página siguiente del mismo ranking (query y filters
+// se ignoran), aunque el índice se haya recargado entre medias. Con { page } se pide esa
+// página (desde 1) del ranking del cursor, o del nuevo si no hay cursor. nextCursor es null en
+// la última página; un cursor caducado rechaza la promesa y hay que repetir la búsqueda.
+// Con { facets: true } (y minScore / yearBucket como en searchFacets) la primera petición
+// guarda los conteos de facetas con el ranking y cada página los devuelve en facets.
+function searchPage(query, pageSize = 20, filters = null, cursor = null,
+                    { hydrate = false, page = null, facets = false, minScore = 0, yearBucket = 10 } = {}) {
+    const payload = cursor
+        ? { op: 'search_page', cursor }
+        : { op: 'search_page', query: String(query || ''), page_size: pageSize };
+    if (filters && !cursor) payload.filters = filters;
+    if (facets && !cursor) Object.assign(payload, { facets: true, min_score: minScore, year_bucket: yearBucket });
+    if (page) payload.page = Number(page);
+    if (hydrate) payload.hydrate = true;
+    return request(payload).then(msg => ({
+        results: msg.results, offset: msg.offset, total: msg.total, cursor: msg.cursor,
+        nextCursor: msg.next_cursor, facets: msg.facets || null,
+    }));
+}
+
+// Fuentes más parecidas a una fuente ya indexada ("más como esta"): la consulta es su
+// vector guardado, sin preprocesar texto. La propia fuente no aparece en los resultados.
+function searchBySource(sourceId, topK = 20, filters = null, { hydrate = false } = {}) {
+    const payload = { op: 'search_by_source', source_id: Number(sourceId), top_k: topK };
+    if (filters) payload.filters = filters;
+    if (hydrate) payload.hydrate = true;
+    return request(payload).then(msg => msg.results);
+}
+
+// Varias consultas en una sola petición, puntuadas juntas en una pasada sobre el índice.
+// Devuelve un array de resultados por consulta, en el mismo orden.
+function searchBatch(queries, topK = 20, filters = null) {
+    const list = (queries || []).map(q => String(q || ''));
+    if (!list.length) return Promise.resolve([]);
+    const payload = { op: 'search_batch', queries: list, top_k: topK };
+    if (filters) payload.filters = filters;
+    return request(payload).then(msg => msg.results);
+}
+
+// Pide al servidor que vuelva a cargar el índice (tras indexar o recalcular IDF).
+// Responde en cuanto la recarga empieza: el servidor sigue atendiendo con el índice
+// anterior y lo sustituye al terminar. Si no está en marcha no hace nada: se
+// cargará actualizado al arrancar.
+function reload() {
+    if (!proc) return Promise.resolve(null);
+    return request({ op: 'reload' });
+}
+
+// Estadísticas del servidor (índice cargado, consultas y contadores de la caché de resultados)
+function stats() {
+    return request({ op: 'stats' });
+}
+
+// Retira fuentes del índice (descuenta doc_freq/total_docs y borra sus vectores).
+// En un borrado físico debe llamarse ANTES de borrar la fuente: el ON DELETE
+// CASCADE eliminaría los vectores de los que se obtienen sus términos.
+function unindexSources(sourceIds) {
+    const ids = (sourceIds || []).map(Number).filter(n => Number.isInteger(n));
+    if (!ids.length) return Promise.resolve(null);
+    return new Promise((resolve, reject) => {
+        const py = spawn('python3', [UNINDEX_SCRIPT, ...ids.map(String)], { cwd: path.join(__dirname, '..') });
+        let output = '';
+        let errOutput = '';
+        py.stdout.on('data', (data) => { output += data.toString(); });
+        py.stderr.on('data', (data) => { errOutput += data.toString(); });
+        py.on('error', (err) => reject(err));
+        py.on('close', (code) => {
+            if (code !== 0) return reject(new Error(`unindex_source.py terminó con código ${code}: ${errOutput}`));
+            reload().catch(err => console.error('Error recargando índice TF-IDF:', err));
+            try {
+                resolve(JSON.parse(output));
+            } catch (e) {
+                resolve({ status: 'ok', raw: output });
+            }
+        });
+    });
+}
+
+function stop() {
+    if (proc) {
+        proc.stdin.end();
+        proc = null;
+    }
+}
+
+module.exports = { search, searchFacets, searchPage, searchBySource, searchBatch, reload, stats, unindexSources, stop };
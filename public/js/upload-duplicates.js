@@ -47,7 +47,9 @@ async function checkTitleDuplicates(title) {
     }
 
     try {
-        const response = await fetch(`/api/check-duplicate-title?title=${encodeURIComponent(title)}`);
+        // Si ya hay autores, el servidor busca también el título con ellos (en la misma petición)
+        const authorsString = getAuthorsString();
+        const response = await fetch(`/api/check-duplicate-title?title=${encodeURIComponent(title)}${authorsString ? `&authors=${encodeURIComponent(authorsString)}` : ''}`);
         const data = await response.json();
 
         if (data.duplicado && data.fuentes?.length > 0) {
@@ -1,7 +1,8 @@
 const { type } = require('os');
 const IsRegistered = require('../../middlewares/auth');
 const checkRoles = require('../../middlewares/checkrole');
-const { spawn } = require('child_process');
+const tfidfSearch = require('../../lib/tfidf_search');
+const duplicateChecker = require('../../lib/duplicate_checker');
 const debugging = global.debugging;
 
 //Alias de middlewares
@@ -22,6 +23,9 @@ function htmlUnescape(s) {
 
 // In-memory cache for related sources (key: sourceId, value: { expires: timestamp, data: [...] })
 const relatedSourcesCache = new Map();
+// Vecinos por similitud de términos que se piden al servidor de búsqueda cuando la fuente
+// aún no tiene los precalculados en related_sources
+const RELATED_TERM_CANDIDATES = 200;
 
 module.exports = function (app) {
 
@@ -126,6 +130,9 @@ module.exports = function (app) {
 
             let results = [];
             let totalResults = 0;
+            let facets = null;
+            // Cursor del ranking guardado en el servidor TF-IDF (enlaces de paginación)
+            let resultsCursor = null;
 
             if (!query || query.trim().length === 0) {
                 // No query: return recent sources optionally filtered by type/category/subcategory/year/rating
@@ -196,19 +203,63 @@ module.exports = function (app) {
                     };
                 });
             } else {
-                // Call Python TF-IDF search
+                // Call Python TF-IDF search; los filtros se aplican dentro del motor para que
+                // el top devuelto ya sea el de después de filtrar (el SQL de abajo los repite
+                // por si la valoración de alguna fuente cambió desde la última recarga del índice)
+                const tfidfFilters = { is_active: true };
+                if (sourceTypeId) tfidfFilters.source_type_id = sourceTypeId;
+                if (selectedCategories.length) tfidfFilters.category_id = selectedCategories;
+                if (selectedSubcategories.length) tfidfFilters.subcategory_id = selectedSubcategories;
+                if (yearFromParam) tfidfFilters.year_from = yearFromParam;
+                if (yearToParam) tfidfFilters.year_to = yearToParam;
+                if (ratingMin !== null && !Number.isNaN(ratingMin)) tfidfFilters.rating_min = ratingMin;
+                if (ratingMax !== null && !Number.isNaN(ratingMax)) tfidfFilters.rating_max = ratingMax;
+
+                // UMBRAL DE SIMILITUD (AJUSTAR ESTO)
+                const MIN_SIMILARITY = 0.1;
+                // Resultados que se reordenan en Node con otro orden o con el ajuste académico
+                const RERANK_DEPTH = 100;
+
+                const currentUserId = req.session && req.session.userId ? req.session.userId : (res.locals.user && res.locals.user.id ? res.locals.user.id : null);
+                // Allow a test override when debugging: ?testAcademic=Licenciatura
+                const testAcademicOverride = debugging && req.query.testAcademic ? String(req.query.testAcademic).trim() : null;
+                const relevanceOrder = !selectedSort || selectedSort === '' || selectedSort === 'relevance';
+                const academicRerank = academicAdjustmentFlag && (currentUserId || testAcademicOverride) && relevanceOrder;
+
+                // El motor devuelve también los conteos de facetas (categoría, subcategoría,
+                // tipo y década) de todas las fuentes que superan el umbral, no solo del top
                 let pyResults = [];
+                let paged = null;
                 try {
-                    pyResults = await searchWithPython(query);
-                    pyResults = await searchWithPython(query);
+                    if (relevanceOrder && !academicRerank) {
+                        // Orden de relevancia: el servidor guarda el ranking (con sus facetas) y
+                        // sirve cada página; los enlaces de paginación llevan su cursor
+                        const pageCursor = req.query.cursor ? String(req.query.cursor) : null;
+                        const pageOptions = { hydrate: true, page: Math.max(1, page), facets: true, minScore: MIN_SIMILARITY };
+                        try {
+                            paged = await tfidfSearch.searchPage(query, perPage, tfidfFilters, pageCursor, pageOptions);
+                        } catch (e) {
+                            if (!pageCursor) throw e;
+                            // cursor caducado o no válido: se vuelve a puntuar la consulta
+                            paged = await tfidfSearch.searchPage(query, perPage, tfidfFilters, null, pageOptions);
+                        }
+                        pyResults = paged.results;
+                        facets = paged.facets;
+                        totalResults = paged.total;
+                        resultsCursor = paged.cursor;
+                    } else {
+                        const found = await tfidfSearch.searchFacets(query, RERANK_DEPTH, tfidfFilters, { minScore: MIN_SIMILARITY, hydrate: true });
+                        pyResults = found.results;
+                        facets = found.facets;
+                    }
                     if (debugging) console.log(`Top 5 scores: ${pyResults.slice(0, 5).map(r => r.score)}`);
                 } catch (e) {
                     console.error('Error calling TF-IDF search.py:', e);
                     pyResults = [];
+                    paged = null;
+                    totalResults = 0;
+                    resultsCursor = null;
                 }
-
-                // UMBRAL DE SIMILITUD (AJUSTAR ESTO)
-                const MIN_SIMILARITY = 0.1;
                 pyResults = pyResults.filter(r => r.score >= MIN_SIMILARITY);
 
                 // pyResults expected to be [{source_id: <int>, score: <float>}, ...]
@@ -241,18 +292,10 @@ module.exports = function (app) {
                             const rid = item.source_id;
                             const row = rowMap.get(rid);
                             if (!row) continue; // skip filtered-out or missing
-                            const authorsRows = db.prepare('SELECT a.full_name FROM authors a JOIN source_authors sa ON a.id = sa.author_id WHERE sa.source_id = ? ORDER BY sa.sort_order').all(row.id);
-                            const authors = authorsRows.map(a => a.full_name);
                             const keywords = row.keywords ? String(row.keywords).split(',').map(k => k.trim()).filter(Boolean) : [];
 
-                            // uploader info
-                            let uploader = { id: null, name: 'Usuario' };
-                            try {
-                                if (row.uploaded_by) {
-                                    const u = db.prepare('SELECT id, username, full_name FROM users WHERE id = ? LIMIT 1').get(row.uploaded_by);
-                                    if (u) uploader = { id: u.id, name: u.full_name || u.username || 'Usuario' };
-                                }
-                            } catch (e) { uploader = { id: null, name: 'Usuario' }; }
+                            // autores y uploader: del registro de presentación que devuelve el motor
+                            const { authors, uploader } = resultAuthorsAndUploader(db, item, row);
 
                             const pagesDisplay = row.pages ? row.pages : 'Completo';
                             const ratingAvg = (typeof row.overall_rating !== 'undefined' && row.overall_rating !== null) ? row.overall_rating : 0;
@@ -283,10 +326,7 @@ module.exports = function (app) {
 
                         // Apply alternative sorting if requested (TF-IDF order preserved by default)
                         // If user requested academic adjustment and is authenticated, re-rank top-N
-                        const currentUserId = req.session && req.session.userId ? req.session.userId : (res.locals.user && res.locals.user.id ? res.locals.user.id : null);
-                        // Allow a test override when debugging: ?testAcademic=Licenciatura
-                        const testAcademicOverride = debugging && req.query.testAcademic ? String(req.query.testAcademic).trim() : null;
-                        if (academicAdjustmentFlag && (currentUserId || testAcademicOverride) && (!selectedSort || selectedSort === '' || selectedSort === 'relevance')) {
+                        if (academicRerank) {
                             try {
                                 // Fetch the user's academic level
                                 const userRow = db.prepare('SELECT academic_level FROM users WHERE id = ? LIMIT 1').get(currentUserId);
@@ -344,9 +384,14 @@ module.exports = function (app) {
                             else if (selectedSort === 'difficulty') ordered.sort((a, b) => ((b.rating.avgDifficulty || 0) - (a.rating.avgDifficulty || 0)));
                         }
 
-                        totalResults = ordered.length;
-                        // simple pagination on ordered results
-                        results = ordered.slice((page - 1) * perPage, page * perPage);
+                        if (paged) {
+                            // ya es la página pedida; totalResults es el tamaño del ranking guardado
+                            results = ordered;
+                        } else {
+                            totalResults = ordered.length;
+                            // simple pagination on ordered results
+                            results = ordered.slice((page - 1) * perPage, page * perPage);
+                        }
                     }
                 }
             }
@@ -362,7 +407,8 @@ module.exports = function (app) {
                 ratingCriteria: ratingCriteria,
                 sourceTypes: sourceTypes,
                 results: results,
-                pagination: { currentPage: page, totalPages: Math.max(1, Math.ceil(totalResults / perPage)), totalResults: totalResults }
+                facets: facets,
+                pagination: { currentPage: page, totalPages: Math.max(1, Math.ceil(totalResults / perPage)), totalResults: totalResults, cursor: resultsCursor }
             });
         } catch (err) {
             console.error('Error in /search handler:', err);
@@ -506,8 +552,14 @@ module.exports = function (app) {
                     };
                 });
             } else {
+                const tfidfFilters = { is_active: true };
+                if (sourceTypeId) tfidfFilters.source_type_id = sourceTypeId;
+                if (selectedCategory) tfidfFilters.category_id = selectedCategory;
+                if (selectedSubcategory) tfidfFilters.subcategory_id = selectedSubcategory;
+                if (excludeListId) tfidfFilters.exclude_list = excludeListId;
+
                 let pyResults = [];
-                try { pyResults = await searchWithPython(query); } catch (e) { console.error('TF-IDF error', e); pyResults = []; }
+                try { pyResults = await tfidfSearch.search(query, 20, tfidfFilters, { hydrate: true }); } catch (e) { console.error('TF-IDF error', e); pyResults = []; }
 
                 if (Array.isArray(pyResults) && pyResults.length > 0) {
                     const ids = pyResults.map(r => r.source_id).filter(Boolean);
@@ -532,18 +584,9 @@ module.exports = function (app) {
                             const rid = item.source_id;
                             const row = rowMap.get(rid);
                             if (!row) continue;
-                            const authorsRows = db.prepare('SELECT a.full_name FROM authors a JOIN source_authors sa ON a.id = sa.author_id WHERE sa.source_id = ? ORDER BY sa.sort_order').all(row.id);
-                            const authors = authorsRows.map(a => a.full_name);
+                            const { authors, uploader } = resultAuthorsAndUploader(db, item, row);
                             const keywords = row.keywords ? String(row.keywords).split(',').map(k => k.trim()).filter(Boolean) : [];
 
-                            let uploader = { id: null, name: 'Usuario' };
-                            try {
-                                if (row.uploaded_by) {
-                                    const u = db.prepare('SELECT id, username, full_name FROM users WHERE id = ? LIMIT 1').get(row.uploaded_by);
-                                    if (u) uploader = { id: u.id, name: u.full_name || u.username || 'Usuario' };
-                                }
-                            } catch (e) { uploader = { id: null, name: 'Usuario' }; }
-
                             ordered.push({
                                 id: row.id,
                                 title: row.title,
@@ -810,7 +853,7 @@ module.exports = function (app) {
     });
 
     // API: related sources for a given source id
-    app.get('/api/sources/:id/related', (req, res) => { 
+    app.get('/api/sources/:id/related', async (req, res) => { 
         if (req.headers.accept && req.headers.accept.includes('text/html')) {
             return res.status(403).json({ success: false, message: 'forbidden' });
         }
@@ -844,35 +887,17 @@ module.exports = function (app) {
             const readsCurrentRow = db.prepare('SELECT COUNT(DISTINCT user_id) as c FROM user_readings WHERE source_id = ? AND status = ?').get(sourceId, 'read');
             const readsCurrent = (readsCurrentRow && readsCurrentRow.c) ? readsCurrentRow.c : 0;
 
-            // term similarity via tfidf_vectors/source_norms
-            let normQ = 0;
-            const nrow = db.prepare('SELECT norm FROM source_norms WHERE source_id = ?').get(sourceId);
-            if (nrow && nrow.norm) normQ = nrow.norm;
-            else {
-                const srow = db.prepare('SELECT SUM(weight*weight) as s FROM tfidf_vectors WHERE source_id = ?').get(sourceId);
-                normQ = (srow && srow.s) ? Math.sqrt(srow.s) : 0;
-            }
-
-            const termSimRows = db.prepare(`
-                SELECT v2.source_id AS other_id, SUM(v1.weight * v2.weight) AS dot, n2.norm AS norm2
-                FROM tfidf_vectors v1
-                JOIN tfidf_vectors v2 ON v1.term = v2.term AND v1.source_id = ? AND v2.source_id != ?
-                JOIN source_norms n2 ON v2.source_id = n2.source_id
-                GROUP BY v2.source_id
-            `).all(sourceId, sourceId);
-
+            // term similarity: vecinos precalculados (related_sources, tf-idf/related_sources.py);
+            // si la fuente aún no los tiene, el servidor de búsqueda los calcula con su vector
+            // guardado como consulta (search_by_source)
             const termSimMap = new Map();
-            if (Array.isArray(termSimRows)) {
-                termSimRows.forEach(r => {
-                    const norm2 = r.norm2 || 0;
-                    const dot = r.dot || 0;
-                    let sim = 0;
-                    if (normQ > 0 && norm2 > 0) sim = dot / (normQ * norm2);
-                    if (!isFinite(sim) || sim < 0) sim = 0;
-                    if (sim > 1) sim = 1;
-                    termSimMap.set(r.other_id, sim);
-                });
-            }
+            const precomputedRows = db.prepare('SELECT related_source_id AS other_id, similarity_score AS sim FROM related_sources WHERE source_id = ?').all(sourceId);
+            const termSimRows = precomputedRows.length > 0
+                ? precomputedRows
+                : (await tfidfSearch.searchBySource(sourceId, RELATED_TERM_CANDIDATES)
+                    .catch(e => { console.error('TF-IDF error', e); return []; }))
+                    .map(r => ({ other_id: r.source_id, sim: r.score }));
+            termSimRows.forEach(r => termSimMap.set(r.other_id, Math.max(0, Math.min(1, r.sim || 0))));
 
             // Author common counts
             const authorCommonRows = db.prepare(`
@@ -1015,6 +1040,8 @@ module.exports = function (app) {
         if (!title || title.length < 3) {
             return res.json({ duplicado: false, fuentes: [] });
         }
+        // Autores (opcional, separados por ';') si el formulario ya los tiene
+        const autoresArray = String(req.query.authors || '').split(';').map(a => a.trim()).filter(a => a.length > 0);
 
         // Usar la base de datos desde req (inyectada por middleware)
         const db = req.db;
@@ -1024,8 +1051,8 @@ module.exports = function (app) {
         }
 
         try {
-            // Usar el sistema TF-IDF ya implementado (llama a Python)
-            const results = await searchWithPython(title);
+            // Título y sus variantes con autores en una sola petición al servidor TF-IDF
+            const results = await searchTitleVariants(title, autoresArray);
 
             // Filtrar por similitud > 0.3 (ajustable)
             const similares = results.filter(r => r.score > 0.3);
@@ -1102,8 +1129,8 @@ module.exports = function (app) {
         }
 
         try {
-            // 1. Primero buscar títulos similares con TF-IDF
-            const similares = await searchWithPython(title);
+            // 1. Primero buscar títulos similares con TF-IDF (título y título + autores, en un lote)
+            const similares = await searchTitleVariants(title, autoresArray);
             const titulosSimilares = similares.filter(r => r.score > 0.3);
 
             if (titulosSimilares.length === 0) {
@@ -1178,37 +1205,8 @@ module.exports = function (app) {
         }
 
         try {
-            // Buscar fuentes con título y edición exactos (tabla 'sources')
-            const posibles = await db.prepare(`
-                SELECT s.id, s.title, s.edition
-                FROM sources s
-                WHERE s.title = ? AND s.edition = ?
-            `).all(title, edition);
-
-            if (posibles.length === 0) {
-                return res.json({ duplicado: false });
-            }
-
-            // Para cada posible, obtener sus autores y comparar
-            let fuenteEncontrada = null;
-            for (let p of posibles) {
-                const autoresFuente = await db.prepare(`
-                    SELECT a.full_name
-                    FROM authors a
-                    JOIN source_authors sa ON a.id = sa.author_id
-                    WHERE sa.source_id = ?
-                `).all(p.id);
-
-                const nombresAutores = autoresFuente.map(a => a.full_name).sort();
-                const autoresBuscados = [...autoresArray].sort(); // copia ordenada
-
-                // Comparar conjuntos de autores (misma longitud y mismos nombres)
-                if (nombresAutores.length === autoresBuscados.length &&
-                    nombresAutores.every((val, idx) => val === autoresBuscados[idx])) {
-                    fuenteEncontrada = p;
-                    break;
-                }
-            }
+            // Una búsqueda en el índice de huellas (título + autores + edición normalizados)
+            const fuenteEncontrada = duplicateChecker.findExactDuplicates(db, title, autoresArray, edition)[0];
 
             if (!fuenteEncontrada) {
                 return res.json({ duplicado: false });
@@ -1235,31 +1233,41 @@ module.exports = function (app) {
 };
 
 
-// Función para buscar
-function searchWithPython(query) {
-    return new Promise((resolve, reject) => {
-        try {
-            const args = ['tf-idf/search.py', query];
-            const py = spawn('python3', args, { cwd: process.cwd() });
-            let output = '';
-            let errOutput = '';
-            py.stdout.on('data', (data) => { output += data.toString(); });
-            py.stderr.on('data', (data) => { errOutput += data.toString(); console.error(`Python error: ${data}`); });
-            py.on('close', (code) => {
-                if (code === 0) {
-                    try {
-                        const results = JSON.parse(output);
-                        resolve(results);
-                    } catch (e) {
-                        reject(e);
-                    }
-                } else {
-                    reject(new Error(`Python exited with code ${code}: ${errOutput}`));
-                }
-            });
-            py.on('error', (err) => reject(err));
-        } catch (e) {
-            reject(e);
+// Autores (en orden) y uploader de un resultado TF-IDF: salen del registro de presentación
+// que el motor adjunta con { hydrate: true } (tabla source_display); solo se consultan en la
+// base si la fuente todavía no tiene registro.
+function resultAuthorsAndUploader(db, item, row) {
+    let uploader = { id: null, name: 'Usuario' };
+    const display = item.display;
+    if (display) {
+        if (display.uploader_id && display.uploader) uploader = { id: display.uploader_id, name: display.uploader };
+        return { authors: display.authors || [], uploader };
+    }
+    const authorsRows = db.prepare('SELECT a.full_name FROM authors a JOIN source_authors sa ON a.id = sa.author_id WHERE sa.source_id = ? ORDER BY sa.sort_order').all(row.id);
+    try {
+        if (row.uploaded_by) {
+            const u = db.prepare('SELECT id, username, full_name FROM users WHERE id = ? LIMIT 1').get(row.uploaded_by);
+            if (u) uploader = { id: u.id, name: u.full_name || u.username || 'Usuario' };
         }
-    });
+    } catch (e) { uploader = { id: null, name: 'Usuario' }; }
+    return { authors: authorsRows.map(a => a.full_name), uploader };
+}
+
+// Candidatos a duplicado de un título (servidor TF-IDF residente, ver lib/tfidf_search.js):
+// el título, el título con todos los autores y el título con cada autor van en una sola
+// petición search_batch, puntuados en una pasada; de cada fuente se queda la mejor puntuación.
+async function searchTitleVariants(title, authors = [], topK = 20) {
+    const variants = [title];
+    if (authors.length) {
+        variants.push(`${title} ${authors.join(' ')}`);
+        if (authors.length > 1) authors.forEach(a => variants.push(`${title} ${a}`));
+    }
+    const lists = await tfidfSearch.searchBatch(variants, topK);
+    const best = new Map();
+    lists.forEach(list => list.forEach(r => {
+        if (!best.has(r.source_id) || best.get(r.source_id) < r.score) best.set(r.source_id, r.score);
+    }));
+    return [...best]
+        .map(([source_id, score]) => ({ source_id, score }))
+        .sort((a, b) => (b.score - a.score) || (a.source_id - b.source_id));
 }
\ No newline at end of file
@@ -11,6 +11,7 @@ const { getVerificationKey } = require('../../lib/encryption_key');
 const urlChecker = require('../../lib/url_checker');
 const offensiveChecker = require('../../lib/offensive_checker');
 const duplicateChecker = require('../../lib/duplicate_checker');
+const tfidfSearch = require('../../lib/tfidf_search');
 
 module.exports = function(app) {
     // helper: ensure optional columns exist (best-effort)
@@ -38,7 +39,7 @@ module.exports = function(app) {
         }
     }
     // Merge selected sources into a base source
-    app.post('/api/admin/compare/merge', soloAdmin, (req, res) => {
+    app.post('/api/admin/compare/merge', soloAdmin, async (req, res) => {
         const db = req.db;
         try {
             const body = req.body || {};
@@ -148,10 +149,10 @@ module.exports = function(app) {
                     db.prepare('DELETE FROM source_authors WHERE source_id = ?').run(mergeId);
                 });
 
-                // Physically delete merged sources (hard delete)
+                // Deactivate merged sources; they are physically deleted once out of the TF-IDF index
                 if (mergeIds.length) {
                     const placeholders = mergeIds.map(() => '?').join(',');
-                    db.prepare(`DELETE FROM sources WHERE id IN (${placeholders})`).run(...mergeIds);
+                    db.prepare(`UPDATE sources SET is_active = 0, updated_at = datetime('now') WHERE id IN (${placeholders})`).run(...mergeIds);
                 }
 
                 // Recompute aggregates for the base source (total_ratings and per-criteria averages)
@@ -181,6 +182,13 @@ module.exports = function(app) {
             // execute transaction
             tx();
 
+            // Retirar del índice TF-IDF solo con la fusión ya confirmada, y borrar
+            // después: el ON DELETE CASCADE se llevaría los vectores que lee unindex
+            await tfidfSearch.unindexSources(mergeIds).catch(err => console.error('Error retirando fuentes del índice TF-IDF:', err));
+            // Physically delete merged sources (hard delete)
+            const mergePlaceholders = mergeIds.map(() => '?').join(',');
+            db.prepare(`DELETE FROM sources WHERE id IN (${mergePlaceholders})`).run(...mergeIds);
+
             // Emit real-time notifications to affected owners about the merge (if connected)
             try {
                 const io = req.app && req.app.get && req.app.get('io');
@@ -386,7 +394,11 @@ module.exports = function(app) {
 
             // Execute action
             if (action === 'delete_source' && report.source_id) {
+                // La desactivación es definitiva: ninguna ruta vuelve a poner is_active = 1.
+                // Si se reactiva una fuente, hay que reindexarla (index_source.py); si no,
+                // recalc_idf.py --check la cuenta como activa sin indexar y el cron reindexa
                 db.prepare("UPDATE sources SET is_active = 0, updated_at = datetime('now') WHERE id = ?").run(report.source_id);
+                tfidfSearch.unindexSources([report.source_id]).catch(err => console.error('Error retirando la fuente del índice TF-IDF:', err));
                 // notify uploader
                 const s = db.prepare('SELECT uploaded_by FROM sources WHERE id = ?').get(report.source_id) || {};
                 const uploaderId = s.uploaded_by;
@@ -4,6 +4,8 @@ const IsRegistered = require('../../middlewares/auth');
 const checkRoles = require('../../middlewares/checkrole');
 const soloValidado = checkRoles(['validado', 'admin']);
 const { exec, spawn } = require('child_process');
+const tfidfSearch = require('../../lib/tfidf_search');
+const duplicateChecker = require('../../lib/duplicate_checker');
 const fs = require('fs').promises;
 const util = require('util');
 const execPromise = util.promisify(exec);
@@ -228,7 +230,10 @@ module.exports = function (app) {
           // use keywordsText computed earlier in this scope
           try {
             indexSourceInPython(fuenteId, coverMetadata.titulo, coverMetadata.autores.join(', '), keywordsText || '')
-              .then(() => console.log(`Fuente ${fuenteId} indexada (background)`))
+              .then(result => {
+                console.log(`Fuente ${fuenteId} indexada (background)`);
+                duplicateChecker.alertNearDuplicates(req.db, fuenteId, result && result.near_duplicates);
+              })
               .catch(err => console.error(`Error indexando fuente ${fuenteId} (background):`, err));
           } catch (e) {
             console.error('Error programando indexacion TF-IDF:', e);
@@ -241,7 +246,10 @@ module.exports = function (app) {
       }
 
       indexSourceInPython(sourceId, req.body.titulo, req.body.autores.join(', '), req.body.palabras_clave)
-        .then(() => console.log(`Fuente ${sourceId} indexada`))
+        .then(result => {
+          console.log(`Fuente ${sourceId} indexada`);
+          duplicateChecker.alertNearDuplicates(req.db, sourceId, result && result.near_duplicates);
+        })
         .catch(err => console.error('Error indexando:', err));
     } catch (err) {
       console.error('Error in POST /upload', err);
@@ -462,7 +470,7 @@ module.exports = function (app) {
   });
 
   // Allow uploader (owner) or admin to permanently delete a source and cascade related rows
-  app.post('/api/sources/:id/delete', IsRegistered, (req, res) => {
+  app.post('/api/sources/:id/delete', IsRegistered, async (req, res) => {
     try {
       const db = req.db;
       const sourceId = parseInt(req.params.id, 10);
@@ -479,6 +487,12 @@ module.exports = function (app) {
         return res.status(403).json({ success: false, message: 'forbidden' });
       }
 
+      // Desactivar, retirar del índice TF-IDF y solo después borrar: el cascade se
+      // llevaría los vectores que lee unindex. Si el borrado falla, la fuente queda
+      // desactivada y fuera del índice, no activa y sin indexar
+      db.prepare("UPDATE sources SET is_active = 0, updated_at = datetime('now') WHERE id = ?").run(sourceId);
+      await tfidfSearch.unindexSources([sourceId]).catch(err => console.error('Error retirando la fuente del índice TF-IDF:', err));
+
       // Perform a transactional delete so all dependent rows are removed and aggregates updated
       try {
         const tx = db.transaction(() => {
@@ -1138,6 +1152,8 @@ function indexSourceInPython(sourceId, title, authors, keywords) {
         if (code === 0) {
           try {
             const parsed = output ? JSON.parse(output) : { status: 'ok' };
+            // El servidor de búsqueda residente debe ver la fuente recién indexada
+            tfidfSearch.reload().catch(err => console.error('Error recargando índice TF-IDF:', err));
             resolve(parsed);
           } catch (e) {
             // If output is not JSON, still resolve with raw output
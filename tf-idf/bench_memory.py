@@ -0,0 +1,116 @@
+"""Benchmark de memoria del índice residente con un corpus sintético.
+
+Compara, para el mismo corpus, los bytes que retiene cada representación:
+
+  documents   {source_id: {'norm': ..., 'vector': {término: peso}}}: un dict por
+              fuente y un float de Python por posting
+  lists       término -> ([source_id, ...], [peso, ...]) más la cota por
+              término (el motor 'inverted' antes de postings_index.py)
+  inverted    postings_index.InvertedIndex: arrays por posting y por término
+
+El corpus tiene --terms-per-source postings por fuente de media, un vocabulario
+que crece como sqrt(fuentes) (ley de Heaps) y frecuencias de documento de Zipf.
+Las listas se generan término a término con una semilla fija, así que las tres
+representaciones se construyen con los mismos postings y solo se mide lo que
+queda retenido (tracemalloc, sin contar el generador).
+
+Uso: python3 tf-idf/bench_memory.py [--sources 100000 1000000] [--terms-per-source 8]
+"""
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+from postings_index import InvertedIndex
+
+LAYOUTS = ('documents', 'lists', 'inverted')
+
+
+def vocabulary_size(n_sources):
+    return max(100, int(60 * n_sources ** 0.5))
+
+
+def synthetic_postings(n_sources, terms_per_source, seed=0):
+    """(término, [source_id, ...], [peso, ...]) por término, ids ordenados."""
+    rng = random.Random(seed)
+    n_terms = vocabulary_size(n_sources)
+    harmonic = sum(1 / rank for rank in range(1, n_terms + 1))
+    total = n_sources * terms_per_source
+    for rank in range(1, n_terms + 1):
+        df = min(n_sources, max(1, round(total / (rank * harmonic))))
+        source_ids = sorted(rng.sample(range(n_sources), df))
+        yield f't{rank}', source_ids, [rng.random() for _ in source_ids]
+
+
+def build(layout, n_sources, terms_per_source):
+    postings = synthetic_postings(n_sources, terms_per_source)
+    if layout == 'documents':
+        documents = {}
+        for term, source_ids, weights in postings:
+            for source_id, weight in zip(source_ids, weights):
+                document = documents.get(source_id)
+                if document is None:
+                    document = documents[source_id] = {'norm': 1.0, 'vector': {}}
+                document['vector'][term] = weight
+        return documents
+    if layout == 'lists':
+        lists = {term: (source_ids, weights) for term, source_ids, weights in postings}
+        max_weight = {term: max(weights) for term, (_, weights) in lists.items()}
+        return lists, max_weight
+    idf = {}
+    rows = ((term, source_id, weight)
+            for term, source_ids, weights in postings if idf.setdefault(term, 1.0)
+            for source_id, weight in zip(source_ids, weights))
+    return InvertedIndex.from_rows(idf, rows, n_sources)
+
+
+def measure(layout, n_sources, terms_per_source):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    index = build(layout, n_sources, terms_per_source)
+    seconds = time.perf_counter() - started
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    if layout == 'documents':
+        n_postings = sum(len(document['vector']) for document in index.values())
+    elif layout == 'lists':
+        n_postings = sum(len(source_ids) for source_ids, _ in index[0].values())
+    else:
+        n_postings = index.n_postings
+    out = {'bytes': retained, 'postings': n_postings,
+           'bytes_per_posting': round(retained / n_postings, 1),
+           'build_s': round(seconds, 2)}
+    if layout == 'inverted':
+        # el resto es el diccionario término -> term_id
+        out['array_bytes_per_posting'] = round(index.nbytes() / n_postings, 1)
+    del index
+    gc.collect()
+    return out
+
+
+def run(sizes, terms_per_source):
+    out = []
+    for n_sources in sizes:
+        result = {'sources': n_sources, 'terms': vocabulary_size(n_sources)}
+        for layout in LAYOUTS:
+            result[layout] = measure(layout, n_sources, terms_per_source)
+            print(f'{n_sources} fuentes, {layout}: {result[layout]}', file=sys.stderr)
+        compact = result['inverted']['bytes_per_posting']
+        result['ratio_documents'] = round(result['documents']['bytes_per_posting'] / compact, 1)
+        result['ratio_lists'] = round(result['lists']['bytes_per_posting'] / compact, 1)
+        out.append(result)
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memoria por posting de las representaciones del índice')
+    parser.add_argument('--sources', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--terms-per-source', type=int, default=8)
+    args = parser.parse_args()
+    print(json.dumps(run(args.sources, args.terms_per_source), ensure_ascii=False))
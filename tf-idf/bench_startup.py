@@ -0,0 +1,107 @@
+"""Benchmark del arranque en frío de los scripts que Node lanza por petición
+(index_source.py, search.py, unindex_source.py).
+
+Cada medición es un proceso nuevo que importa el módulo y preprocesa una
+consulta con palabras del léxico de arranque (preprocess.LEXICON_PATH), o solo
+con stopwords si aún no hay léxico; se toma la mediana de --runs ejecuciones. Sale con código 1 si alguna mediana
+supera --max-ms o si el arranque llega a importar módulos pesados (nltk,
+numpy), de modo que una importación nueva en el camino caliente se detecta
+como regresión. Con --compare mide también el arranque sin léxico (NLTK completo).
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import time
+
+import preprocess
+
+ENTRY_POINTS = ('index_source', 'search', 'unindex_source')
+HEAVY_MODULES = ('nltk', 'numpy')
+DEFAULT_MAX_MS = 120.0
+
+CHILD = '''
+import sys, time
+started = time.perf_counter()
+import {module}
+from preprocess import preprocess
+preprocess({query!r})
+elapsed = time.perf_counter() - started
+import json
+print(json.dumps({{'ms': elapsed * 1000, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def sample_query(path):
+    """Consulta con palabras que el léxico ya conoce (el arranque no debe
+    necesitar el stemmer) y si el léxico existe. Sin él (antes del primer
+    recalc_idf.py), solo stopwords, que preprocess conoce sin NLTK."""
+    if not os.path.exists(path):
+        return 'De la que los para nosotros', False
+    with open(path, encoding='utf-8') as f:
+        words = json.load(f)['words'].split()
+    if not words:
+        raise ValueError('el léxico no tiene palabras')
+    return 'de ' + ' '.join(words[:4]).title(), True
+
+
+def measure(module, query, runs, env):
+    script = CHILD.format(module=module, query=query, heavy=HEAVY_MODULES)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    samples, wall, heavy = [], [], set()
+    for _ in range(runs + 1):
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', script], cwd=cwd, env=env,
+                             capture_output=True, text=True, check=True)
+        wall.append((time.perf_counter() - started) * 1000)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result['ms'])
+        heavy.update(result['heavy'])
+    # la primera ejecución solo calienta la caché de disco y los .pyc
+    return {
+        'import_ms': round(statistics.median(samples[1:]), 1),
+        'process_ms': round(statistics.median(wall[1:]), 1),
+        'heavy_modules': sorted(heavy),
+    }
+
+
+def run_benchmark(runs=5, max_ms=DEFAULT_MAX_MS, compare=False, lexicon=None):
+    lexicon = lexicon or preprocess.LEXICON_PATH
+    env = dict(os.environ, TFIDF_LEXICON=lexicon)
+    query, found = sample_query(lexicon)
+    report = {'lexicon': lexicon, 'lexicon_found': found, 'query': query, 'max_ms': max_ms, 'entry_points': {}}
+    failures = []
+    for module in ENTRY_POINTS:
+        result = measure(module, query, runs, env)
+        if compare:
+            # sin léxico válido preprocess usa NLTK para todas las raíces
+            no_lexicon = dict(env, TFIDF_LEXICON=os.devnull)
+            result['nltk_import_ms'] = measure(module, query, runs, no_lexicon)['import_ms']
+        report['entry_points'][module] = result
+        if result['heavy_modules']:
+            failures.append(f"{module}: importa {', '.join(result['heavy_modules'])}")
+        if result['import_ms'] > max_ms:
+            failures.append(f"{module}: {result['import_ms']} ms > {max_ms} ms")
+    report['failures'] = failures
+    report['ok'] = not failures
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark del arranque de los scripts TF-IDF')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=DEFAULT_MAX_MS,
+                        help='presupuesto de importación + primer preprocesado por script')
+    parser.add_argument('--compare', action='store_true',
+                        help='medir también el arranque sin léxico (NLTK completo)')
+    parser.add_argument('--lexicon', default=None, help='léxico a usar (por defecto TFIDF_LEXICON)')
+    args = parser.parse_args()
+    try:
+        report = run_benchmark(max(1, args.runs), args.max_ms, args.compare, args.lexicon)
+    except (OSError, ValueError, KeyError) as e:
+        print(f'Léxico de arranque no disponible ({e}); genéralo con recalc_idf.py', file=sys.stderr)
+        sys.exit(2)
+    print(json.dumps(report, ensure_ascii=False))
+    sys.exit(0 if report['ok'] else 1)
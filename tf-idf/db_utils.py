@@ -1,8 +1,217 @@
 import os
+import re
+import json
+import math
 import sqlite3
 
 # Use an absolute path relative to this file so scripts run from different CWD still find the DB
 DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'database', 'articora.db'))
+# Instantánea mmap del índice que genera recalc_idf.py (ver index_snapshot.py)
+SNAPSHOT_PATH = os.path.join(os.path.dirname(DB_PATH), 'tfidf_index.bin')
+
+# El esquema está en database/init.sql. Las tablas, vistas, triggers e índices
+# del módulo TF-IDF que le falten a una base creada con un init.sql anterior los
+# crea ensure_schema() desde ese mismo fichero, al arrancar la aplicación
+# (lib/database.js: python3 tf-idf/db_utils.py) o al reindexar (recalc_idf.py).
+INIT_SQL_PATH = os.path.join(os.path.dirname(DB_PATH), 'init.sql')
+INIT_SQL_SECTION = ('-- MODULE 9: TF-IDF AND SEARCH', '-- MODULE 10:')
+GENERATION_INDEX = re.compile(r'idx_\w+_g\d+_')
+CREATE_RE = re.compile(r'CREATE\s+(TABLE|INDEX|VIEW|TRIGGER)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)(?:\s+ON\s+(\w+))?', re.I)
+# Contadores de tfidf_meta que init.sql siembra en una base nueva
+SEED_SQL = (
+    "INSERT OR IGNORE INTO tfidf_meta (key, value) VALUES ('generation', 0)",
+    "INSERT OR IGNORE INTO tfidf_meta (key, value) SELECT 'total_docs', COUNT(*) FROM source_norms",
+)
+
+# Tablas del índice que se reconstruyen como generación nueva (recalc_idf.py).
+# {suffix} es '_next' mientras se construyen; los índices secundarios llevan el
+# número de generación porque SQLite no los renombra junto con su tabla.
+INDEX_TABLES = ('global_idf', 'tfidf_terms', 'tfidf_postings', 'source_norms', 'term_max_weights')
+# Postings con el término como entero (diccionario tfidf_terms) y solo la
+# frecuencia del término: el IDF está en global_idf y tf / norm no depende de la
+# escala del tf de cada fuente, así que se guarda el número de apariciones.
+POSTINGS_SQL = '''
+CREATE TABLE tfidf_terms{suffix} (
+    term_id INTEGER PRIMARY KEY,
+    term VARCHAR(100) NOT NULL UNIQUE
+);
+CREATE TABLE tfidf_postings{suffix} (
+    term_id INTEGER NOT NULL,
+    source_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term_id, source_id),
+    FOREIGN KEY (source_id) REFERENCES sources(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX idx_postings_g{generation}_source ON tfidf_postings{suffix}(source_id);
+'''
+GENERATION_SQL = '''
+CREATE TABLE global_idf{suffix} (
+    term VARCHAR(100) PRIMARY KEY,
+    idf REAL NOT NULL,
+    doc_freq INTEGER NOT NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+''' + POSTINGS_SQL + '''
+CREATE TABLE source_norms{suffix} (
+    source_id INTEGER PRIMARY KEY,
+    norm REAL NOT NULL,
+    FOREIGN KEY (source_id) REFERENCES sources(id) ON DELETE CASCADE
+);
+CREATE TABLE term_max_weights{suffix} (
+    term VARCHAR(100) PRIMARY KEY,
+    max_weight REAL NOT NULL
+);
+'''
 
 def get_db():
-    return sqlite3.connect(DB_PATH)
\ No newline at end of file
+    return sqlite3.connect(DB_PATH)
+
+def schema_statements(path=INIT_SQL_PATH):
+    """Sentencias CREATE de la sección TF-IDF de init.sql: (tipo, nombre, tabla
+    del índice o None, sentencia), en el orden del fichero."""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    first, last = INIT_SQL_SECTION
+    text = text[text.index(first):text.index(last)]
+    statements, buffer = [], ''
+    for line in text.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            match = CREATE_RE.search(buffer)
+            if match:
+                kind, name, table = match.groups()
+                statements.append((kind.lower(), name, table, buffer.strip()))
+            buffer = ''
+    return statements
+
+def ensure_schema(db):
+    """Migra una base creada con un init.sql anterior: crea los objetos de la
+    sección TF-IDF de init.sql que no existen y pasa el formato antiguo de
+    postings (tfidf_vectors) al actual. Devuelve los nombres creados."""
+    # Bases con el formato anterior de postings (tfidf_vectors, término en texto)
+    if has_table(db, 'tfidf_vectors') and not has_table(db, 'tfidf_postings'):
+        from migrate_postings import migrate
+        migrate(db)
+    existing = {r[0] for r in db.execute('SELECT name FROM sqlite_master')}
+    created = []
+    for kind, name, table, statement in schema_statements():
+        if name in existing:
+            continue
+        # Los índices de las tablas de cada generación llevan su número
+        # (idx_postings_g<N>_source): solo se crean junto con una tabla nueva.
+        # Los demás también se añaden a tablas que ya existían
+        if kind == 'index' and table not in created and GENERATION_INDEX.match(name):
+            continue
+        db.execute(statement)
+        created.append(name)
+    if 'tfidf_meta' in created:
+        for statement in SEED_SQL:
+            db.execute(statement)
+    # Los triggers solo mantienen los registros a partir de ahora
+    if 'source_display' in created:
+        db.execute('INSERT INTO source_display SELECT * FROM source_display_view')
+    db.commit()
+    return created
+
+def has_table(db, name):
+    return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+def read_meta(db, key, default=0):
+    # Contador de tfidf_meta (default en bases que aún no tienen la tabla o la clave)
+    try:
+        row = db.execute('SELECT value FROM tfidf_meta WHERE key = ?', (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return default
+    return row[0] if row else default
+
+def read_generation(db):
+    # Generación vigente del índice
+    return read_meta(db, 'generation')
+
+def read_change_seq(db):
+    # Último seq asignado en tfidf_changes (AUTOINCREMENT: no retrocede al purgar el registro)
+    try:
+        row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'tfidf_changes'").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+# Reconstrucciones en curso que releerán tfidf_changes a partir de un seq
+# (recalc_idf.py, related_sources.py): build_snapshot no purga el registro más
+# allá del menor de ellos. Una reconstrucción interrumpida deja su marca hasta
+# que la siguiente del mismo tipo la reescribe o la retira.
+CHANGES_HOLD = 'changes_hold_'
+
+def hold_changes(db, name):
+    """Marca el punto de partida de una reconstrucción y lo devuelve: las filas
+    de tfidf_changes con seq mayor se conservan hasta release_changes()."""
+    db.execute(f"""
+        INSERT OR REPLACE INTO tfidf_meta (key, value)
+        SELECT '{CHANGES_HOLD}' || ?, COALESCE(MAX(seq), 0) FROM tfidf_changes
+    """, (name,))
+    seq = read_meta(db, CHANGES_HOLD + name)
+    db.commit()
+    return seq
+
+def release_changes(cursor, name):
+    # Dentro de la transacción del llamante
+    cursor.execute('DELETE FROM tfidf_meta WHERE key = ?', (CHANGES_HOLD + name,))
+
+def purge_limit(cursor, seq):
+    """Mayor seq de tfidf_changes que se puede purgar sin dejar sin datos a una
+    reconstrucción en curso (seq si no hay ninguna)."""
+    cursor.execute('SELECT MIN(value) FROM tfidf_meta WHERE key LIKE ?', (CHANGES_HOLD + '%',))
+    hold = cursor.fetchone()[0]
+    return seq if hold is None else min(seq, hold)
+
+def index_version(db):
+    # Versión del contenido del índice: cambia al reindexar (generación) o al indexar/retirar fuentes
+    return (read_generation(db), read_change_seq(db))
+
+def compute_idf(doc_freq, total_docs):
+    return math.log((total_docs or 1) / (1 + doc_freq))
+
+def fetch_idf(cursor, terms=None, suffix=''):
+    """IDF derivado de los contadores doc_freq y total_docs (todos los términos
+    si terms es None); suffix='_next' lee la generación en construcción."""
+    total_docs = read_meta(cursor, f'total_docs{suffix}')
+    if terms is None:
+        cursor.execute(f'SELECT term, doc_freq FROM global_idf{suffix}')
+    else:
+        unique_terms = sorted(set(terms))
+        if not unique_terms:
+            return {}
+        cursor.execute(f"SELECT term, doc_freq FROM global_idf{suffix} WHERE term IN ({','.join('?' * len(unique_terms))})",
+                       unique_terms)
+    return {term: compute_idf(doc_freq, total_docs) for term, doc_freq in cursor.fetchall()}
+
+def fetch_norm_idf(cursor, terms, suffix=''):
+    """IDF de referencia de las normas (global_idf.idf): el valor con el que se
+    calcularon las normas de las fuentes que contienen el término. Solo cambia
+    al refrescar normas (recalc_idf.refresh_norms) o en un recálculo completo."""
+    unique_terms = sorted(set(terms))
+    if not unique_terms:
+        return {}
+    cursor.execute(f"SELECT term, idf FROM global_idf{suffix} WHERE term IN ({','.join('?' * len(unique_terms))})",
+                   unique_terms)
+    return dict(cursor.fetchall())
+
+def term_ids(cursor, terms, suffix='', create=False):
+    """Término -> term_id del diccionario tfidf_terms; con create=True da id a
+    los términos que aún no lo tienen (el diccionario solo crece dentro de una
+    generación: recalc_idf.py lo reconstruye compacto)."""
+    unique_terms = sorted(set(terms))
+    if not unique_terms:
+        return {}
+    if create:
+        cursor.executemany(f'INSERT OR IGNORE INTO tfidf_terms{suffix} (term) VALUES (?)', [(t,) for t in unique_terms])
+    cursor.execute(f"SELECT term, term_id FROM tfidf_terms{suffix} WHERE term IN ({','.join('?' * len(unique_terms))})",
+                   unique_terms)
+    return dict(cursor.fetchall())
+
+if __name__ == '__main__':
+    # Migración del esquema TF-IDF al arrancar la aplicación (lib/database.js)
+    db = get_db()
+    created = ensure_schema(db)
+    db.close()
+    print(json.dumps({'status': 'ok', 'created': created}))
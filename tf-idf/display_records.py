@@ -0,0 +1,90 @@
+"""Registros de presentación de las fuentes para los resultados de búsqueda.
+
+Cada fuente tiene en `source_display` un JSON compacto con lo que muestra una
+página de resultados: título, autores en orden, año, tipo, quién la subió y su
+valoración (ver la vista source_display_view en database/init.sql). Los
+triggers de la base lo rehacen al cambiar la fuente, sus autores, el nombre de
+un autor o el del usuario que la subió, y también al valorar (overall_rating);
+recalc_idf.py lo reconstruye entero e index_source.py lo refresca al indexar.
+
+El servidor de búsqueda adjunta estos registros a los resultados ("hydrate")
+con una sola consulta por petición, de modo que la ruta no tiene que leer
+autores ni usuarios fuente por fuente.
+
+Uso: python3 tf-idf/display_records.py [--all | SOURCE_ID ...]
+"""
+import sys
+import json
+from db_utils import get_db, ensure_schema
+
+CHUNK_SIZE = 500
+
+
+def refresh_display(db, source_ids):
+    """Rehace los registros de `source_ids` (los de fuentes que ya no existen se borran)."""
+    source_ids = sorted(set(source_ids))
+    for i in range(0, len(source_ids), CHUNK_SIZE):
+        chunk = source_ids[i:i + CHUNK_SIZE]
+        marks = ','.join('?' * len(chunk))
+        db.execute(f'DELETE FROM source_display WHERE source_id IN ({marks})', chunk)
+        db.execute(f'INSERT INTO source_display SELECT * FROM source_display_view WHERE source_id IN ({marks})',
+                   chunk)
+    return len(source_ids)
+
+
+def rebuild_display(db):
+    """Reconstruye todos los registros (reindexado completo)."""
+    db.execute('DELETE FROM source_display')
+    db.execute('INSERT INTO source_display SELECT * FROM source_display_view')
+    return db.execute('SELECT COUNT(*) FROM source_display').fetchone()[0]
+
+
+def fetch_display(db, source_ids):
+    """source_id -> registro (dict) de las fuentes que lo tienen."""
+    source_ids = sorted(set(source_ids))
+    records = {}
+    for i in range(0, len(source_ids), CHUNK_SIZE):
+        chunk = source_ids[i:i + CHUNK_SIZE]
+        rows = db.execute(f"SELECT source_id, record FROM source_display WHERE source_id IN ({','.join('?' * len(chunk))})",
+                          chunk)
+        for source_id, record in rows:
+            records[source_id] = json.loads(record)
+    return records
+
+
+def hydrate_many(result_lists, db=None):
+    """Copia de cada lista de resultados con el registro de cada fuente en
+    'display' (None si la fuente no lo tiene), leídos en una sola pasada. Los
+    resultados originales (que pueden estar en la caché) no se modifican."""
+    ids = {r['source_id'] for results in result_lists for r in results}
+    if not ids:
+        return [list(results) for results in result_lists]
+    own_db = db is None
+    if own_db:
+        db = get_db()
+    try:
+        records = fetch_display(db, ids)
+    finally:
+        if own_db:
+            db.close()
+    return [[dict(r, display=records.get(r['source_id'])) for r in results] for results in result_lists]
+
+
+def hydrate(results, db=None):
+    return hydrate_many([results], db)[0]
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args:
+        print('Uso: display_records.py [--all | SOURCE_ID ...]', file=sys.stderr)
+        sys.exit(2)
+    db = get_db()
+    ensure_schema(db)
+    if args == ['--all']:
+        count = rebuild_display(db)
+    else:
+        count = refresh_display(db, [int(a) for a in args])
+    db.commit()
+    db.close()
+    print(json.dumps({'status': 'ok', 'records': count}))
@@ -0,0 +1,118 @@
+"""Huellas canónicas de las fuentes para detectar duplicados exactos.
+
+La huella de una fuente es un entero de 64 bits con signo: los 8 primeros bytes
+(big-endian) del SHA-256 de
+
+    título normalizado \\x1f autores normalizados, sin repetir y ordenados, unidos por \\x1e \\x1f edición
+
+con la normalización de near_duplicates.normalize_title (minúsculas, sin
+diacríticos ni signos) y la edición como texto ('' si no tiene; si es un
+número, sin ceros a la izquierda). `source_fingerprints` guarda la de cada
+fuente con un índice por huella, así que comprobar si un título + autores +
+edición ya existe es una sola búsqueda en ese índice. lib/duplicate_checker.js
+calcula la misma huella en Node (sourceFingerprint) para la ruta
+/api/check-exact-duplicate: las dos implementaciones tienen que coincidir.
+
+index_source.py y unindex_source.py refrescan la huella de las fuentes que
+tocan y recalc_idf.py rehace la tabla entera.
+
+Uso: python3 tf-idf/fingerprints.py --all
+     python3 tf-idf/fingerprints.py --collisions
+     python3 tf-idf/fingerprints.py --check "Título" "Autor 1; Autor 2" EDICIÓN
+"""
+import sys
+import json
+import hashlib
+from db_utils import get_db, ensure_schema
+from near_duplicates import normalize_title
+
+CHUNK_SIZE = 500
+
+
+def canonical_edition(edition):
+    # Solo dígitos ASCII, como /^[0-9]+$/ en sourceFingerprint: isdigit() también
+    # acepta '²' o '٣', que int() no convierte o que JS no trataría como número
+    text = '' if edition is None else str(edition).strip()
+    return str(int(text)) if text.isascii() and text.isdigit() else text
+
+
+def fingerprint(title, authors, edition):
+    """Huella de un título, una lista de nombres de autor y una edición."""
+    names = sorted({name for name in (normalize_title(a) for a in authors) if name})
+    canonical = '\x1f'.join((normalize_title(title), '\x1e'.join(names), canonical_edition(edition)))
+    return int.from_bytes(hashlib.sha256(canonical.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+def _source_rows(db, source_ids=None):
+    # (id, título, edición, [autores]) de las fuentes pedidas, o de todas
+    if source_ids is None:
+        sources = db.execute('SELECT id, title, edition FROM sources').fetchall()
+        authors = db.execute('''SELECT sa.source_id, a.full_name FROM source_authors sa
+                                JOIN authors a ON a.id = sa.author_id''').fetchall()
+    else:
+        marks = ','.join('?' * len(source_ids))
+        sources = db.execute(f'SELECT id, title, edition FROM sources WHERE id IN ({marks})', source_ids).fetchall()
+        authors = db.execute(f'''SELECT sa.source_id, a.full_name FROM source_authors sa
+                                 JOIN authors a ON a.id = sa.author_id
+                                 WHERE sa.source_id IN ({marks})''', source_ids).fetchall()
+    names = {}
+    for source_id, name in authors:
+        names.setdefault(source_id, []).append(name)
+    return [(source_id, title, edition, names.get(source_id, [])) for source_id, title, edition in sources]
+
+
+def refresh_fingerprints(db, source_ids):
+    """Rehace las huellas de `source_ids` (las de fuentes que ya no existen se borran)."""
+    source_ids = sorted(set(source_ids))
+    for i in range(0, len(source_ids), CHUNK_SIZE):
+        chunk = source_ids[i:i + CHUNK_SIZE]
+        db.execute(f"DELETE FROM source_fingerprints WHERE source_id IN ({','.join('?' * len(chunk))})", chunk)
+        db.executemany('INSERT INTO source_fingerprints (source_id, fingerprint) VALUES (?, ?)',
+                       [(source_id, fingerprint(title, names, edition))
+                        for source_id, title, edition, names in _source_rows(db, chunk)])
+    return len(source_ids)
+
+
+def rebuild_fingerprints(db):
+    """Reconstruye todas las huellas (reindexado completo)."""
+    db.execute('DELETE FROM source_fingerprints')
+    db.executemany('INSERT INTO source_fingerprints (source_id, fingerprint) VALUES (?, ?)',
+                   ((source_id, fingerprint(title, names, edition))
+                    for source_id, title, edition, names in _source_rows(db)))
+    return db.execute('SELECT COUNT(*) FROM source_fingerprints').fetchone()[0]
+
+
+def find_exact(db, title, authors, edition):
+    """Ids de las fuentes con la misma huella que título + autores + edición."""
+    return [r[0] for r in db.execute('SELECT source_id FROM source_fingerprints WHERE fingerprint = ? ORDER BY source_id',
+                                     (fingerprint(title, authors, edition),))]
+
+
+def collisions(db):
+    """Grupos de fuentes que comparten huella, en una pasada por el índice."""
+    groups = []
+    for fp, ids in db.execute('''SELECT fingerprint, GROUP_CONCAT(source_id) FROM source_fingerprints
+                                 GROUP BY fingerprint HAVING COUNT(*) > 1'''):
+        groups.append({'fingerprint': fp, 'source_ids': sorted(int(i) for i in ids.split(','))})
+    groups.sort(key=lambda g: g['source_ids'])
+    return groups
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    db = get_db()
+    ensure_schema(db)
+    if args == ['--all']:
+        out = {'status': 'ok', 'fingerprints': rebuild_fingerprints(db)}
+        db.commit()
+    elif args == ['--collisions']:
+        groups = collisions(db)
+        out = {'groups': groups, 'duplicated_sources': sum(len(g['source_ids']) for g in groups)}
+    elif len(args) == 4 and args[0] == '--check':
+        authors = [a.strip() for a in args[2].split(';') if a.strip()]
+        out = {'source_ids': find_exact(db, args[1], authors, args[3])}
+    else:
+        print('Uso: fingerprints.py --all | --collisions | --check TÍTULO "AUTOR; ..." EDICIÓN', file=sys.stderr)
+        sys.exit(2)
+    db.close()
+    print(json.dumps(out, ensure_ascii=False))
@@ -0,0 +1,235 @@
+"""Instantánea binaria del índice TF-IDF, abierta con mmap.
+
+recalc_idf.py la genera al terminar y los dos motores la abren sin pasar por
+SQLite: el motor numpy como matriz CSR de vistas NumPy (open_index) y el
+inverted como InvertedIndex de vistas memoryview (postings_snapshot.py), en
+ambos casos de cero copias sobre el fichero mapeado, de modo que el arranque
+tarda milisegundos sea cual sea el tamaño del corpus y varios procesos
+comparten la misma copia en la caché de páginas. El formato está en
+snapshot_format.py.
+
+Las fuentes reindexadas después de generar la instantánea (tfidf_changes con
+seq > change_seq) se leen de SQLite y se superponen a la instantánea. El IDF
+de la instantánea se desplaza según el total_docs actual y el de los términos de
+esas fuentes se vuelve a leer. Una instantánea de otra generación del índice
+(tfidf_meta) se rechaza.
+"""
+import os
+import sys
+import math
+import mmap
+import json
+import argparse
+import numpy as np
+from db_utils import get_db, read_generation, read_meta, fetch_idf, purge_limit, SNAPSHOT_PATH
+from sparse_index import SparseIndex
+from snapshot_format import (HEADER, HEADER_SIZE, MAGIC, VERSION, SnapshotError, TermDictionary, SnapshotIdf,
+                             OverlayIdf, layout, map_snapshot, read_header)
+
+
+def _np_layout(header):
+    sections, total = layout(header)
+    return {name: (offset, np.dtype(code), count) for name, (offset, code, count) in sections.items()}, total
+
+
+class OverlayIndex:
+    """Instantánea más las fuentes reindexadas después de generarla.
+
+    Las columnas de la instantánea cuyas fuentes cambiaron se ignoran y esas
+    fuentes se puntúan con un SparseIndex pequeño leído de SQLite.
+    """
+    engine = 'numpy'
+    version = (0, 0)
+
+    def __init__(self, base, delta, masked, idf=None):
+        self.base = base
+        self.delta = delta
+        self.masked = masked
+        self.idf = base.idf if idf is None else idf
+        self.change_seq = base.change_seq
+        self.generation = base.generation
+
+    @property
+    def n_sources(self):
+        return int(self.base.n_sources - np.count_nonzero(self.masked)) + self.delta.n_sources
+
+    @property
+    def attrs(self):
+        return self.base.attrs
+
+    @attrs.setter
+    def attrs(self, attrs):
+        self.base.attrs = attrs
+        self.delta.attrs = attrs
+
+    def score(self, query_vector, top_k=20, filters=None, min_score=0.0, counter=None):
+        results = self.base.score(query_vector, top_k, exclude=self.masked, filters=filters,
+                                  min_score=min_score, counter=counter)
+        results += self.delta.score(query_vector, top_k, filters=filters, min_score=min_score, counter=counter)
+        results.sort(key=lambda r: (-r['score'], r['source_id']))
+        return results[:top_k]
+
+    def score_batch(self, query_vectors, top_k=20, filters=None):
+        merged = []
+        base = self.base.score_batch(query_vectors, top_k, exclude=self.masked, filters=filters)
+        for results, delta in zip(base, self.delta.score_batch(query_vectors, top_k, filters=filters)):
+            results += delta
+            results.sort(key=lambda r: (-r['score'], r['source_id']))
+            merged.append(results[:top_k])
+        return merged
+
+
+def write_snapshot(index, path=SNAPSHOT_PATH, change_seq=0, generation=0, total_docs=0):
+    """Escribe un SparseIndex completo (con los IDF de global_idf) de forma
+    atómica: los lectores que ya tienen mapeada la versión anterior la conservan."""
+    terms = sorted(set(index.idf) | set(index.vocabulary))
+    encoded = [t.encode('utf-8') for t in terms]
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    np.cumsum([len(b) for b in encoded], out=term_offsets[1:])
+    blob = b''.join(encoded)
+
+    # Reordenar filas según el diccionario ordenado (los términos sin postings quedan vacíos)
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    rows = []
+    for i, term in enumerate(terms):
+        row = index.vocabulary.get(term)
+        if row is None:
+            indptr[i + 1] = indptr[i]
+            continue
+        start, end = int(index.indptr[row]), int(index.indptr[row + 1])
+        rows.append((start, end))
+        indptr[i + 1] = indptr[i] + (end - start)
+    if rows:
+        indices = np.concatenate([index.indices[s:e] for s, e in rows]).astype(np.int32)
+        data = np.concatenate([index.data[s:e] for s, e in rows]).astype(np.float32)
+    else:
+        indices = np.zeros(0, dtype=np.int32)
+        data = np.zeros(0, dtype=np.float32)
+    idf = np.array([index.idf.get(t, math.nan) for t in terms], dtype=np.float64)
+    source_ids = np.asarray(index.source_ids, dtype=np.int64)
+    # Para el motor inverted: source_id de cada posting y cota por término
+    posting_ids = source_ids[indices].astype(np.int32)
+    max_weights = np.zeros(len(terms), dtype=np.float32)
+    nonempty = indptr[1:] > indptr[:-1]
+    if nonempty.any():
+        max_weights[nonempty] = np.maximum.reduceat(np.abs(data), indptr[:-1][nonempty])
+
+    arrays = {
+        'term_offsets': term_offsets,
+        'term_blob': np.frombuffer(blob, dtype=np.uint8),
+        'idf': idf,
+        'indptr': indptr,
+        'indices': indices,
+        'data': data,
+        'source_ids': source_ids,
+        'posting_ids': posting_ids,
+        'max_weights': max_weights,
+    }
+    sections, total = _np_layout({'terms': len(terms), 'sources': len(source_ids), 'postings': len(indices),
+                                  'blob_len': len(blob)})
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        header = HEADER.pack(MAGIC, VERSION, generation, len(terms), len(source_ids), len(indices), len(blob), change_seq,
+                             total_docs)
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        for name, (offset, dtype, count) in sections.items():
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+        f.write(b'\0' * (total - f.tell()))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return {'terms': len(terms), 'sources': len(source_ids), 'postings': len(indices), 'bytes': total}
+
+
+def open_snapshot(path=SNAPSHOT_PATH):
+    """Mapea la instantánea en solo lectura y devuelve un SparseIndex cuyos
+    arrays son vistas sobre el mapeo."""
+    mm, header, _ = map_snapshot(path)
+    sections, _ = _np_layout(header)
+    views = {name: np.frombuffer(mm, dtype=dtype, count=count, offset=offset)
+             for name, (offset, dtype, count) in sections.items()}
+    vocabulary = TermDictionary(views['term_offsets'], memoryview(mm)[sections['term_blob'][0]:][:header['blob_len']])
+    index = SparseIndex(vocabulary, SnapshotIdf(vocabulary, views['idf']), views['indptr'],
+                        views['indices'], views['data'], views['source_ids'])
+    index.change_seq = header['change_seq']
+    index.generation = header['generation']
+    index.total_docs = header['total_docs']
+    index.mmap = mm
+    return index
+
+
+def open_index(path=SNAPSHOT_PATH, db=None):
+    """Instantánea más las fuentes reindexadas después (ver OverlayIndex)."""
+    base = open_snapshot(path)
+    own_db = db is None
+    if own_db:
+        db = get_db()
+    try:
+        generation = read_generation(db)
+        if generation != base.generation:
+            raise SnapshotError(f'instantánea de la generación {base.generation}, el índice está en la {generation}')
+        cursor = db.cursor()
+        cursor.execute('SELECT DISTINCT source_id FROM tfidf_changes WHERE seq > ?', (base.change_seq,))
+        changed = sorted(r[0] for r in cursor.fetchall())
+        delta = SparseIndex.from_db(db, source_ids=changed)
+        masked = np.isin(base.source_ids, np.array(changed, dtype=np.int64))
+        # doc_freq solo cambió en los términos que las fuentes cambiadas tenían
+        # (columnas enmascaradas de la instantánea) o tienen ahora (delta)
+        fresh = delta.idf
+        if masked.any():
+            hits = np.flatnonzero(np.isin(base.indices, np.flatnonzero(masked)))
+            rows = np.unique(np.searchsorted(base.indptr, hits, side='right') - 1)
+            terms = [base.vocabulary[int(r)].decode('utf-8') for r in rows] + list(delta.idf)
+            fresh = dict.fromkeys(terms)     # None: el término ya no está en global_idf
+            fresh.update(fetch_idf(cursor, terms))
+        total_docs = read_meta(db, 'total_docs')
+    finally:
+        if own_db:
+            db.close()
+    # Instantáneas sin total_docs en la cabecera (0): IDF tal cual
+    shift = math.log((total_docs or 1) / base.total_docs) if base.total_docs else 0.0
+    return OverlayIndex(base, delta, masked, OverlayIdf(base.idf, fresh, shift))
+
+
+def build_snapshot(path=SNAPSHOT_PATH, db=None):
+    """Lee el índice completo de SQLite en una sola transacción de lectura y
+    escribe la instantánea; descarta del registro de cambios lo ya incluido
+    que ninguna reconstrucción en curso necesite."""
+    own_db = db is None
+    if own_db:
+        db = get_db()
+    try:
+        cursor = db.cursor()
+        db.commit()
+        cursor.execute('BEGIN')
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM tfidf_changes')
+        change_seq = cursor.fetchone()[0]
+        generation = read_generation(db)
+        total_docs = read_meta(db, 'total_docs')
+        index = SparseIndex.from_db(db)
+        db.commit()
+        info = write_snapshot(index, path, change_seq, generation, total_docs or 1)
+        # Lo que una reconstrucción en curso aún va a releer se queda (db_utils.hold_changes)
+        cursor.execute('DELETE FROM tfidf_changes WHERE seq <= ?', (purge_limit(cursor, change_seq),))
+        db.commit()
+    finally:
+        if own_db:
+            db.close()
+    info['change_seq'] = change_seq
+    info['generation'] = generation
+    return info
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genera o inspecciona la instantánea mmap del índice TF-IDF')
+    parser.add_argument('--path', default=SNAPSHOT_PATH)
+    parser.add_argument('--info', action='store_true', help='solo mostrar la cabecera de la instantánea')
+    args = parser.parse_args()
+    if args.info:
+        with open(args.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                print(json.dumps(read_header(mm)))
+        sys.exit(0)
+    print(json.dumps(build_snapshot(args.path)))
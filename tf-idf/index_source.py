@@ -1,68 +1,140 @@
 import sys
 import json
 import math
-from db_utils import get_db
-from preprocess import preprocess
+from db_utils import get_db, read_meta, compute_idf, fetch_norm_idf, term_ids
+from preprocess import preprocess, ensure_lexicon
+from near_duplicates import refresh_signature, check_source
+from fingerprints import refresh_fingerprints
 
-def index_source(source_id, title, authors, keywords):
-    db = get_db()
-    cursor = db.cursor()
-    
-    # 1. Crear documento virtual con pesos (título×3, autores, keywords×2)
+DEFAULT_IDF = math.log(1000)   # valor arbitrario alto para términos sin IDF
+
+def build_document(title, authors, keywords):
+    # Documento virtual con pesos (título×3, autores, keywords×2)
     doc_parts = [title] * 3
     if authors:
         doc_parts.append(authors)
     if keywords:
         doc_parts.extend([keywords] * 2)
-    text = ' '.join(doc_parts)
-    
-    # 2. Preprocesar
-    terms = preprocess(text)
-    
-    # 3. Obtener IDF actuales de global_idf
-    cursor.execute('SELECT term, idf FROM global_idf')
-    idf_map = {row[0]: row[1] for row in cursor.fetchall()}
-    
-    # 4. Calcular TF
-    total_terms = len(terms)
+    return ' '.join(doc_parts)
+
+def term_frequencies(terms):
+    # Número de apariciones de cada término: la búsqueda usa tf / norm, que no
+    # cambia al dividir por la longitud del documento, y un entero ocupa menos
     tf_map = {}
     for t in terms:
         tf_map[t] = tf_map.get(t, 0) + 1
-    for t in tf_map:
-        tf_map[t] /= total_terms   # TF normalizado
-    
-    # 5. Calcular weight = tf * idf (si no existe idf, usar un valor por defecto)
-    default_idf = math.log(1000)   # valor arbitrario alto
+    return tf_map
+
+def update_doc_freq(cursor, source_id, terms, suffix=''):
+    """Ajusta doc_freq y total_docs al pasar la fuente de su vector guardado a
+    `terms` (None la retira del índice): solo cambian los términos que entran o
+    salen, y total_docs cuando la fuente entra o sale. Debe ejecutarse antes de
+    write_vector, en la misma transacción, y con el bloqueo de escritura ya
+    tomado (BEGIN IMMEDIATE): si el cambio de generación de recalc_idf.py se
+    confirmara entre estas lecturas y las escrituras, los deltas caerían sobre
+    la generación nueva calculados con el estado de la anterior."""
+    cursor.execute(f'''SELECT t.term FROM tfidf_postings{suffix} p JOIN tfidf_terms{suffix} t ON t.term_id = p.term_id
+                       WHERE p.source_id = ?''', (source_id,))
+    old_terms = {r[0] for r in cursor.fetchall()}
+    cursor.execute(f'SELECT 1 FROM source_norms{suffix} WHERE source_id = ?', (source_id,))
+    was_indexed = cursor.fetchone() is not None
+    new_terms = set(terms) if terms is not None else set()
+
+    delta = (terms is not None) - was_indexed
+    if delta:
+        cursor.execute(f"UPDATE tfidf_meta SET value = value + ? WHERE key = 'total_docs{suffix}'", (delta,))
+
+    removed = [(t,) for t in sorted(old_terms - new_terms)]
+    cursor.executemany(f'UPDATE global_idf{suffix} SET doc_freq = doc_freq - 1 WHERE term = ?', removed)
+    cursor.executemany(f'DELETE FROM global_idf{suffix} WHERE term = ? AND doc_freq <= 0', removed)
+    # Un término nuevo toma como IDF de referencia su IDF actual; el de los
+    # existentes no cambia (las normas de las demás fuentes se calcularon con él)
+    new_idf = compute_idf(1, read_meta(cursor, f'total_docs{suffix}'))
+    cursor.executemany(f'''
+        INSERT INTO global_idf{suffix} (term, idf, doc_freq) VALUES (?, ?, 1)
+        ON CONFLICT(term) DO UPDATE SET doc_freq = doc_freq + 1
+    ''', [(t, new_idf) for t in sorted(new_terms - old_terms)])
+
+def compute_vector(terms, idf_map):
+    # weight = tf * idf (si no existe idf, usar un valor por defecto) y norma del vector.
+    # idf_map es el IDF de referencia de las normas (fetch_norm_idf): la búsqueda
+    # solo usa tf y la norma, y aplica el IDF vigente al consultar
+    tf_map = term_frequencies(terms)
     weights = {}
     norm_sq = 0.0
     for t, tf in tf_map.items():
-        idf = idf_map.get(t, default_idf)
-        w = tf * idf
+        w = tf * idf_map.get(t, DEFAULT_IDF)
         weights[t] = w
         norm_sq += w * w
-    norm = math.sqrt(norm_sq)
-    
-    # 6. Guardar en tfidf_vectors (borrar antes si ya existía)
-    cursor.execute('DELETE FROM tfidf_vectors WHERE source_id = ?', (source_id,))
-    for t, w in weights.items():
-        tf_val = tf_map[t]
-        idf_val = idf_map.get(t, default_idf)
-        cursor.execute('''
-            INSERT INTO tfidf_vectors (source_id, term, tf, idf, weight)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (source_id, t, tf_val, idf_val, w))
-    
-    # 7. Guardar norma
-    cursor.execute('DELETE FROM source_norms WHERE source_id = ?', (source_id,))
-    cursor.execute('INSERT INTO source_norms (source_id, norm) VALUES (?, ?)',
+    return tf_map, weights, math.sqrt(norm_sq)
+
+def write_vector(cursor, source_id, tf_map, weights, norm, idf_map, suffix=''):
+    """Sustituye el vector, la norma y las cotas de una fuente en las tablas
+    vivas (suffix='') o en las de la generación en construcción ('_next')."""
+    # Guardar los postings (borrar antes si ya existían) con el id de cada término
+    ids = term_ids(cursor, weights, suffix, create=True)
+    cursor.execute(f'DELETE FROM tfidf_postings{suffix} WHERE source_id = ?', (source_id,))
+    cursor.executemany(f'INSERT INTO tfidf_postings{suffix} (term_id, source_id, tf) VALUES (?, ?, ?)',
+                       [(ids[t], source_id, tf_map[t]) for t in weights])
+
+    # Guardar norma
+    cursor.execute(f'DELETE FROM source_norms{suffix} WHERE source_id = ?', (source_id,))
+    cursor.execute(f'INSERT INTO source_norms{suffix} (source_id, norm) VALUES (?, ?)',
                    (source_id, norm))
-    
+
+    # Actualizar cotas MaxScore de tf / norm (solo pueden crecer hasta el próximo recálculo)
+    if norm > 0:
+        cursor.executemany(f'''
+            INSERT INTO term_max_weights{suffix} (term, max_weight) VALUES (?, ?)
+            ON CONFLICT(term) DO UPDATE SET max_weight = MAX(max_weight, excluded.max_weight)
+        ''', [(t, tf / norm) for t, tf in tf_map.items()])
+
+def index_source(source_id, title, authors, keywords):
+    db = get_db()
+    cursor = db.cursor()
+
+    # 1. Crear documento virtual con pesos (título×3, autores, keywords×2)
+    text = build_document(title, authors, keywords)
+
+    # 2. Preprocesar
+    terms = preprocess(text)
+
+    # 3. Actualizar doc_freq/total_docs y leer el IDF de referencia de las normas,
+    #    con el bloqueo de escritura tomado desde la primera lectura
+    cursor.execute('BEGIN IMMEDIATE')
+    update_doc_freq(cursor, source_id, terms)
+    idf_map = fetch_norm_idf(cursor, terms)
+
+    # 4. Calcular TF, pesos y norma
+    tf_map, weights, norm = compute_vector(terms, idf_map)
+
+    # 5. Guardar vector, norma y cotas
+    write_vector(cursor, source_id, tf_map, weights, norm, idf_map)
+
+    # 6. Registrar el cambio para la instantánea mmap, un reindexado en curso y
+    #    las fuentes relacionadas (related_sources.py --pending)
+    cursor.execute('INSERT INTO tfidf_changes (source_id) VALUES (?)', (source_id,))
     db.commit()
+
+    # 7. Huella de duplicado exacto (título + autores + edición) y firma MinHash
+    #    del título, en su propia transacción corta, y después sus casi
+    #    duplicados (solo lectura de los cubos LSH de sus bandas)
+    refresh_fingerprints(db, [source_id])
+    refresh_signature(cursor, source_id, title)
+    db.commit()
+    near = [{k: m[k] for k in ('source_id', 'jaccard', 'edit_similarity')} for m in check_source(cursor, source_id)]
     db.close()
-    print(json.dumps({"status": "ok", "source_id": source_id}))
+
+    # 8. Sin léxico de arranque todavía (no ha corrido recalc_idf.py), dejar
+    #    uno con las raíces de esta fuente
+    try:
+        ensure_lexicon()
+    except Exception as e:
+        print(f"Error escribiendo el léxico de arranque: {e}", file=sys.stderr)
+    print(json.dumps({"status": "ok", "source_id": source_id, "near_duplicates": near}))
 
 if __name__ == '__main__':
     # Esperamos argumentos: source_id, title, authors, keywords
     # authors y keywords pueden ser cadenas vacías
     _, source_id, title, authors, keywords = sys.argv
-    index_source(int(source_id), title, authors, keywords)
\ No newline at end of file
+    index_source(int(source_id), title, authors, keywords)
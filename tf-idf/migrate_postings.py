@@ -0,0 +1,201 @@
+"""Migración de tfidf_vectors al formato compacto de postings.
+
+El formato anterior guardaba por cada (fuente, término) el texto del término,
+tf, idf y weight, con la clave primaria (source_id, term) y un índice
+(term, source_id, weight): el término se repetía en cada fila de ambos árboles
+e idf/weight duplicaban global_idf. El nuevo (db_utils.POSTINGS_SQL) es
+
+  tfidf_terms     term_id -> término (diccionario de la generación)
+  tfidf_postings  (term_id, source_id) -> tf, WITHOUT ROWID, más un índice por source_id
+
+con el tf como número de apariciones: tf / norm no depende de la escala de los
+tf de cada fuente, así que se recupera el entero (apariciones / longitud ×
+longitud) y la norma de la fuente se multiplica por el mismo factor. Las
+fuentes cuyos tf no resultan enteros con ninguna longitud razonable conservan
+su tf tal cual (con su norma, el cociente es el mismo).
+
+ensure_schema() llama a migrate() sola al arrancar la aplicación
+(lib/database.js) o al reindexar (recalc_idf.py) con una base antigua. A mano:
+
+Uso: python3 tf-idf/migrate_postings.py [--queries 200] [--vacuum]
+
+mide tamaño en disco (dbstat) y latencia de lectura con el formato antiguo,
+migra, y repite las medidas con el nuevo.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from db_utils import get_db, ensure_schema, has_table, read_generation, POSTINGS_SQL
+
+# Apariciones máximas del término menos frecuente al buscar la longitud de una fuente
+MAX_COUNT = 64
+BATCH_SIZE = 20000
+
+
+def count_scale(tfs):
+    """Longitud del documento (entero) que convierte sus tf en apariciones
+    enteras, o None si no la hay."""
+    low = min(tfs)
+    if low <= 0:
+        return None
+    for count in range(1, MAX_COUNT + 1):
+        length = round(count / low)
+        if length and all(abs(tf * length - round(tf * length)) < 1e-6 for tf in tfs):
+            return length
+    return None
+
+
+def migrate(db):
+    """Pasa tfidf_vectors a tfidf_terms + tfidf_postings en una sola transacción
+    y borra la tabla antigua (con sus índices)."""
+    started = time.perf_counter()
+    generation = read_generation(db)
+    db.commit()
+    cursor = db.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        for statement in POSTINGS_SQL.format(suffix='', generation=generation).split(';'):
+            if statement.strip():
+                cursor.execute(statement)
+        cursor.execute('INSERT INTO tfidf_terms (term) SELECT DISTINCT term FROM tfidf_vectors ORDER BY term')
+
+        # Longitud de cada fuente a partir de sus tf (filas en el orden de la clave)
+        cursor.execute('DROP TABLE IF EXISTS temp.postings_scale')
+        cursor.execute('CREATE TEMP TABLE postings_scale (source_id INTEGER PRIMARY KEY, factor INTEGER NOT NULL)')
+        reader = db.cursor()
+        reader.execute('SELECT source_id, tf FROM tfidf_vectors ORDER BY source_id')
+        scaled, kept = [], 0
+        current, tfs = None, []
+        for source_id, tf in reader:
+            if source_id != current:
+                if tfs:
+                    factor = count_scale(tfs)
+                    if factor is None:
+                        kept += 1
+                    else:
+                        scaled.append((current, factor))
+                current, tfs = source_id, []
+            tfs.append(tf)
+        if tfs:
+            factor = count_scale(tfs)
+            if factor is None:
+                kept += 1
+            else:
+                scaled.append((current, factor))
+        cursor.executemany('INSERT INTO temp.postings_scale (source_id, factor) VALUES (?, ?)', scaled)
+
+        cursor.execute('''
+            INSERT INTO tfidf_postings (term_id, source_id, tf)
+            SELECT t.term_id, v.source_id,
+                   CASE WHEN s.factor IS NULL THEN v.tf ELSE CAST(ROUND(v.tf * s.factor) AS INTEGER) END
+            FROM tfidf_vectors v
+            JOIN tfidf_terms t ON t.term = v.term
+            LEFT JOIN temp.postings_scale s ON s.source_id = v.source_id
+            ORDER BY t.term_id, v.source_id
+        ''')
+        postings = cursor.rowcount
+        cursor.execute('''
+            UPDATE source_norms
+            SET norm = norm * (SELECT s.factor FROM temp.postings_scale s WHERE s.source_id = source_norms.source_id)
+            WHERE source_id IN (SELECT source_id FROM temp.postings_scale)
+        ''')
+        cursor.execute('DROP TABLE tfidf_vectors')
+        cursor.execute('DROP TABLE temp.postings_scale')
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    cursor.execute('SELECT COUNT(*) FROM tfidf_terms')
+    return {'terms': cursor.fetchone()[0], 'postings': postings, 'scaled_sources': len(scaled),
+            'unscaled_sources': kept, 'seconds': round(time.perf_counter() - started, 3)}
+
+
+def table_sizes(db, tables):
+    """Bytes de cada tabla de `tables` con todos sus índices (dbstat)."""
+    sizes = {}
+    rows = db.execute('''
+        SELECT m.tbl_name, SUM(d.pgsize) FROM dbstat d JOIN sqlite_master m ON m.name = d.name
+        GROUP BY m.tbl_name
+    ''').fetchall()
+    for table, size in rows:
+        if table in tables:
+            sizes[table] = size
+    return sizes
+
+
+# Lecturas equivalentes en los dos formatos: postings de un término (búsqueda),
+# vector de una fuente (search_by_source, indexado incremental) y carga completa
+LEGACY_READS = {
+    'term': '''SELECT v.source_id, v.tf / n.norm FROM tfidf_vectors v
+               JOIN source_norms n ON v.source_id = n.source_id
+               WHERE v.term = ? AND n.norm > 0 ORDER BY v.source_id''',
+    'source': '''SELECT v.term, v.tf / n.norm FROM tfidf_vectors v
+                 JOIN source_norms n ON v.source_id = n.source_id
+                 WHERE v.source_id = ? AND n.norm > 0''',
+    'full': '''SELECT v.term, v.source_id, v.tf / n.norm FROM tfidf_vectors v
+               JOIN source_norms n ON v.source_id = n.source_id
+               WHERE n.norm > 0 ORDER BY v.term, v.source_id''',
+}
+READS = {
+    'term': '''SELECT p.source_id, p.tf / n.norm FROM tfidf_terms t
+               JOIN tfidf_postings p ON p.term_id = t.term_id
+               JOIN source_norms n ON p.source_id = n.source_id
+               WHERE t.term = ? AND n.norm > 0 ORDER BY p.source_id''',
+    'source': '''SELECT t.term, p.tf / n.norm FROM tfidf_postings p
+                 JOIN source_norms n ON p.source_id = n.source_id
+                 JOIN tfidf_terms t ON t.term_id = p.term_id
+                 WHERE p.source_id = ? AND n.norm > 0''',
+    'full': '''SELECT t.term, p.source_id, p.tf / n.norm FROM tfidf_postings p
+               JOIN tfidf_terms t ON t.term_id = p.term_id
+               JOIN source_norms n ON p.source_id = n.source_id
+               WHERE n.norm > 0 ORDER BY p.term_id, p.source_id''',
+}
+
+
+def time_reads(db, reads, terms, sources):
+    """Milisegundos por lectura (media) de cada tipo."""
+    out = {}
+    for name, params in (('term', terms), ('source', sources), ('full', [()])):
+        started = time.perf_counter()
+        rows = 0
+        for p in params:
+            rows += len(db.execute(reads[name], p if isinstance(p, tuple) else (p,)).fetchall())
+        out[f'{name}_ms'] = round((time.perf_counter() - started) * 1000 / max(len(params), 1), 3)
+        out[f'{name}_rows'] = rows
+    return out
+
+
+def report(db, queries=200, vacuum=False):
+    if not has_table(db, 'tfidf_vectors'):
+        raise SystemExit('La base ya usa tfidf_postings: no hay nada que migrar')
+    rng = random.Random(0)
+    terms = [r[0] for r in db.execute('SELECT term FROM global_idf')]
+    sources = [r[0] for r in db.execute('SELECT source_id FROM source_norms WHERE norm > 0')]
+    terms = rng.sample(terms, min(queries, len(terms)))
+    sources = rng.sample(sources, min(queries, len(sources)))
+
+    legacy = ('tfidf_vectors',)
+    compact = ('tfidf_terms', 'tfidf_postings')
+    before = {'bytes': table_sizes(db, legacy), **time_reads(db, LEGACY_READS, terms, sources)}
+    migrated = migrate(db)
+    ensure_schema(db)
+    if vacuum:
+        db.execute('VACUUM')
+    after = {'bytes': table_sizes(db, compact), **time_reads(db, READS, terms, sources)}
+    old_bytes, new_bytes = sum(before['bytes'].values()), sum(after['bytes'].values())
+    return {'migration': migrated, 'before': before, 'after': after,
+            'bytes_ratio': round(new_bytes / old_bytes, 3) if old_bytes else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migra tfidf_vectors a tfidf_terms + tfidf_postings')
+    parser.add_argument('--queries', type=int, default=200, help='términos y fuentes medidos')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM tras migrar (devuelve el espacio al disco)')
+    args = parser.parse_args()
+    db = get_db()
+    try:
+        print(json.dumps(report(db, args.queries, args.vacuum), ensure_ascii=False))
+    finally:
+        db.close()
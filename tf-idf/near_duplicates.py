@@ -0,0 +1,534 @@
+"""Detección de fuentes casi duplicadas por título con MinHash y LSH.
+
+Cada fuente guarda en `title_signatures` su título normalizado (minúsculas,
+sin acentos ni signos), su año y la firma MinHash del conjunto de sus palabras
+de más de dos letras que no son stopwords (las del léxico de preprocess.py):
+SIGNATURE_SIZE mínimos de otras tantas funciones hash. La probabilidad de que
+dos firmas coincidan en una posición es la similitud de Jaccard de los dos
+conjuntos. Sin las stopwords, dos títulos no se parecen solo por compartir
+"para", "los" o "una", que además llenarían los cubos.
+
+Solo los pares candidatos pasan la comprobación exacta (Jaccard de esos
+conjuntos y distancia de edición de los títulos normalizados), con los
+umbrales que usaba lib/duplicate_checker.js:
+  mismo año y (Jaccard >= 0,35 o similitud de edición >= 0,75), o Jaccard >= 0,70
+La regla de edición decide igual que antes. El Jaccard, al no contar las
+stopwords, cambia en dos casos: los títulos que solo compartían stopwords ("Lo
+que hay entre nosotros y ellos: historia" / "...: economía política moderna")
+dejan de ser pares, y los que solo se diferencian en stopwords ("El origen de
+las especies" / "Origen de especies") pasan a tener Jaccard 1. Los umbrales se
+mantienen a propósito: son esos dos cambios los que se buscaban
+(tests/test_near_duplicates.py compara con las reglas de lib/duplicate_checker.js).
+
+Los candidatos salen de dos juegos de bandas de la misma firma, uno por regla,
+y cada banda es un cubo en `title_lsh_buckets`:
+  - YEAR_BANDS bandas de YEAR_ROWS valores con el año en la clave del cubo: un
+    par del mismo año con Jaccard 0,35 es candidato con probabilidad
+    1 - (1 - 0,35²)³² ≈ 0,985, y los de años distintos no comparten cubos.
+  - WIDE_BANDS bandas de WIDE_ROWS valores sin año: Jaccard 0,70 lo es con
+    1 - (1 - 0,70⁴)¹⁶ ≈ 0,988, y Jaccard 0,35 solo con ≈ 0,21.
+Los cubos con más de --max-bucket fuentes no generan pares: un duplicado real
+comparte muchas bandas y aparece por otra.
+
+Una errata en cada palabra deja el Jaccard bajo y la firma no encuentra el
+par, así que la regla de edición tiene su propio camino de candidatos, solo
+entre fuentes del mismo año: la diferencia de longitudes y los bigramas de
+caracteres compartidos (cada operación de edición destruye como mucho dos)
+descartan sin calcular la distancia los pares que no pueden llegar a 0,75.
+
+- scan: sincroniza las firmas con `sources` (solo recalcula los títulos o años
+  que cambiaron, en bloque con NumPy), agrupa por cubo todas las fuentes
+  activas y descarta los candidatos cuyas firmas coinciden en muy pocas
+  posiciones antes de la comprobación exacta. Los bigramas compartidos de
+  todos los pares de cada año salen de un producto de matrices. Devuelve los
+  pares de todo el corpus.
+- check_title / check_source: una sola fuente contra el corpus, leyendo solo
+  sus cubos (clave primaria de title_lsh_buckets) y los títulos de su año
+  (idx_title_signatures_year). index_source.py refresca la firma de la fuente
+  indexada y devuelve sus casi duplicados.
+
+Uso: python3 tf-idf/near_duplicates.py --scan [--max-bucket N]
+     python3 tf-idf/near_duplicates.py --source ID
+     python3 tf-idf/near_duplicates.py --title "Título" [--year 2020]
+"""
+import re
+import json
+import math
+import time
+import zlib
+import argparse
+import unicodedata
+from array import array
+from collections import Counter
+from db_utils import get_db, ensure_schema
+from preprocess import stop_words
+
+SIGNATURE_SIZE = 64
+# Bandas 0..31: pares de valores + año; bandas 32..47: cuartetos de valores
+YEAR_BANDS, YEAR_ROWS = 32, 2
+WIDE_BANDS, WIDE_ROWS = 16, 4
+BANDS = [(band, band * YEAR_ROWS, YEAR_ROWS, True) for band in range(YEAR_BANDS)] + \
+        [(YEAR_BANDS + band, band * WIDE_ROWS, WIDE_ROWS, False) for band in range(WIDE_BANDS)]
+MAX_BUCKET = 500
+# Los candidatos del scan cuyas firmas coinciden en menos de esta fracción de
+# posiciones (estimación de su Jaccard) se descartan sin la comprobación exacta.
+# Con 64 posiciones, un par con Jaccard 1/3 (mismo año) o 0,70 (años distintos)
+# queda por debajo con probabilidad < 0,001
+MIN_AGREEMENT = 0.15
+MIN_AGREEMENT_ANY_YEAR = 0.45
+
+# Funciones hash (a·x + b) mod PRIME con a, b < 2³² y x < 2³²: a·x + b < 2⁶⁴
+# cabe sin desbordar en uint64 (NumPy); el mínimo se guarda en 32 bits
+PRIME = 4294967311
+MASK = 0xFFFFFFFF
+MASK64 = (1 << 64) - 1
+GOLDEN = 0x9E3779B97F4A7C15
+
+
+def _hash_params(count, seed=0x9E3779B97F4A7C15):
+    # Coeficientes fijos (generador congruencial de 64 bits): las firmas guardadas
+    # solo son comparables si todas se calculan con los mismos
+    values = []
+    state = seed
+    for _ in range(count):
+        state = (state * 6364136223846793005 + 1442695040888963407) & 0xFFFFFFFFFFFFFFFF
+        values.append(1 + (state >> 33) % (MASK - 1))
+    return values
+
+
+_params = _hash_params(2 * SIGNATURE_SIZE)
+HASH_A = _params[:SIGNATURE_SIZE]
+HASH_B = _params[SIGNATURE_SIZE:]
+
+# Umbrales de la comprobación exacta
+JACCARD_SAME_YEAR = 0.35
+EDIT_SAME_YEAR = 0.75
+JACCARD_ANY_YEAR = 0.70
+
+CHUNK_SIZE = 500
+COMBINING = re.compile('[\u0300-\u036f]')
+NON_ALNUM = re.compile(r'[^a-z0-9\s]')
+SPACES = re.compile(r'\s+')
+
+
+def normalize_title(title):
+    """Minúsculas, sin diacríticos y con todo lo que no sea letra o cifra como espacio."""
+    text = COMBINING.sub('', unicodedata.normalize('NFD', str(title or '').lower()))
+    return SPACES.sub(' ', NON_ALNUM.sub(' ', text)).strip()
+
+
+_stop = None
+
+
+def title_tokens(normalized):
+    """Palabras de más de dos letras que no son stopwords (normalizadas como los
+    títulos); si el título solo tiene stopwords, todas sus palabras."""
+    global _stop
+    if _stop is None:
+        _stop = {normalize_title(w) for w in stop_words()}
+    words = {w for w in normalized.split(' ') if len(w) > 2}
+    return (words - _stop) or words
+
+
+def _token_hash(token):
+    return zlib.crc32(token.encode('utf-8'))
+
+
+def signature(tokens):
+    """Firma MinHash (array de SIGNATURE_SIZE enteros de 32 bits); None sin palabras."""
+    if not tokens:
+        return None
+    values = [_token_hash(t) for t in tokens]
+    return array('I', (min((a * x + b) % PRIME for x in values) & MASK
+                       for a, b in zip(HASH_A, HASH_B)))
+
+
+def signatures_batch(token_sets):
+    """Las mismas firmas que signature() para muchos títulos a la vez (NumPy):
+    matriz títulos × SIGNATURE_SIZE de uint32 (las filas de títulos sin palabras
+    no significan nada)."""
+    import numpy as np
+    lengths = np.fromiter((len(t) for t in token_sets), dtype=np.int64, count=len(token_sets))
+    out = np.zeros((len(token_sets), SIGNATURE_SIZE), dtype=np.uint32)
+    if not lengths.sum():
+        return out
+    x = np.fromiter((_token_hash(t) for tokens in token_sets for t in tokens), dtype=np.uint64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    present = lengths > 0
+    for k in range(SIGNATURE_SIZE):
+        h = (x * np.uint64(HASH_A[k]) + np.uint64(HASH_B[k])) % np.uint64(PRIME)
+        out[present, k] = (np.minimum.reduceat(h, starts[present]) & np.uint64(MASK)).astype(np.uint32)
+    return out
+
+
+def _bucket(values):
+    # Clave de 64 bits con signo (SQLite) de los valores de una banda
+    h = 0
+    for v in values:
+        h = ((h ^ v) * GOLDEN) & MASK64
+        h ^= h >> 29
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def band_keys(sig, year=None):
+    """[(banda, cubo)] de una firma; sin año solo las bandas sin año."""
+    keys = []
+    for band, first, rows, with_year in BANDS:
+        if with_year and not year:
+            continue
+        values = list(sig[first:first + rows])
+        keys.append((band, _bucket([int(year) & MASK64] + values if with_year else values)))
+    return keys
+
+
+def _band_columns(matrix, years):
+    """Lo mismo que band_keys() para una matriz de firmas (NumPy): por banda,
+    (banda, cubos int64, máscara de las filas que tienen esa banda)."""
+    import numpy as np
+    years = np.asarray(years, dtype=np.int64)
+    has_year = years != 0
+    everyone = np.ones(len(matrix), dtype=bool)
+    for band, first, rows, with_year in BANDS:
+        columns = [matrix[:, k].astype(np.uint64) for k in range(first, first + rows)]
+        if with_year:
+            columns.insert(0, years.astype(np.uint64))
+        h = np.zeros(len(matrix), dtype=np.uint64)
+        for column in columns:
+            h = (h ^ column) * np.uint64(GOLDEN)
+            h ^= h >> np.uint64(29)
+        yield band, h.view(np.int64), has_year if with_year else everyone
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def edit_similarity(a, b, minimum=0.0):
+    """1 - distancia de Levenshtein / longitud del más largo. Con `minimum`,
+    devuelve 0 en cuanto la distancia ya no puede quedar por debajo de la que
+    permite (el mínimo de una fila de la tabla nunca baja)."""
+    if len(a) < len(b):
+        a, b = b, a
+    if not a:
+        return 1.0
+    limit = math.floor((1 - minimum) * len(a) + 1e-9)
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return 0.0
+        previous = current
+    return 1 - previous[-1] / len(a)
+
+
+def _edit_reachable(len_a, len_b):
+    # cota de la similitud de edición por la diferencia de longitudes
+    longest = max(len_a, len_b, 1)
+    return 1 - abs(len_a - len_b) / longest >= EDIT_SAME_YEAR
+
+
+def _min_shared_bigrams(len_a, len_b):
+    """Bigramas de caracteres (con repetición) que comparten como mínimo dos
+    títulos con similitud de edición >= EDIT_SAME_YEAR: el más largo tiene
+    longest - 1 y cada una de las floor((1 - EDIT_SAME_YEAR) · longest)
+    operaciones permitidas destruye como mucho dos."""
+    longest = max(len_a, len_b)
+    return longest - 1 - 2 * math.floor((1 - EDIT_SAME_YEAR) * longest + 1e-9)
+
+
+def bigrams(normalized):
+    return Counter(normalized[i:i + 2] for i in range(len(normalized) - 1))
+
+
+def compare(norm_a, norm_b, year_a, year_b):
+    """(jaccard, similitud de edición) si el par es casi duplicado; None si no.
+    La distancia de edición solo se calcula cuando decide."""
+    score = jaccard(title_tokens(norm_a), title_tokens(norm_b))
+    same_year = bool(year_a) and year_a == year_b
+    if score >= JACCARD_ANY_YEAR or (same_year and score >= JACCARD_SAME_YEAR):
+        return score, edit_similarity(norm_a, norm_b)
+    if not same_year or not _edit_reachable(len(norm_a), len(norm_b)):
+        return None
+    edit = edit_similarity(norm_a, norm_b, EDIT_SAME_YEAR)
+    return (score, edit) if edit >= EDIT_SAME_YEAR else None
+
+
+# ---------------------------------------------------------------------------
+# Firmas en SQLite
+
+def _delete_signatures(cursor, source_ids):
+    # Los cubos se borran por su clave primaria, a partir de la firma guardada
+    source_ids = list(source_ids)
+    for i in range(0, len(source_ids), CHUNK_SIZE):
+        chunk = source_ids[i:i + CHUNK_SIZE]
+        marks = ','.join('?' * len(chunk))
+        rows = cursor.execute(f'''SELECT source_id, signature, publication_year FROM title_signatures
+                                 WHERE source_id IN ({marks})''', chunk).fetchall()
+        cursor.executemany('DELETE FROM title_lsh_buckets WHERE band = ? AND bucket = ? AND source_id = ?',
+                           [(band, key, source_id) for source_id, blob, year in rows
+                            for band, key in band_keys(array('I', blob), year)])
+        cursor.execute(f'DELETE FROM title_signatures WHERE source_id IN ({marks})', chunk)
+
+
+def refresh_signature(cursor, source_id, title):
+    """Rehace la firma y los cubos de una fuente (dentro de la transacción del llamante)."""
+    row = cursor.execute('SELECT publication_year FROM sources WHERE id = ?', (source_id,)).fetchone()
+    year = row[0] if row else None
+    normalized = normalize_title(title)
+    sig = signature(title_tokens(normalized))
+    _delete_signatures(cursor, [source_id])
+    if sig is None:
+        return
+    cursor.execute('INSERT INTO title_signatures (source_id, normalized, publication_year, signature) VALUES (?, ?, ?, ?)',
+                   (source_id, normalized, year, sig.tobytes()))
+    cursor.executemany('INSERT INTO title_lsh_buckets (band, bucket, source_id) VALUES (?, ?, ?)',
+                       [(band, key, source_id) for band, key in band_keys(sig, year)])
+
+
+def sync_signatures(db):
+    """Pone las firmas al día con `sources`: calcula las de los títulos o años
+    nuevos o cambiados y borra las de fuentes que ya no existen (las tablas no
+    tienen clave foránea, ver database/init.sql). Devuelve cuántas cambió.
+    Los cubos se insertan en bloque y ordenados por (band, bucket), el orden de
+    la clave de title_lsh_buckets."""
+    import numpy as np
+    cursor = db.cursor()
+    stored = {source_id: (normalized, year) for source_id, normalized, year
+              in cursor.execute('SELECT source_id, normalized, publication_year FROM title_signatures')}
+    changed = []
+    current = set()
+    for source_id, title, year in cursor.execute('SELECT id, title, publication_year FROM sources').fetchall():
+        current.add(source_id)
+        normalized = normalize_title(title)
+        # los títulos sin palabras significativas no tienen firma
+        if stored.get(source_id) != (normalized, year) and (source_id in stored or title_tokens(normalized)):
+            changed.append((source_id, normalized, year))
+    gone = [source_id for source_id in stored if source_id not in current]
+    _delete_signatures(cursor, gone + [source_id for source_id, _, _ in changed if source_id in stored])
+
+    token_sets = [title_tokens(normalized) for _, normalized, _ in changed]
+    changed = [entry for entry, tokens in zip(changed, token_sets) if tokens]
+    if changed:
+        matrix = signatures_batch([tokens for tokens in token_sets if tokens])
+        cursor.executemany('INSERT INTO title_signatures (source_id, normalized, publication_year, signature) '
+                           'VALUES (?, ?, ?, ?)',
+                           ((source_id, normalized, year, row.tobytes())
+                            for (source_id, normalized, year), row in zip(changed, matrix)))
+        ids = np.array([entry[0] for entry in changed], dtype=np.int64)
+        bands, keys, owners = [], [], []
+        for band, column, valid in _band_columns(matrix, [entry[2] or 0 for entry in changed]):
+            keys.append(column[valid])
+            owners.append(ids[valid])
+            bands.append(np.full(len(owners[-1]), band, dtype=np.int64))
+        bands, keys, owners = np.concatenate(bands), np.concatenate(keys), np.concatenate(owners)
+        order = np.lexsort((owners, keys, bands))
+        cursor.executemany('INSERT INTO title_lsh_buckets (band, bucket, source_id) VALUES (?, ?, ?)',
+                           zip(bands[order].tolist(), keys[order].tolist(), owners[order].tolist()))
+    db.commit()
+    return len(changed) + len(gone)
+
+
+def _candidates(cursor, sig, year, max_bucket):
+    # Fuentes que comparten el cubo de alguna banda (cubos demasiado llenos aparte)
+    found = set()
+    crowded = 0
+    for band, key in band_keys(sig, year):
+        rows = cursor.execute('SELECT source_id FROM title_lsh_buckets WHERE band = ? AND bucket = ? LIMIT ?',
+                              (band, key, max_bucket + 1)).fetchall()
+        if len(rows) > max_bucket:
+            crowded += 1
+            continue
+        found.update(r[0] for r in rows)
+    return found, crowded
+
+
+def _same_year_candidates(cursor, normalized, year):
+    # Fuentes del mismo año que aún pueden pasar la regla de edición
+    if not year:
+        return set()
+    mine = bigrams(normalized)
+    distinct = set(mine)
+    length = len(normalized)
+    found = set()
+    for source_id, other in cursor.execute('''
+        SELECT source_id, normalized FROM title_signatures
+        WHERE publication_year = ? AND length(normalized) BETWEEN ? AND ?
+    ''', (year, math.ceil(EDIT_SAME_YEAR * length - 1e-9), math.floor(length / EDIT_SAME_YEAR + 1e-9))).fetchall():
+        need = _min_shared_bigrams(length, len(other))
+        # cota con conjuntos: cada bigrama común más las repeticiones del otro título
+        grams = {other[i:i + 2] for i in range(len(other) - 1)}
+        if len(distinct & grams) + len(other) - 1 - len(grams) < need:
+            continue
+        if sum((mine & bigrams(other)).values()) >= need:
+            found.add(source_id)
+    return found
+
+
+def _matches(cursor, normalized, year, candidates):
+    out = []
+    candidates = sorted(candidates)
+    for i in range(0, len(candidates), CHUNK_SIZE):
+        chunk = candidates[i:i + CHUNK_SIZE]
+        rows = cursor.execute(f'''
+            SELECT t.source_id, t.normalized, s.publication_year, s.title
+            FROM title_signatures t JOIN sources s ON s.id = t.source_id
+            WHERE s.is_active = 1 AND t.source_id IN ({','.join('?' * len(chunk))})
+        ''', chunk).fetchall()
+        for source_id, other, other_year, title in rows:
+            result = compare(normalized, other, year, other_year)
+            if result:
+                out.append({'source_id': source_id, 'title': title,
+                            'jaccard': round(result[0], 4), 'edit_similarity': round(result[1], 4)})
+    out.sort(key=lambda m: (-m['jaccard'], -m['edit_similarity'], m['source_id']))
+    return out
+
+
+def check_title(cursor, title, year=None, exclude=None, max_bucket=MAX_BUCKET):
+    """Fuentes activas casi duplicadas de un título (p. ej. de una subida que aún
+    no está en la base). Solo lee los cubos del título y sus candidatos."""
+    normalized = normalize_title(title)
+    sig = signature(title_tokens(normalized))
+    if sig is None:
+        return []
+    candidates, _ = _candidates(cursor, sig, year, max_bucket)
+    candidates |= _same_year_candidates(cursor, normalized, year)
+    candidates.discard(exclude)
+    return _matches(cursor, normalized, year, candidates)
+
+
+def check_source(cursor, source_id, max_bucket=MAX_BUCKET):
+    """Casi duplicados de una fuente ya guardada (con su firma al día)."""
+    row = cursor.execute('SELECT normalized, signature, publication_year FROM title_signatures WHERE source_id = ?',
+                         (source_id,)).fetchone()
+    if row is None:
+        return []
+    normalized, blob, year = row
+    candidates, _ = _candidates(cursor, array('I', blob), year, max_bucket)
+    candidates |= _same_year_candidates(cursor, normalized, year)
+    candidates.discard(source_id)
+    return _matches(cursor, normalized, year, candidates)
+
+
+def _same_year_pairs(normalized, years, n, block=1024):
+    """Pares i·n + j (i < j) del mismo año que aún pueden pasar la regla de
+    edición. Cada título es un vector de rasgos (bigrama, k-ésima aparición):
+    el producto de dos vectores es el número de bigramas que comparten con
+    repetición, y los de un año salen todos de un producto de matrices."""
+    import numpy as np
+    lengths = np.fromiter((len(t) for t in normalized), dtype=np.int64, count=n)
+    found = []
+    for year in np.unique(years[years != 0]).tolist():
+        members = np.flatnonzero(years == year)
+        if len(members) < 2:
+            continue
+        features = {}
+        rows, columns = [], []
+        for row, position in enumerate(members.tolist()):
+            seen = Counter()
+            text = normalized[position]
+            for i in range(len(text) - 1):
+                gram = text[i:i + 2]
+                seen[gram] += 1
+                rows.append(row)
+                columns.append(features.setdefault((gram, seen[gram]), len(features)))
+        matrix = np.zeros((len(members), max(len(features), 1)), dtype=np.float32)
+        matrix[rows, columns] = 1
+        size = lengths[members]
+        for start in range(0, len(members), block):
+            stop = min(start + block, len(members))
+            shared = matrix[start:stop] @ matrix.T
+            a, b = size[start:stop, None], size[None, :]
+            longest = np.maximum(a, b)
+            need = longest - 1 - 2 * np.floor((1 - EDIT_SAME_YEAR) * longest + 1e-9)
+            ok = (shared >= need) & (1 - np.abs(a - b) / np.maximum(longest, 1) >= EDIT_SAME_YEAR)
+            ok &= np.arange(start, stop)[:, None] < np.arange(len(members))[None, :]
+            i, j = np.nonzero(ok)
+            found.append(members[start + i] * n + members[j])
+    return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+
+def scan(db, max_bucket=MAX_BUCKET):
+    """Pares casi duplicados entre todas las fuentes activas."""
+    import numpy as np
+    started = time.perf_counter()
+    updated = sync_signatures(db)
+    rows = db.execute('''
+        SELECT t.source_id, t.normalized, t.signature, t.publication_year FROM title_signatures t
+        JOIN sources s ON s.id = t.source_id WHERE s.is_active = 1 ORDER BY t.source_id
+    ''').fetchall()
+    n = len(rows)
+    if n < 2:
+        return {'pairs': [], 'sources': n, 'candidates': 0, 'edit_candidates': 0, 'verified': 0, 'crowded_buckets': 0,
+                'updated': updated, 'seconds': round(time.perf_counter() - started, 2)}
+    sigs = np.frombuffer(b''.join(r[2] for r in rows), dtype=np.uint32).reshape(n, SIGNATURE_SIZE)
+    years = np.array([r[3] or 0 for r in rows], dtype=np.int64)
+
+    # Pares (i, j) con i < j de las posiciones que comparten cubo, codificados como i·n + j
+    pairs = []
+    crowded = 0
+    for _, keys, valid in _band_columns(sigs, years):
+        positions = np.flatnonzero(valid)
+        order = positions[np.argsort(keys[valid], kind='stable')]
+        sorted_keys = keys[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_keys)) + 1))
+        sizes = np.diff(np.concatenate((starts, [len(order)])))
+        crowded += int(np.count_nonzero(sizes > max_bucket))
+        # los cubos del mismo tamaño se expanden juntos: una matriz cubos × tamaño de posiciones
+        for size in np.unique(sizes[(sizes > 1) & (sizes <= max_bucket)]).tolist():
+            members = np.sort(order[starts[sizes == size][:, None] + np.arange(size)], axis=1)
+            i, j = np.triu_indices(size, k=1)
+            pairs.append((members[:, i] * n + members[:, j]).ravel())
+    candidates = np.unique(np.concatenate(pairs)) if pairs else np.zeros(0, dtype=np.int64)
+    generated = len(candidates)
+
+    # Estimación del Jaccard por la firma: fuera los que no pueden llegar al umbral de su regla
+    kept = []
+    for start in range(0, generated, 1 << 20):
+        block = candidates[start:start + (1 << 20)]
+        left, right = np.divmod(block, n)
+        agreement = np.count_nonzero(sigs[left] == sigs[right], axis=1) / SIGNATURE_SIZE
+        same_year = (years[left] == years[right]) & (years[left] != 0)
+        kept.append(block[agreement >= np.where(same_year, MIN_AGREEMENT, MIN_AGREEMENT_ANY_YEAR)])
+    candidates = np.concatenate(kept) if kept else candidates
+    # Los de la regla de edición no pasan por la firma: su Jaccard puede ser bajo
+    edit_pairs = _same_year_pairs([r[1] for r in rows], years, n)
+    candidates = np.union1d(candidates, edit_pairs)
+
+    found = []
+    for code in candidates.tolist():
+        i, j = divmod(code, n)
+        result = compare(rows[i][1], rows[j][1], rows[i][3], rows[j][3])
+        if result:
+            found.append({'a': rows[i][0], 'b': rows[j][0],
+                          'jaccard': round(result[0], 4), 'edit_similarity': round(result[1], 4)})
+    return {'pairs': found, 'sources': n, 'candidates': generated, 'edit_candidates': len(edit_pairs),
+            'verified': len(candidates), 'crowded_buckets': crowded,
+            'updated': updated, 'seconds': round(time.perf_counter() - started, 2)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fuentes casi duplicadas por título (MinHash + LSH)')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--scan', action='store_true', help='todos los pares casi duplicados del corpus')
+    mode.add_argument('--source', type=int, help='casi duplicados de una fuente guardada')
+    mode.add_argument('--title', help='casi duplicados de un título (una subida nueva)')
+    parser.add_argument('--year', type=int, default=None, help='año de publicación del título (--title)')
+    parser.add_argument('--max-bucket', type=int, default=MAX_BUCKET,
+                        help='cubos con más fuentes no generan candidatos')
+    args = parser.parse_args()
+    db = get_db()
+    ensure_schema(db)
+    try:
+        if args.scan:
+            result = scan(db, args.max_bucket)
+        elif args.source is not None:
+            result = {'matches': check_source(db.cursor(), args.source, args.max_bucket)}
+        else:
+            result = {'matches': check_title(db.cursor(), args.title, args.year, max_bucket=args.max_bucket)}
+    finally:
+        db.close()
+    print(json.dumps(result, ensure_ascii=False))
@@ -0,0 +1,276 @@
+"""Índice invertido residente del motor 'inverted', sobre buffers compactos.
+
+Cada término tiene un id entero (`vocabulary`: término -> term_id, un
+PackedVocabulary) y todo lo demás son arrays de la biblioteca estándar
+indexados por ese id o por posting:
+
+  offsets      array('q')  tramo [offsets[t], offsets[t + 1]) de las listas del término t
+  idf_values   array('d')  IDF del término (NaN si no está en global_idf)
+  max_weights  array('f')  cota MaxScore: máximo |tf / norm| de sus postings
+  ids          array('i')  source_id de cada posting, ordenados dentro de cada término
+  weights      array('f')  tf / norm de cada posting, en float32
+
+Un posting ocupa así 8 bytes y un término unos 40 más su texto en UTF-8, en lugar
+de una lista de int y otra de float de Python (~70 bytes por posting) más una
+tupla, dos listas, un float y la entrada de un dict por término (ver
+bench_memory.py).
+
+Las listas se entregan como memoryview de su tramo, sin copiar: admiten len,
+índices, zip y bisect como las listas, así que top_k_maxscore y
+score_lists_batch (search.py) las recorren igual. Los buffers pueden ser
+también vistas sobre la instantánea mmap (postings_snapshot.py), con un
+diccionario snapshot_format.TermDictionary en lugar del dict. No importa NumPy,
+para que search.py siga arrancando rápido en los procesos de un solo uso.
+"""
+import json
+import math
+from array import array
+
+MISSING = math.nan
+
+
+class TermEntry:
+    """Metadatos de un término, leídos de los arrays del índice al consultarlo."""
+    __slots__ = ('term_id', 'idf', 'max_weight', 'start', 'end')
+
+    def __init__(self, term_id, idf, max_weight, start, end):
+        self.term_id = term_id
+        self.idf = idf                  # None si el término no está en global_idf
+        self.max_weight = max_weight
+        self.start = start
+        self.end = end
+
+
+class PackedVocabulary:
+    """Diccionario término -> term_id sin un str y un int de Python por
+    término: los términos en UTF-8 concatenados en orden de term_id, sus
+    offsets y una tabla hash abierta (sondeo lineal) de term_id + 1 por hueco,
+    con entre 2 y 4 huecos por término. El hash es el de Python, así que la
+    tabla solo vale dentro del proceso que la construye."""
+    __slots__ = ('_offsets', '_blob', '_slots', '_mask')
+
+    def __init__(self, terms):
+        """terms: los términos en orden de term_id."""
+        self._offsets = array('q', [0])
+        encoded = []
+        for term in terms:
+            encoded.append(term.encode('utf-8'))
+            self._offsets.append(self._offsets[-1] + len(encoded[-1]))
+        self._blob = b''.join(encoded)
+        size = 8
+        while size < 2 * len(encoded):
+            size *= 2
+        self._slots = array('i', bytes(4 * size))
+        self._mask = size - 1
+        for term_id, key in enumerate(encoded):
+            i = hash(key) & self._mask
+            while self._slots[i]:
+                i = (i + 1) & self._mask
+            self._slots[i] = term_id + 1
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def get(self, term, default=None):
+        key = term.encode('utf-8')
+        offsets, slots, mask = self._offsets, self._slots, self._mask
+        i = hash(key) & mask
+        while True:
+            term_id = slots[i] - 1
+            if term_id < 0:
+                return default
+            if self._blob[offsets[term_id]:offsets[term_id + 1]] == key:
+                return term_id
+            i = (i + 1) & mask
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+
+class IdfView:
+    """Vista término -> idf con la misma interfaz .get() que un dict."""
+    __slots__ = ('_index', '_count')
+
+    def __init__(self, index):
+        self._index = index
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = sum(1 for value in self._index.idf_values if value == value)
+        return self._count
+
+    def get(self, term, default=None):
+        term_id = self._index.vocabulary.get(term)
+        if term_id is None:
+            return default
+        value = self._index.idf_values[term_id]
+        return default if value != value else value
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+
+class PostingsView:
+    """Vista término -> (ids, pesos) con .get(), como el dict de listas de postings."""
+    __slots__ = ('_index',)
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        offsets = self._index.offsets
+        return sum(1 for t in range(len(offsets) - 1) if offsets[t + 1] > offsets[t])
+
+    def get(self, term, default=None):
+        index = self._index
+        term_id = index.vocabulary.get(term)
+        if term_id is None:
+            return default
+        start, end = index.offsets[term_id], index.offsets[term_id + 1]
+        if start == end:
+            return default
+        return index._ids_view[start:end], index._weights_view[start:end]
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+
+class InvertedIndex:
+    engine = 'inverted'
+    __slots__ = ('vocabulary', 'offsets', 'idf_values', 'max_weights', 'ids', 'weights',
+                 '_ids_view', '_weights_view', 'idf', 'postings', 'sources', 'generation', 'version', 'attrs',
+                 'excluded')
+
+    def __init__(self, vocabulary, offsets, idf_values, max_weights, ids, weights, sources=0):
+        self.vocabulary = vocabulary    # término -> term_id (PackedVocabulary o TermDictionary)
+        self.offsets = offsets
+        self.idf_values = idf_values
+        self.max_weights = max_weights
+        self.ids = ids
+        self.weights = weights
+        self._ids_view = memoryview(ids)
+        self._weights_view = memoryview(weights)
+        self.idf = IdfView(self)
+        self.postings = PostingsView(self)
+        self.sources = sources          # fuentes indexadas (norma > 0)
+        self.generation = 0
+        self.version = (0, 0)
+        self.attrs = None               # source_attrs.SourceAttributes, para filtrar
+        self.excluded = None            # source_ids que no se puntúan (ver postings_snapshot.py)
+
+    @classmethod
+    def from_rows(cls, idf, rows, sources=0):
+        """Índice a partir de filas (término, source_id, tf / norm) agrupadas
+        por término y ordenadas por source_id dentro de cada uno; idf: término
+        -> idf (los términos sin postings quedan con un tramo vacío)."""
+        vocabulary = {}
+        offsets = array('q', [0])
+        ids = array('i')
+        weights = array('f')
+        current = None
+        for term, source_id, weight in rows:
+            if term != current:
+                if current is not None:
+                    vocabulary[current] = len(offsets) - 1
+                    offsets.append(len(ids))
+                current = term
+            ids.append(source_id)
+            weights.append(weight)
+        if current is not None:
+            vocabulary[current] = len(offsets) - 1
+            offsets.append(len(ids))
+        for term in idf:
+            if term not in vocabulary:
+                vocabulary[term] = len(offsets) - 1
+                offsets.append(len(ids))
+
+        idf_values = array('d', bytes(8 * len(vocabulary)))
+        for term, term_id in vocabulary.items():
+            value = idf.get(term)
+            idf_values[term_id] = MISSING if value is None else value
+        # Cotas sobre los pesos ya redondeados a float32, que son los que se suman
+        max_weights = array('f', bytes(4 * len(vocabulary)))
+        view = memoryview(weights)
+        for term_id in range(len(vocabulary)):
+            start, end = offsets[term_id], offsets[term_id + 1]
+            if end > start:
+                max_weights[term_id] = max(map(abs, view[start:end]))
+        view.release()
+        # los term_id se asignan en orden de inserción: el dict ya está en orden de term_id
+        return cls(PackedVocabulary(vocabulary), offsets, idf_values, max_weights, ids, weights, sources)
+
+    @classmethod
+    def from_postings(cls, idf, postings, sources=0):
+        """Índice a partir de un dict término -> ([source_id, ...], [peso, ...])."""
+        return cls.from_rows(idf, ((term, source_id, weight) for term, (source_ids, weights) in postings.items()
+                                   for source_id, weight in zip(source_ids, weights)), sources)
+
+    @classmethod
+    def from_db(cls, db, idf, shard=None):
+        """Carga todas las listas de tfidf_postings en el orden de su clave; el
+        texto de cada término se lee una sola vez del diccionario. shard=(i, n):
+        solo las fuentes con source_id % n == i (shards.py)."""
+        where, params = ('', []) if shard is None else ('AND n.source_id % ? = ?', [shard[1], shard[0]])
+        cursor = db.cursor()
+        cursor.execute('SELECT term_id, term FROM tfidf_terms')
+        term_text = dict(cursor.fetchall())
+        cursor.execute(f'SELECT COUNT(*) FROM source_norms n WHERE n.norm > 0 {where}', params)
+        sources = cursor.fetchone()[0]
+        cursor.execute(f'''
+            SELECT p.term_id, p.source_id, p.tf / n.norm
+            FROM tfidf_postings p
+            JOIN source_norms n ON p.source_id = n.source_id
+            WHERE n.norm > 0 {where}
+            ORDER BY p.term_id, p.source_id
+        ''', params)
+        return cls.from_rows(idf, ((term_text[term_id], source_id, weight) for term_id, source_id, weight in cursor),
+                             sources)
+
+    @classmethod
+    def from_db_sources(cls, db, idf, source_ids):
+        """Solo las listas de las fuentes dadas, leídas por el índice de
+        tfidf_postings por fuente (las fuentes cambiadas desde la instantánea)."""
+        ids = json.dumps(sorted(source_ids))
+        cursor = db.cursor()
+        cursor.execute('SELECT COUNT(*) FROM source_norms WHERE norm > 0 AND source_id IN (SELECT value FROM json_each(?))',
+                       (ids,))
+        sources = cursor.fetchone()[0]
+        cursor.execute('''
+            SELECT t.term, p.source_id, p.tf / n.norm
+            FROM tfidf_postings p
+            JOIN source_norms n ON p.source_id = n.source_id
+            JOIN tfidf_terms t ON t.term_id = p.term_id
+            WHERE n.norm > 0 AND p.source_id IN (SELECT value FROM json_each(?))
+            ORDER BY p.term_id, p.source_id
+        ''', (ids,))
+        return cls.from_rows(idf, cursor, sources)
+
+    def entry(self, term):
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return None
+        value = self.idf_values[term_id]
+        return TermEntry(term_id, None if value != value else value, self.max_weights[term_id],
+                         self.offsets[term_id], self.offsets[term_id + 1])
+
+    def slice(self, entry):
+        """(ids, pesos) de un término como memoryview de su tramo (sin copia)."""
+        return self._ids_view[entry.start:entry.end], self._weights_view[entry.start:entry.end]
+
+    @property
+    def n_terms(self):
+        return len(self.vocabulary)
+
+    @property
+    def n_postings(self):
+        return len(self.ids)
+
+    @property
+    def n_sources(self):
+        return self.sources
+
+    def nbytes(self):
+        """Bytes de los arrays (sin el diccionario de términos)."""
+        return sum(a.itemsize * len(a) for a in (self.offsets, self.idf_values, self.max_weights,
+                                                  self.ids, self.weights))
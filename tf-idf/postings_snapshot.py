@@ -0,0 +1,104 @@
+"""Motor inverted sobre la instantánea mmap del índice (index_snapshot.py).
+
+open_postings() construye un postings_index.InvertedIndex cuyos buffers son
+vistas memoryview sobre el fichero mapeado (posting_ids, data, indptr,
+max_weights e idf de la instantánea): no se copia ni se decodifica nada, así
+que el servidor arranca en milisegundos sea cual sea el tamaño del corpus y
+varios procesos comparten las mismas páginas. No importa NumPy.
+
+Las fuentes indexadas o retiradas después de generar la instantánea
+(tfidf_changes con seq > change_seq) se leen de SQLite en un InvertedIndex
+pequeño y se ocultan en el de la instantánea (InvertedIndex.excluded);
+SnapshotOverlay puntúa los dos y mezcla sus top_k. En ese caso el IDF se lee
+entero de global_idf (una fila por término, no por posting), de modo que es
+exacto también para los términos que esas fuentes tenían y ya no tienen.
+"""
+from bisect import bisect_left
+from db_utils import get_db, read_generation, fetch_idf, SNAPSHOT_PATH
+from postings_index import InvertedIndex
+from snapshot_format import SnapshotError, TermDictionary, map_snapshot, section_view
+from search import score_index_weights, score_index_weights_facets, score_lists_batch, merge_top_k, _matcher
+
+
+def open_postings(path=SNAPSHOT_PATH):
+    """InvertedIndex sobre la instantánea, su cabecera y la vista de sus
+    source_ids (ordenados)."""
+    mm, header, sections = map_snapshot(path)
+
+    def view(name):
+        return section_view(mm, sections, name)
+
+    vocabulary = TermDictionary(view('term_offsets'), view('term_blob'))
+    index = InvertedIndex(vocabulary, view('indptr'), view('idf'), view('max_weights'), view('posting_ids'),
+                          view('data'), header['sources'])
+    index.generation = header['generation']
+    return index, header, view('source_ids')
+
+
+class SnapshotOverlay:
+    """Instantánea más las fuentes cambiadas después de generarla. Tiene la
+    interfaz de SparseIndex (score, score_batch, idf...), como ShardedIndex."""
+    engine = 'inverted'
+
+    def __init__(self, base, delta, idf, n_sources):
+        self.base = base
+        self.delta = delta
+        self.idf = idf
+        self.n_sources = n_sources
+        self.generation = base.generation
+        self.version = (0, 0)
+
+    @property
+    def attrs(self):
+        return self.base.attrs
+
+    @attrs.setter
+    def attrs(self, attrs):
+        self.base.attrs = attrs
+        self.delta.attrs = attrs
+
+    def score(self, weights, top_k=20, filters=None, min_score=0.0, counter=None):
+        if counter is None:
+            partials = [score_index_weights(part, weights, top_k, filters) for part in (self.base, self.delta)]
+        else:
+            partials = []
+            for part in (self.base, self.delta):
+                reply = score_index_weights_facets(part, weights, top_k, filters, min_score, counter.year_bucket)
+                counter.merge(reply['facets'])
+                partials.append(reply['results'])
+        return merge_top_k(partials, top_k)
+
+    def score_batch(self, weights_list, top_k=20, filters=None):
+        partials = [score_lists_batch(weights_list, part.postings, top_k, _matcher(part, filters))
+                    for part in (self.base, self.delta)]
+        return [merge_top_k(pair, top_k) for pair in zip(*partials)]
+
+
+def open_index(path=SNAPSHOT_PATH, db=None):
+    """Instantánea más las fuentes cambiadas después (ver SnapshotOverlay);
+    sin cambios, el InvertedIndex de la instantánea tal cual."""
+    base, header, source_ids = open_postings(path)
+    own_db = db is None
+    if own_db:
+        db = get_db()
+    try:
+        generation = read_generation(db)
+        if generation != base.generation:
+            raise SnapshotError(f'instantánea de la generación {base.generation}, el índice está en la {generation}')
+        cursor = db.cursor()
+        cursor.execute('SELECT DISTINCT source_id FROM tfidf_changes WHERE seq > ?', (header['change_seq'],))
+        changed = sorted(r[0] for r in cursor.fetchall())
+        if not changed:
+            return base
+        delta = InvertedIndex.from_db_sources(db, {}, changed)
+        idf = fetch_idf(cursor)
+    finally:
+        if own_db:
+            db.close()
+    base.excluded = frozenset(changed)
+    # las fuentes cambiadas que ya estaban en la instantánea dejan de contar en ella
+    present = 0
+    for source_id in changed:
+        i = bisect_left(source_ids, source_id)
+        present += i < len(source_ids) and source_ids[i] == source_id
+    return SnapshotOverlay(base, delta, idf, base.n_sources - present + delta.n_sources)
@@ -1,20 +1,248 @@
+import os
 import re
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer
+import json
+import time
 
-stemmer = SnowballStemmer('spanish')
-stop_words = set(stopwords.words('spanish'))
+# NLTK (≈0,25 s de importación, arrastra numpy) solo se carga si hace falta: las
+# stopwords y las raíces del vocabulario del corpus se leen del léxico que
+# genera recalc_idf.py, y el stemmer solo se construye ante una palabra nueva.
+# Sin léxico (antes del primer reindexado) las stopwords salen de spanish_stopwords.py.
+LEXICON_PATH = os.environ.get('TFIDF_LEXICON') or os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', 'database', 'tfidf_lexicon.json'))
+LEXICON_VERSION = 1
 
-def preprocess(text: str) -> list[str]:
-    # minúsculas
-    text = text.lower()
-    # solo letras (incluye acentos y ñ)
-    text = re.sub(r'[^a-záéíóúüñ]', ' ', text)
-    # tokenizar
-    tokens = text.split()
+# solo letras (incluye acentos y ñ)
+NON_LETTERS = re.compile(r'[^a-záéíóúüñ]')
+
+# Caché de raíces: palabra -> raíz. Un reindexado repite las mismas pocas miles
+# de palabras millones de veces; al llenarse se descartan las más antiguas.
+STEM_CACHE_SIZE = int(os.environ.get('TFIDF_STEM_CACHE_SIZE', 100000))
+# Fichero opcional donde conservar la caché entre ejecuciones (load/save_stem_cache)
+STEM_CACHE_PATH = os.environ.get('TFIDF_STEM_CACHE')
+
+_stem_cache = {}
+# Raíces calculadas desde el último take_new_stems (los procesos de un pool las
+# devuelven al principal para que save_stem_cache las conserve)
+_new_stems = {}
+_stats = {'documents': 0, 'tokens': 0, 'stem_hits': 0, 'stem_misses': 0, 'seconds': 0.0}
+
+_stop_words = None
+_stemmer = None
+# Versión de NLTK con la que se generaron las raíces del léxico cargado
+_lexicon_nltk = None
+
+
+def _seed_stems(entries):
+    # Precarga raíces ya calculadas (las más recientes si no caben todas)
+    if STEM_CACHE_SIZE <= 0:
+        return
+    items = list(entries.items())
+    _stem_cache.update(items[-STEM_CACHE_SIZE:])
+    while len(_stem_cache) > STEM_CACHE_SIZE:
+        del _stem_cache[next(iter(_stem_cache))]
+
+
+def load_lexicon(path=None):
+    """Carga stopwords y raíces del léxico; sin léxico válido usa las stopwords
+    de NLTK copiadas en spanish_stopwords.py. Se llama sola en el primer preprocesado."""
+    global _stop_words, _lexicon_nltk
+    try:
+        with open(path or LEXICON_PATH, encoding='utf-8') as f:
+            lexicon = json.load(f)
+        if lexicon.get('version') != LEXICON_VERSION:
+            raise ValueError('versión de léxico no soportada')
+        stop_words = set(lexicon['stopwords'])
+        # palabras y raíces en dos cadenas paralelas separadas por espacios: se
+        # cargan bastante más rápido que un objeto JSON con una clave por palabra
+        words, roots = lexicon['words'].split(), lexicon['stems'].split()
+        if len(words) != len(roots):
+            raise ValueError('léxico corrupto')
+        stems = dict(zip(words, roots))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        from spanish_stopwords import STOPWORDS
+        _stop_words = set(STOPWORDS)
+        return 0
+    _stop_words = stop_words
+    _lexicon_nltk = lexicon.get('nltk')
+    _seed_stems(stems)
+    return len(stems)
+
+
+def _get_stemmer():
+    global _stemmer
+    if _stemmer is None:
+        from nltk.stem import SnowballStemmer
+        _stemmer = SnowballStemmer('spanish')
+    return _stemmer
+
+
+def save_lexicon(path=None):
+    """Escribe el léxico de arranque (escritura atómica): las stopwords de NLTK
+    y las raíces de la caché, que tras un reindexado cubren el vocabulario del
+    corpus. Si las raíces cargadas vienen de otra versión de NLTK se recalculan."""
+    import nltk
+    from nltk.corpus import stopwords
+    path = path or LEXICON_PATH
+    if _lexicon_nltk is not None and _lexicon_nltk != nltk.__version__:
+        stemmer = _get_stemmer()
+        for token in _stem_cache:
+            _stem_cache[token] = stemmer.stem(token)
+    # (una raíz vacía descuadraría las dos listas: esa palabra se queda fuera)
+    entries = {token: root for token, root in _stem_cache.items() if root}
+    lexicon = {
+        'version': LEXICON_VERSION,
+        'nltk': nltk.__version__,
+        'stopwords': sorted(stopwords.words('spanish')),
+        'words': ' '.join(entries),
+        'stems': ' '.join(entries.values()),
+    }
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(lexicon, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+def ensure_lexicon(path=None):
+    """Escribe un primer léxico si aún no hay ninguno (antes del primer
+    reindexado), con las raíces calculadas en este proceso, para que los
+    siguientes no vuelvan a NLTK con esas palabras. None si ya existía."""
+    path = path or LEXICON_PATH
+    if os.path.exists(path):
+        return None
+    return save_lexicon(path)
+
+
+def stem(token):
+    root = _stem_cache.get(token)
+    if root is not None:
+        _stats['stem_hits'] += 1
+        return root
+    _stats['stem_misses'] += 1
+    root = _get_stemmer().stem(token)
+    _new_stems[token] = root
+    if STEM_CACHE_SIZE > 0:
+        if len(_stem_cache) >= STEM_CACHE_SIZE:
+            # descartar la entrada más antigua (los dict conservan el orden de inserción)
+            del _stem_cache[next(iter(_stem_cache))]
+        _stem_cache[token] = root
+    return root
+
+
+def _tokens(text, stop_words):
+    # minúsculas, solo letras y tokenizar
+    tokens = NON_LETTERS.sub(' ', text.lower()).split()
     # filtrar palabras cortas y stopwords
-    tokens = [t for t in tokens if len(t) > 2 and t not in stop_words]
-    # stemming
-    tokens = [stemmer.stem(t) for t in tokens]
-    return tokens
\ No newline at end of file
+    return [t for t in tokens if len(t) > 2 and t not in stop_words]
+
+
+def stop_words():
+    """Stopwords del léxico (o las de spanish_stopwords.py sin léxico), cargadas la primera vez."""
+    if _stop_words is None:
+        load_lexicon()
+    return _stop_words
+
+
+def preprocess(text: str) -> list[str]:
+    return preprocess_batch([text])[0]
+
+
+def preprocess_batch(texts) -> list[list[str]]:
+    """Preprocesa varios documentos en una llamada (mismo resultado que
+    preprocess en cada uno), compartiendo la caché de raíces."""
+    started = time.perf_counter()
+    if _stop_words is None:
+        load_lexicon()
+    stop_words = _stop_words
+    cache = _stem_cache
+    out = []
+    tokens_seen = 0
+    for text in texts:
+        tokens = _tokens(text, stop_words)
+        tokens_seen += len(tokens)
+        # stemming (la caché se consulta en línea: es el bucle más caliente)
+        terms = []
+        for t in tokens:
+            root = cache.get(t)
+            if root is None:
+                root = stem(t)
+            else:
+                _stats['stem_hits'] += 1
+            terms.append(root)
+        out.append(terms)
+    _stats['documents'] += len(out)
+    _stats['tokens'] += tokens_seen
+    _stats['seconds'] += time.perf_counter() - started
+    return out
+
+
+def stats(raw=None):
+    """Estadísticas de tokenización para dimensionar la caché: las acumuladas en
+    este proceso o las de `raw` (contadores sumados con merge_stats)."""
+    raw = _stats if raw is None else raw
+    lookups = raw.get('stem_hits', 0) + raw.get('stem_misses', 0)
+    info = {key: raw.get(key, 0) for key in _stats}
+    info['seconds'] = round(info['seconds'], 3)
+    info['stem_cache_size'] = len(_stem_cache)
+    info['stem_cache_max'] = STEM_CACHE_SIZE
+    info['stem_hit_rate'] = round(info['stem_hits'] / lookups, 4) if lookups else 0.0
+    info['tokens_per_sec'] = round(info['tokens'] / raw['seconds']) if raw.get('seconds') else 0
+    return info
+
+
+def take_stats():
+    # Devuelve los contadores y los pone a cero (para sumar los de varios procesos)
+    info = dict(_stats)
+    for key in _stats:
+        _stats[key] = 0
+    _stats['seconds'] = 0.0
+    return info
+
+
+def take_new_stems():
+    new = dict(_new_stems)
+    _new_stems.clear()
+    return new
+
+
+def remember_stems(stems):
+    # Añade a la caché raíces calculadas en otro proceso (sin contar aciertos ni fallos)
+    if STEM_CACHE_SIZE <= 0:
+        return
+    for token, root in stems.items():
+        if token not in _stem_cache:
+            if len(_stem_cache) >= STEM_CACHE_SIZE:
+                del _stem_cache[next(iter(_stem_cache))]
+            _stem_cache[token] = root
+
+
+def merge_stats(total, part):
+    for key, value in part.items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+
+def load_stem_cache(path=None):
+    """Carga una caché de raíces guardada con save_stem_cache (si existe)."""
+    path = path or STEM_CACHE_PATH
+    if not path or not os.path.exists(path) or STEM_CACHE_SIZE <= 0:
+        return 0
+    try:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    _seed_stems(entries)
+    return len(_stem_cache)
+
+
+def save_stem_cache(path=None):
+    """Guarda la caché de raíces (escritura atómica) para la próxima ejecución."""
+    path = path or STEM_CACHE_PATH
+    if not path:
+        return 0
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_stem_cache, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return len(_stem_cache)
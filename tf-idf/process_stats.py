@@ -0,0 +1,30 @@
+"""Memoria del proceso actual para los informes de carga del índice
+(search_server.py, shards.py): RSS actual y pico del proceso (high-water
+mark), en MB. Donde no hay /proc o el módulo resource (Windows) valen None.
+"""
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _mb(n_bytes):
+    return None if n_bytes is None else round(n_bytes / (1 << 20), 1)
+
+
+def memory_usage():
+    rss = peak = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # ru_maxrss: KB en Linux, bytes en macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    if peak is not None and rss is not None:
+        peak = max(peak, rss)       # ru_maxrss se actualiza con retraso respecto a statm
+    return {'rss_mb': _mb(rss), 'max_rss_mb': _mb(peak)}
@@ -1,63 +1,535 @@
+import os
+import sys
+import json
 import math
-from collections import defaultdict
-from db_utils import get_db
+import time
+import argparse
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from db_utils import (get_db, ensure_schema, read_generation, read_meta, compute_idf, fetch_norm_idf,
+                      hold_changes, release_changes, GENERATION_SQL, INDEX_TABLES, SNAPSHOT_PATH)
+import preprocess as text_pipeline
 from preprocess import preprocess
-from index_source import index_source
+from index_source import build_document, term_frequencies, update_doc_freq, compute_vector, write_vector
+from index_snapshot import build_snapshot
+from display_records import rebuild_display
+from fingerprints import rebuild_fingerprints
 
+# Filas de TF acumuladas antes de cada executemany (acota la memoria)
+BATCH_SIZE = 20000
+# Fuentes por bloque enviado a cada proceso de tokenización
+CHUNK_SIZE = 500
 
-def recalc_idf():
+# Desviación relativa del IDF a partir de la cual se recalculan las normas
+# de las fuentes que contienen el término (refresh_norms)
+NORM_TOLERANCE = 0.01
+
+# Sufijos de las tablas de la generación en construcción y de la anterior
+# (también de la clave total_docs de tfidf_meta)
+SHADOW = '_next'
+OLD = '_old'
+
+# Código de salida de --check cuando los contadores están desviados (cron.js
+# reindexa solo con este): 1 queda para cualquier excepción sin capturar
+DRIFT_EXIT = 3
+
+SOURCES_SQL = '''
+    SELECT s.id, s.title,
+           GROUP_CONCAT(DISTINCT a.full_name) as authors,
+           s.keywords as keywords
+    FROM sources s
+    LEFT JOIN source_authors sa ON s.id = sa.source_id
+    LEFT JOIN authors a ON sa.author_id = a.id
+    WHERE s.is_active = 1 {where}
+    GROUP BY s.id
+'''
+
+
+def tokenize_rows(rows):
+    """Tokeniza un bloque de fuentes en una sola llamada a preprocess_batch:
+    ([(source_id, [(término, tf), ...], n_tokens)], contadores de tokenización,
+    raíces nuevas calculadas)."""
+    # documento virtual igual que en indexación
+    batch = text_pipeline.preprocess_batch([build_document(title, authors, keywords)
+                                            for _, title, authors, keywords in rows])
+    out = [(row[0], list(term_frequencies(terms).items()), len(terms)) for row, terms in zip(rows, batch)]
+    return out, text_pipeline.take_stats(), text_pipeline.take_new_stems()
+
+
+def tokenized_sources(cursor, workers=1, stats=None):
+    """Lee las fuentes del cursor por bloques y las tokeniza, en serie o en un
+    pool de procesos. Los resultados vuelven en el orden de lectura y como mucho
+    hay 2 × workers bloques en vuelo, así que la memoria sigue acotada. Los
+    contadores de tokenización de todos los procesos se suman en `stats`."""
+    if stats is None:
+        stats = {}
+
+    def collect(result):
+        out, part, new_stems = result
+        text_pipeline.merge_stats(stats, part)
+        if workers > 1:
+            text_pipeline.remember_stems(new_stems)
+        return out
+
+    def chunks():
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                return
+            yield rows
+
+    if workers <= 1:
+        for rows in chunks():
+            yield from collect(tokenize_rows(rows))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for rows in chunks():
+            pending.append(pool.submit(tokenize_rows, rows))
+            if len(pending) >= workers * 2:
+                yield from collect(pending.popleft().result())
+        while pending:
+            yield from collect(pending.popleft().result())
+
+
+def _drop_generation(cursor, suffix):
+    for table in INDEX_TABLES:
+        cursor.execute(f'DROP TABLE IF EXISTS {table}{suffix}')
+
+
+def _catch_up(cursor, start_seq):
+    """Aplica a la generación nueva las fuentes indexadas mientras se construía
+    (tfidf_changes con seq > start_seq). Se ejecuta dentro de la transacción del
+    cambio de generación, así que nada puede colarse entre medias."""
+    cursor.execute('SELECT DISTINCT source_id FROM tfidf_changes WHERE seq > ?', (start_seq,))
+    changed = [r[0] for r in cursor.fetchall()]
+    if not changed:
+        return 0
+    cursor.execute(SOURCES_SQL.format(where=f"AND s.id IN ({','.join('?' * len(changed))})"), changed)
+    rows = cursor.fetchall()
+    for source_id, title, authors, keywords in rows:
+        terms = preprocess(build_document(title, authors, keywords))
+        update_doc_freq(cursor, source_id, terms, SHADOW)
+        idf_map = fetch_norm_idf(cursor, terms, SHADOW)
+        tf_map, weights, norm = compute_vector(terms, idf_map)
+        write_vector(cursor, source_id, tf_map, weights, norm, idf_map, SHADOW)
+    # Fuentes borradas o desactivadas durante la reconstrucción
+    for source_id in set(changed) - {r[0] for r in rows}:
+        update_doc_freq(cursor, source_id, None, SHADOW)
+        cursor.execute(f'DELETE FROM tfidf_postings{SHADOW} WHERE source_id = ?', (source_id,))
+        cursor.execute(f'DELETE FROM source_norms{SHADOW} WHERE source_id = ?', (source_id,))
+    return len(changed)
+
+
+def recalc_idf(batch_size=BATCH_SIZE, workers=1, stem_cache=None):
+    """Reindexado completo en bloque sobre una generación nueva del índice.
+
+    Recorre las fuentes con un cursor (sin fetchall) y tokeniza cada documento
+    una sola vez: su TF se vuelca por lotes a una tabla temporal mientras se
+    cuentan las frecuencias de documento. Después IDF, vectores, normas y cotas
+    se escriben en bloque en tablas sombra (*_next), en transacciones cortas que
+    no bloquean las subidas. La memoria queda acotada por el vocabulario y el
+    tamaño de lote, no por el corpus.
+
+    Las búsquedas siguen leyendo la generación anterior hasta que una única
+    transacción corta renombra las tablas sombra a las vivas; las tablas de la
+    generación anterior se eliminan a continuación.
+
+    Con workers > 1 la tokenización y el TF se reparten en un pool de procesos;
+    este proceso sigue siendo el único escritor y el resultado es idéntico al serie.
+    La caché de raíces se carga de `stem_cache` (o TFIDF_STEM_CACHE) antes de
+    tokenizar, la heredan los procesos del pool, y se guarda al terminar.
+    """
+    started = time.perf_counter()
+    text_pipeline.load_stem_cache(stem_cache)
     db = get_db()
+    ensure_schema(db)
+    db.create_function('sqrt', 1, math.sqrt, deterministic=True)
     cursor = db.cursor()
-    
-    # 1. Obtener todas las fuentes con sus metadatos
+
+    # 0. Generación nueva: tablas sombra vacías (restos de ejecuciones fallidas fuera)
+    generation = read_generation(db) + 1
+    start_seq = hold_changes(db, 'recalc')
+    _drop_generation(cursor, SHADOW)
+    _drop_generation(cursor, OLD)
+    db.commit()
+    db.executescript(GENERATION_SQL.format(suffix=SHADOW, generation=generation))
+    cursor.execute('DROP TABLE IF EXISTS temp.doc_terms')
     cursor.execute('''
-        SELECT s.id, s.title,
-               GROUP_CONCAT(DISTINCT a.full_name) as authors,
-               s.keywords as keywords
-        FROM sources s
-        LEFT JOIN source_authors sa ON s.id = sa.source_id
-        LEFT JOIN authors a ON sa.author_id = a.id
-        GROUP BY s.id
+        CREATE TEMP TABLE doc_terms (
+            source_id INTEGER NOT NULL,
+            term_id INTEGER NOT NULL,
+            tf INTEGER NOT NULL
+        )
     ''')
-    rows = cursor.fetchall()
-    
-    total_docs = len(rows)
+
+    # 1. Una pasada por las fuentes: TF de cada documento y frecuencia de documento
+    total_docs = 0
+    total_tokens = 0
+    total_postings = 0
     # Mapa término -> número de documentos que lo contienen
     doc_freq = defaultdict(int)
-    
-    for source_id, title, authors, keywords in rows:
-        # reconstruir documento virtual igual que en indexación
-        doc_parts = [title] * 3
-        if authors:
-            doc_parts.append(authors)
-        if keywords:
-            doc_parts.extend([keywords] * 2)
-        text = ' '.join(doc_parts)
-        terms = set(preprocess(text))   # términos únicos de este documento
-        for t in terms:
+    # Diccionario término -> term_id de la generación nueva (en orden de aparición)
+    dictionary = {}
+    # Fuentes sin términos útiles: norma 0, igual que en index_source
+    empty_sources = []
+    batch = []
+    sources = db.cursor()
+    sources.execute(SOURCES_SQL.format(where=''))
+    token_stats = {}
+    for source_id, tf_items, n_tokens in tokenized_sources(sources, workers, token_stats):
+        total_docs += 1
+        total_tokens += n_tokens
+        if not tf_items:
+            empty_sources.append((source_id,))
+        for t, tf in tf_items:
             doc_freq[t] += 1
-    
-    # 2. Calcular IDF y actualizar global_idf
-    cursor.execute('DELETE FROM global_idf')
-    for term, freq in doc_freq.items():
-        idf = math.log((total_docs or 1) / (1 + freq))
-        cursor.execute('''
-            INSERT INTO global_idf (term, idf, doc_freq, updated_at)
+            term_id = dictionary.get(t)
+            if term_id is None:
+                term_id = dictionary[t] = len(dictionary) + 1
+            batch.append((source_id, term_id, tf))
+        if len(batch) >= batch_size:
+            cursor.executemany('INSERT INTO temp.doc_terms (source_id, term_id, tf) VALUES (?, ?, ?)', batch)
+            total_postings += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany('INSERT INTO temp.doc_terms (source_id, term_id, tf) VALUES (?, ?, ?)', batch)
+        total_postings += len(batch)
+    db.commit()
+    tokenized = time.perf_counter()
+
+    # 2. IDF, vectores, normas y cotas en la generación sombra, por lotes con commit
+    try:
+        cursor.execute('INSERT OR REPLACE INTO tfidf_meta (key, value) VALUES (?, ?)', (f'total_docs{SHADOW}', total_docs))
+        idf_rows = []
+        for term, freq in doc_freq.items():
+            idf_rows.append((term, compute_idf(freq, total_docs), freq))
+            if len(idf_rows) >= batch_size:
+                cursor.executemany(f'''
+                    INSERT INTO global_idf{SHADOW} (term, idf, doc_freq, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ''', idf_rows)
+                db.commit()
+                idf_rows = []
+        cursor.executemany(f'''
+            INSERT INTO global_idf{SHADOW} (term, idf, doc_freq, updated_at)
             VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (term, idf, freq))
-    
+        ''', idf_rows)
+        db.commit()
+
+        cursor.executemany(f'INSERT INTO tfidf_terms{SHADOW} (term_id, term) VALUES (?, ?)',
+                           [(term_id, t) for t, term_id in dictionary.items()])
+        db.commit()
+
+        # Postings en el orden de su clave (term_id, source_id), por tramos de
+        # términos de unos batch_size postings cada uno
+        cursor.execute('CREATE INDEX temp.doc_terms_key ON doc_terms (term_id, source_id, tf)')
+        db.commit()
+        by_id = sorted((term_id, doc_freq[t]) for t, term_id in dictionary.items())
+        low = 1
+        pending = 0
+        for term_id, freq in by_id:
+            pending += freq
+            if pending >= batch_size or term_id == len(by_id):
+                cursor.execute(f'''
+                    INSERT INTO tfidf_postings{SHADOW} (term_id, source_id, tf)
+                    SELECT term_id, source_id, tf FROM temp.doc_terms
+                    WHERE term_id BETWEEN ? AND ?
+                    ORDER BY term_id, source_id
+                ''', (low, term_id))
+                db.commit()
+                low, pending = term_id + 1, 0
+
+        # Normas: doc_terms tiene las filas de cada fuente seguidas (SOURCES_SQL las
+        # lee agrupadas por fuente), así que se acumulan por tramos de rowid
+        # arrastrando a la siguiente tanda la fuente que queda a medias
+        idf_by_id = {term_id: compute_idf(doc_freq[t], total_docs) for t, term_id in dictionary.items()}
+        cursor.execute('SELECT COALESCE(MAX(rowid), 0) FROM temp.doc_terms')
+        last_row = cursor.fetchone()[0]
+        current, norm_sq = None, 0.0
+        for low in range(1, last_row + 1, batch_size):
+            cursor.execute('SELECT source_id, term_id, tf FROM temp.doc_terms WHERE rowid BETWEEN ? AND ?',
+                           (low, low + batch_size - 1))
+            norms = []
+            for source_id, term_id, tf in cursor.fetchall():
+                if source_id != current:
+                    if current is not None:
+                        norms.append((current, math.sqrt(norm_sq)))
+                    current, norm_sq = source_id, 0.0
+                w = tf * idf_by_id[term_id]
+                norm_sq += w * w
+            cursor.executemany(f'INSERT INTO source_norms{SHADOW} (source_id, norm) VALUES (?, ?)', norms)
+            db.commit()
+        if current is not None:
+            cursor.execute(f'INSERT INTO source_norms{SHADOW} (source_id, norm) VALUES (?, ?)',
+                           (current, math.sqrt(norm_sq)))
+        cursor.executemany(f'INSERT INTO source_norms{SHADOW} (source_id, norm) VALUES (?, 0)', empty_sources)
+        db.commit()
+
+        # Cotas exactas de tf / norm por término (poda MaxScore)
+        cursor.execute(f'''
+            SELECT t.term, MAX(p.tf / n.norm)
+            FROM tfidf_postings{SHADOW} p
+            JOIN source_norms{SHADOW} n ON p.source_id = n.source_id
+            JOIN tfidf_terms{SHADOW} t ON t.term_id = p.term_id
+            WHERE n.norm > 0
+            GROUP BY p.term_id
+        ''')
+        max_weights = cursor.fetchall()
+        cursor.executemany(f'INSERT INTO term_max_weights{SHADOW} (term, max_weight) VALUES (?, ?)', max_weights)
+        db.commit()
+        cursor.execute('DROP TABLE temp.doc_terms')
+        written = time.perf_counter()
+
+        # 3. Cambio de generación: una sola transacción corta
+        cursor.execute('BEGIN IMMEDIATE')
+        caught_up = _catch_up(cursor, start_seq)
+        for table in INDEX_TABLES:
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {table}{OLD}')
+            cursor.execute(f'ALTER TABLE {table}{SHADOW} RENAME TO {table}')
+        cursor.execute("UPDATE tfidf_meta SET value = ? WHERE key = 'generation'", (generation,))
+        cursor.execute(f'''
+            UPDATE tfidf_meta SET value = (SELECT value FROM tfidf_meta WHERE key = 'total_docs{SHADOW}')
+            WHERE key = 'total_docs'
+        ''')
+        cursor.execute(f"DELETE FROM tfidf_meta WHERE key = 'total_docs{SHADOW}'")
+        release_changes(cursor, 'recalc')
+        db.commit()
+    except Exception:
+        db.rollback()
+        _drop_generation(cursor, SHADOW)
+        cursor.execute(f"DELETE FROM tfidf_meta WHERE key = 'total_docs{SHADOW}'")
+        release_changes(cursor, 'recalc')
+        db.commit()
+        db.close()
+        raise
+    swapped = time.perf_counter()
+
+    # 4. Recolectar la generación anterior y rehacer los registros de presentación
+    #    de los resultados (los triggers los mantienen al día a partir de aquí) y
+    #    las huellas de duplicado exacto
+    for table in INDEX_TABLES:
+        cursor.execute(f'DROP TABLE IF EXISTS {table}{OLD}')
+        db.commit()
+    display_records = rebuild_display(db)
+    fingerprints = rebuild_fingerprints(db)
     db.commit()
-    
-    # 3. Reindexar todas las fuentes con los nuevos IDF
-    for source_id, title, authors, keywords in rows:
-        # volver a calcular vector y norma
+
+    # 5. Instantánea mmap para que la búsqueda arranque sin leer SQLite
+    try:
+        info = build_snapshot(SNAPSHOT_PATH, db)
+        print(f"Instantánea del índice escrita: {info['terms']} términos, {info['postings']} postings")
+    except Exception as e:
+        print(f"Error escribiendo la instantánea del índice: {e}")
+        # Una instantánea antigua ya no describe estos vectores: la búsqueda volverá a SQLite
+        if os.path.exists(SNAPSHOT_PATH):
+            os.remove(SNAPSHOT_PATH)
+
+    db.close()
+    text_pipeline.save_stem_cache(stem_cache)
+    # 6. Léxico de arranque rápido de preprocess.py (stopwords + raíces del corpus)
+    try:
+        stems = text_pipeline.save_lexicon()
+        print(f"Léxico de arranque escrito: {stems} raíces")
+    except Exception as e:
+        print(f"Error escribiendo el léxico de arranque: {e}")
+    elapsed = time.perf_counter() - started
+    pipeline = text_pipeline.stats(token_stats)
+    stats = {
+        'generation': generation,
+        'sources': total_docs,
+        'tokens': total_tokens,
+        'postings': total_postings,
+        'terms': len(doc_freq),
+        'workers': workers,
+        'caught_up': caught_up,
+        'display_records': display_records,
+        'fingerprints': fingerprints,
+        'tokenize_s': round(tokenized - started, 3),
+        'write_s': round(written - tokenized, 3),
+        'swap_ms': round((swapped - written) * 1000, 1),
+        'total_s': round(elapsed, 3),
+        'preprocess': pipeline,
+    }
+    rate = elapsed or 1e-9
+    print(f"Fuentes: {total_docs} ({total_docs / rate:.0f}/s), tokens: {total_tokens} ({total_tokens / rate:.0f}/s), "
+          f"postings: {total_postings}, términos: {len(doc_freq)}")
+    print(f"Tokenización {stats['tokenize_s']}s ({workers} proceso(s)), escritura {stats['write_s']}s, "
+          f"cambio de generación {stats['swap_ms']}ms ({caught_up} fuente(s) al día), total {stats['total_s']}s")
+    print(f"Preprocesado: {pipeline['tokens']} tokens en {pipeline['seconds']}s ({pipeline['tokens_per_sec']}/s por proceso), "
+          f"caché de raíces {pipeline['stem_hit_rate']:.1%} de aciertos ({pipeline['stem_misses']} fallos)")
+    print(f"IDF recalculado y vectores actualizados (generación {generation})")
+    return stats
+
+def refresh_norms(tolerance=NORM_TOLERANCE):
+    """Actualiza las normas al IDF vigente sin reescribir los vectores.
+
+    Los postings guardan el TF y la búsqueda aplica el IDF actual, así que un
+    cambio de IDF solo afecta a las normas. Se toman los términos cuyo IDF
+    derivado de los contadores se ha alejado de su IDF de referencia
+    (global_idf.idf) más que `tolerance` (relativa; 0 = todos los que cambiaron)
+    y, con sentencias en bloque en una sola transacción, se mueve su referencia,
+    se recalcula la norma solo de las fuentes que los contienen y las cotas
+    MaxScore de los términos de esas fuentes."""
+    started = time.perf_counter()
+    db = get_db()
+    ensure_schema(db)
+    db.create_function('sqrt', 1, math.sqrt, deterministic=True)
+    cursor = db.cursor()
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS drift (term TEXT PRIMARY KEY, idf REAL NOT NULL)')
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS touched (term_id INTEGER PRIMARY KEY)')
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS renormed (source_id INTEGER PRIMARY KEY)')
+    db.commit()
+
+    cursor.execute('BEGIN IMMEDIATE')
+    total_docs = read_meta(cursor, 'total_docs')
+    cursor.execute('SELECT term, idf, doc_freq FROM global_idf')
+    rows = cursor.fetchall()
+    drifted = []
+    for term, norm_idf, freq in rows:
+        idf = compute_idf(freq, total_docs)
+        if abs(idf - norm_idf) > tolerance * abs(norm_idf):
+            drifted.append((term, idf))
+    cursor.execute('DELETE FROM temp.drift')
+    cursor.execute('DELETE FROM temp.renormed')
+    cursor.execute('DELETE FROM temp.touched')
+    cursor.executemany('INSERT INTO temp.drift (term, idf) VALUES (?, ?)', drifted)
+    cursor.execute('''
+        UPDATE global_idf
+        SET idf = (SELECT d.idf FROM temp.drift d WHERE d.term = global_idf.term),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE term IN (SELECT term FROM temp.drift)
+    ''')
+    cursor.execute('''
+        INSERT INTO temp.renormed (source_id)
+        SELECT DISTINCT p.source_id FROM temp.drift d
+        JOIN tfidf_terms t ON t.term = d.term
+        JOIN tfidf_postings p ON p.term_id = t.term_id
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO source_norms (source_id, norm)
+        SELECT p.source_id, sqrt(SUM(p.tf * g.idf * p.tf * g.idf))
+        FROM tfidf_postings p
+        JOIN tfidf_terms t ON t.term_id = p.term_id
+        JOIN global_idf g ON g.term = t.term
+        WHERE p.source_id IN (SELECT source_id FROM temp.renormed)
+        GROUP BY p.source_id
+    ''')
+    # Las cotas de tf / norm dependen de las normas: recalcular las de los términos afectados
+    cursor.execute('''
+        INSERT INTO temp.touched (term_id)
+        SELECT DISTINCT term_id FROM tfidf_postings
+        WHERE source_id IN (SELECT source_id FROM temp.renormed)
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO term_max_weights (term, max_weight)
+        SELECT t.term, MAX(p.tf / n.norm)
+        FROM temp.touched x
+        JOIN tfidf_terms t ON t.term_id = x.term_id
+        JOIN tfidf_postings p ON p.term_id = x.term_id
+        JOIN source_norms n ON p.source_id = n.source_id
+        WHERE n.norm > 0
+        GROUP BY x.term_id
+    ''')
+    # La instantánea mmap debe dejar de usar las normas antiguas de esas fuentes
+    cursor.execute('INSERT INTO tfidf_changes (source_id) SELECT source_id FROM temp.renormed')
+    cursor.execute('SELECT COUNT(*) FROM temp.renormed')
+    renormed = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM source_norms')
+    total_sources = cursor.fetchone()[0]
+    db.commit()
+    written = time.perf_counter()
+
+    if renormed:
         try:
-            index_source(source_id, title, authors or '', keywords or '')
+            build_snapshot(SNAPSHOT_PATH, db)
         except Exception as e:
-            print(f"Error reindexando fuente {source_id}: {e}")
-    
+            print(f"Error escribiendo la instantánea del índice: {e}")
+            if os.path.exists(SNAPSHOT_PATH):
+                os.remove(SNAPSHOT_PATH)
+    db.close()
+    stats = {
+        'tolerance': tolerance,
+        'terms': len(rows),
+        'drifted_terms': len(drifted),
+        'sources': total_sources,
+        'renormed_sources': renormed,
+        'write_s': round(written - started, 3),
+        'total_s': round(time.perf_counter() - started, 3),
+    }
+    print(json.dumps(stats))
+    return stats
+
+def check_counts():
+    """Comprobación de consistencia de los contadores incrementales: compara
+    doc_freq y total_docs con lo que hay realmente en tfidf_postings/source_norms
+    y con las fuentes activas. Solo lee; un recálculo completo corrige la deriva."""
+    db = get_db()
+    ensure_schema(db)
+    cursor = db.cursor()
+    cursor.execute('BEGIN')
+    cursor.execute('''
+        SELECT COUNT(*), COALESCE(SUM(ABS(COALESCE(g.doc_freq, 0) - c.n)), 0)
+        FROM (SELECT t.term, c.n FROM (SELECT term_id, COUNT(*) AS n FROM tfidf_postings GROUP BY term_id) c
+              JOIN tfidf_terms t ON t.term_id = c.term_id) c
+        LEFT JOIN global_idf g ON g.term = c.term
+        WHERE g.doc_freq IS NULL OR g.doc_freq != c.n
+    ''')
+    drifted_terms, doc_freq_drift = cursor.fetchone()
+    cursor.execute('''
+        SELECT COUNT(*) FROM global_idf g
+        WHERE NOT EXISTS (SELECT 1 FROM tfidf_terms t JOIN tfidf_postings p ON p.term_id = t.term_id
+                          WHERE t.term = g.term)
+    ''')
+    orphan_terms = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM source_norms')
+    indexed = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT COUNT(*) FROM sources s
+        WHERE s.is_active = 1 AND NOT EXISTS (SELECT 1 FROM source_norms n WHERE n.source_id = s.id)
+    ''')
+    missing = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT COUNT(*) FROM source_norms n
+        WHERE NOT EXISTS (SELECT 1 FROM sources s WHERE s.id = n.source_id AND s.is_active = 1)
+    ''')
+    stale = cursor.fetchone()[0]
+    total_docs = read_meta(cursor, 'total_docs')
+    db.rollback()
     db.close()
-    print("IDF recalculado y vectores actualizados")
+    report = {
+        'total_docs': total_docs,
+        'indexed_sources': indexed,
+        'drifted_terms': drifted_terms,
+        'doc_freq_drift': doc_freq_drift,
+        'orphan_terms': orphan_terms,
+        'missing_sources': missing,
+        'stale_sources': stale,
+    }
+    report['consistent'] = (total_docs == indexed and not drifted_terms and not orphan_terms
+                            and not missing and not stale)
+    print(json.dumps(report))
+    return report
 
 if __name__ == '__main__':
-    recalc_idf()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Recalcula IDF y reindexa todas las fuentes')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='procesos de tokenización (1 = serie)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='filas de TF por executemany')
+    parser.add_argument('--stem-cache', default=None,
+                        help='fichero donde conservar la caché de raíces entre ejecuciones (o TFIDF_STEM_CACHE)')
+    parser.add_argument('--check', action='store_true',
+                        help=f'solo comprobar los contadores incrementales (sale con {DRIFT_EXIT} si hay deriva)')
+    parser.add_argument('--refresh-norms', action='store_true',
+                        help='solo actualizar las normas al IDF vigente (sin reescribir vectores)')
+    parser.add_argument('--tolerance', type=float, default=NORM_TOLERANCE,
+                        help='desviación relativa del IDF que obliga a recalcular normas (0 = cualquier cambio)')
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if check_counts()['consistent'] else DRIFT_EXIT)
+    if args.refresh_norms:
+        refresh_norms(max(0.0, args.tolerance))
+        sys.exit(0)
+    recalc_idf(batch_size=args.batch_size, workers=max(1, args.workers), stem_cache=args.stem_cache)
@@ -0,0 +1,359 @@
+"""Fuentes relacionadas precalculadas (tabla related_sources).
+
+Para cada fuente se guardan sus top_n vecinos por similitud de coseno entre
+vectores TF-IDF (tf / norm × IDF vigente), de modo que la página de una fuente
+lee sus relacionadas en lugar de lanzar una búsqueda por visita.
+
+El cálculo completo (build_related) es el autoproducto disperso XᵀX de la
+matriz términos × fuentes de sparse_index.py, por bloques de fuentes: las
+filas de postings de los términos de cada bloque se expanden y se acumulan con
+un bincount sobre una matriz densa bloque × fuentes (acotada a --block-cells
+celdas), y de cada fila se elige el top_n con argpartition. Los bloques se
+reparten entre --workers procesos; este proceso es el único escritor. Se
+escribe en una tabla sombra que sustituye a la viva con un renombrado en una
+transacción corta; las fuentes indexadas mientras tanto se ponen al día después.
+
+Las subidas y retiradas no tocan related_sources: quedan en tfidf_changes y
+refresh_pending (el cron, con --pending) las aplica por lotes en transacciones
+cortas, desde la marca changes_hold_related de tfidf_meta, que también impide
+purgar del registro lo que aún no se ha aplicado. refresh_neighbors recalcula
+los vecinos de cada fuente, la inserta en las listas de las fuentes a las que
+ahora supera y recalcula por completo las listas que la contenían. Hasta el
+primer cálculo completo no se mantiene nada.
+
+Uso: python3 tf-idf/related_sources.py [--top-n 10] [--workers N]
+     python3 tf-idf/related_sources.py --pending [--batch N]   (cambios pendientes)
+     python3 tf-idf/related_sources.py --sources ID ...   (solo esas vecindades)
+"""
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from db_utils import get_db, ensure_schema, read_meta, fetch_idf, hold_changes, release_changes, CHANGES_HOLD
+
+DEFAULT_TOP_N = 10
+# Celdas (fuentes del bloque × fuentes) de la matriz densa de cada bloque
+BLOCK_CELLS = 1 << 22
+# Productos parciales que se acumulan en cada bincount (acota la memoria)
+EXPAND_LIMIT = 1 << 23
+METHOD = 'tfidf_cosine'
+# Cambios de tfidf_changes por transacción de refresh_pending: cada fuente
+# recalcula además las listas que la contenían, así que los lotes son pequeños
+PENDING_BATCH = 5
+# Marca de tfidf_meta: último seq de tfidf_changes aplicado a related_sources
+PENDING_MARK = CHANGES_HOLD + 'related'
+SHADOW = '_next'
+
+RELATED_SQL = '''
+CREATE TABLE related_sources{suffix} (
+    source_id INTEGER NOT NULL,
+    related_source_id INTEGER NOT NULL,
+    similarity_score REAL NOT NULL,
+    relationship_factors TEXT,
+    PRIMARY KEY (source_id, related_source_id),
+    FOREIGN KEY (source_id) REFERENCES sources(id) ON DELETE CASCADE,
+    FOREIGN KEY (related_source_id) REFERENCES sources(id) ON DELETE CASCADE
+)
+'''
+
+# Matriz del proceso (la reciben los procesos del pool al arrancar)
+_matrix = None
+
+
+def _init_worker(matrix):
+    global _matrix
+    _matrix = matrix
+
+
+def source_matrix(index):
+    """Matriz del autoproducto a partir de un SparseIndex: valores tf / norm ×
+    IDF por término (filas de postings) y la misma matriz ordenada por fuente."""
+    import numpy as np
+    n_terms = index.n_terms
+    idf = np.zeros(n_terms)
+    for term, row in index.vocabulary.items():
+        idf[row] = index.idf.get(term, 0.0)
+    lengths = np.diff(index.indptr)
+    entry_terms = np.repeat(np.arange(n_terms, dtype=np.int32), lengths)
+    values = index.data.astype(np.float64) * idf[entry_terms]
+    order = np.argsort(index.indices, kind='stable')
+    source_ptr = np.zeros(index.n_sources + 1, dtype=np.int64)
+    np.cumsum(np.bincount(index.indices, minlength=index.n_sources), out=source_ptr[1:])
+    return {
+        'indptr': index.indptr, 'indices': index.indices, 'values': values,
+        'source_ptr': source_ptr, 'source_terms': entry_terms[order], 'source_values': values[order],
+        'source_ids': index.source_ids,
+    }
+
+
+def neighbor_block(first, last, top_n, matrix=None):
+    """Top_n vecinos de las columnas [first, last): [(source_id, related_id, score)]."""
+    import numpy as np
+    m = matrix or _matrix
+    indptr, indices, values = m['indptr'], m['indices'], m['values']
+    source_ids = m['source_ids']
+    n = len(source_ids)
+    size = last - first
+    lo, hi = m['source_ptr'][first], m['source_ptr'][last]
+    terms = m['source_terms'][lo:hi]
+    weights = m['source_values'][lo:hi]
+    # fila local (fuente del bloque) de cada entrada
+    rows = np.repeat(np.arange(size, dtype=np.int64), np.diff(m['source_ptr'][first:last + 1]))
+    starts = indptr[terms]
+    lengths = indptr[terms + 1] - starts
+    scores = np.zeros(size * n)
+    ends = np.cumsum(lengths)
+    begin = 0
+    while begin < len(terms):
+        # tramo de entradas cuya expansión cabe en EXPAND_LIMIT (al menos una)
+        base = ends[begin - 1] if begin else 0
+        end = max(begin + 1, int(np.searchsorted(ends, base + EXPAND_LIMIT, side='right')))
+        part_lengths = lengths[begin:end]
+        total = int(part_lengths.sum())
+        if total:
+            entry = np.repeat(np.arange(begin, end), part_lengths)
+            offsets = np.arange(total) - np.repeat(np.cumsum(part_lengths) - part_lengths, part_lengths)
+            positions = starts[entry] + offsets
+            cells = rows[entry] * n + indices[positions]
+            scores += np.bincount(cells, weights=weights[entry] * values[positions], minlength=size * n)
+        begin = end
+    scores = scores.reshape(size, n)
+    scores[np.arange(size), np.arange(first, last)] = 0.0
+    out = []
+    for j in range(size):
+        row = scores[j]
+        if top_n < n:
+            best = np.argpartition(-row, top_n - 1)[:top_n]
+        else:
+            best = np.arange(n)
+        best = best[row[best] > 0]
+        ids = source_ids[best]
+        order = np.lexsort((ids, -row[best]))
+        source_id = int(source_ids[first + j])
+        out.extend((source_id, int(ids[i]), float(row[best][i])) for i in order)
+    return out
+
+
+def neighbor_blocks(matrix, top_n, workers=1, block_cells=BLOCK_CELLS):
+    """Resultados de neighbor_block por bloques, en orden; con workers > 1 en un
+    pool de procesos con como mucho 2 × workers bloques en vuelo."""
+    n = len(matrix['source_ids'])
+    step = max(1, block_cells // max(n, 1))
+    ranges = [(first, min(n, first + step)) for first in range(0, n, step)]
+    if workers <= 1:
+        for first, last in ranges:
+            yield neighbor_block(first, last, top_n, matrix)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(matrix,)) as pool:
+        pending = deque()
+        for first, last in ranges:
+            pending.append(pool.submit(neighbor_block, first, last, top_n))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _factors(generation):
+    return json.dumps({'method': METHOD, 'generation': generation})
+
+
+def _ensure_related_index(cursor, generation):
+    # Índice por related_source_id (listas que contienen una fuente). Lleva la
+    # generación en el nombre porque SQLite no lo renombra junto con su tabla
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'related_sources' "
+                   "AND name LIKE 'idx_related_sources_r%'")
+    if cursor.fetchone() is None:
+        cursor.execute(f'CREATE INDEX idx_related_sources_r{generation} ON related_sources(related_source_id)')
+
+
+def build_related(top_n=DEFAULT_TOP_N, workers=1, block_cells=BLOCK_CELLS):
+    """Recalcula todas las vecindades (ver el docstring del módulo)."""
+    from sparse_index import SparseIndex
+    started = time.perf_counter()
+    db = get_db()
+    ensure_schema(db)
+    cursor = db.cursor()
+    generation = read_meta(db, 'related_generation') + 1
+
+    # 0. Punto de partida de tfidf_changes (se conserva hasta el paso 2) y matriz
+    #    de una sola generación del índice; lo indexado entre medias se repasa dos veces
+    start_seq = hold_changes(db, 'related_build')
+    cursor.execute('BEGIN')
+    index = SparseIndex.from_db(db)
+    db.commit()
+    matrix = source_matrix(index)
+    loaded = time.perf_counter()
+
+    # 1. Vecinos por bloques en la tabla sombra, con commit por bloque
+    cursor.execute(f'DROP TABLE IF EXISTS related_sources{SHADOW}')
+    cursor.execute(RELATED_SQL.format(suffix=SHADOW))
+    db.commit()
+    factors = _factors(generation)
+    pairs = 0
+    for rows in neighbor_blocks(matrix, top_n, workers, block_cells):
+        cursor.executemany(f'INSERT INTO related_sources{SHADOW} VALUES (?, ?, ?, ?)',
+                           [(s, r, score, factors) for s, r, score in rows])
+        db.commit()
+        pairs += len(rows)
+    computed = time.perf_counter()
+
+    # 2. Cambio de tabla; las fuentes indexadas mientras tanto quedan pendientes
+    #    desde start_seq y se ponen al día a continuación, por lotes
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute('DROP TABLE related_sources')
+    cursor.execute(f'ALTER TABLE related_sources{SHADOW} RENAME TO related_sources')
+    _ensure_related_index(cursor, generation)
+    cursor.execute("INSERT OR REPLACE INTO tfidf_meta (key, value) VALUES ('related_generation', ?)", (generation,))
+    cursor.execute("INSERT OR REPLACE INTO tfidf_meta (key, value) VALUES ('related_top_n', ?)", (top_n,))
+    cursor.execute('INSERT OR REPLACE INTO tfidf_meta (key, value) VALUES (?, ?)', (PENDING_MARK, start_seq))
+    release_changes(cursor, 'related_build')
+    db.commit()
+    caught_up = refresh_pending(db)['sources']
+    db.close()
+    stats = {
+        'generation': generation,
+        'sources': int(index.n_sources),
+        'pairs': pairs,
+        'top_n': top_n,
+        'workers': workers,
+        'caught_up': caught_up,
+        'load_s': round(loaded - started, 3),
+        'compute_s': round(computed - loaded, 3),
+        'total_s': round(time.perf_counter() - started, 3),
+    }
+    print(json.dumps(stats))
+    return stats
+
+
+def source_scores(cursor, source_id):
+    """Similitud de `source_id` con cada fuente que comparte algún término
+    (sin ella misma), leyendo solo las listas de sus términos."""
+    from search import fetch_postings, fetch_source_vector, source_weights
+    vector = fetch_source_vector(cursor, source_id)
+    if not vector:
+        return {}
+    weights = source_weights(vector, fetch_idf(cursor, vector))
+    scores = {}
+    for term, (ids, values) in fetch_postings(cursor, vector).items():
+        tw = weights[term]
+        for other, value in zip(ids, values):
+            scores[other] = scores.get(other, 0.0) + tw * value
+    scores.pop(source_id, None)
+    return scores
+
+
+def _top(scores, top_n):
+    ranked = sorted(((-score, other) for other, score in scores.items() if score > 0))[:top_n]
+    return [(other, -neg) for neg, other in ranked]
+
+
+def _write_list(cursor, source_id, neighbors, factors):
+    cursor.execute('DELETE FROM related_sources WHERE source_id = ?', (source_id,))
+    cursor.executemany('INSERT INTO related_sources VALUES (?, ?, ?, ?)',
+                       [(source_id, other, score, factors) for other, score in neighbors])
+
+
+def refresh_neighbors(cursor, source_ids, top_n=None):
+    """Pone al día las vecindades afectadas por las fuentes indexadas o retiradas
+    (dentro de la transacción del llamante). Devuelve cuántas listas se
+    reescribieron por completo; no hace nada si aún no hubo un cálculo completo."""
+    generation = read_meta(cursor, 'related_generation')
+    if not generation or not source_ids:
+        return 0
+    top_n = top_n or read_meta(cursor, 'related_top_n', DEFAULT_TOP_N)
+    factors = _factors(generation)
+    changed = set(source_ids)
+    dirty = set()
+    for source_id in sorted(changed):
+        # Las listas que la contenían se recalculan enteras (su puntuación cambió o salió)
+        cursor.execute('SELECT source_id FROM related_sources WHERE related_source_id = ?', (source_id,))
+        dirty.update(r[0] for r in cursor.fetchall())
+        cursor.execute('DELETE FROM related_sources WHERE related_source_id = ?', (source_id,))
+        scores = source_scores(cursor, source_id)
+        _write_list(cursor, source_id, _top(scores, top_n), factors)
+        # Listas a las que ahora supera: entra y sale la peor
+        candidates = sorted(o for o in scores if scores[o] > 0 and o not in changed and o not in dirty)
+        for i in range(0, len(candidates), 500):
+            chunk = candidates[i:i + 500]
+            cursor.execute(f'''
+                SELECT source_id, COUNT(*), MIN(similarity_score) FROM related_sources
+                WHERE source_id IN ({','.join('?' * len(chunk))}) GROUP BY source_id
+            ''', chunk)
+            lists = {r[0]: (r[1], r[2]) for r in cursor.fetchall()}
+            for other in chunk:
+                count, worst = lists.get(other, (0, None))
+                score = scores[other]
+                if count >= top_n and score < worst:
+                    continue
+                cursor.execute('INSERT INTO related_sources VALUES (?, ?, ?, ?)',
+                               (other, source_id, score, factors))
+                if count >= top_n:
+                    cursor.execute('''
+                        DELETE FROM related_sources WHERE rowid = (
+                            SELECT rowid FROM related_sources WHERE source_id = ?
+                            ORDER BY similarity_score ASC, related_source_id DESC LIMIT 1)
+                    ''', (other,))
+    dirty -= changed
+    for other in sorted(dirty):
+        _write_list(cursor, other, _top(source_scores(cursor, other), top_n), factors)
+    return len(dirty) + len(changed)
+
+
+def refresh_pending(db, batch=PENDING_BATCH):
+    """Aplica a related_sources los cambios de tfidf_changes posteriores a la
+    marca PENDING_MARK, `batch` cambios por transacción, y avanza la marca con
+    cada lote. Sin cálculo completo previo (sin marca) no hace nada."""
+    cursor = db.cursor()
+    db.commit()
+    lists = sources = batches = 0
+    while True:
+        cursor.execute('BEGIN IMMEDIATE')
+        seq = read_meta(cursor, PENDING_MARK, None)
+        if seq is None:
+            db.rollback()
+            break
+        cursor.execute('SELECT seq, source_id FROM tfidf_changes WHERE seq > ? ORDER BY seq LIMIT ?', (seq, batch))
+        rows = cursor.fetchall()
+        if not rows:
+            db.rollback()
+            break
+        changed = sorted({source_id for _, source_id in rows})
+        lists += refresh_neighbors(cursor, changed)
+        cursor.execute('UPDATE tfidf_meta SET value = ? WHERE key = ?', (rows[-1][0], PENDING_MARK))
+        db.commit()
+        sources += len(changed)
+        batches += 1
+    return {'sources': sources, 'lists': lists, 'batches': batches}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calcula las fuentes relacionadas (related_sources)')
+    parser.add_argument('--top-n', type=int, default=DEFAULT_TOP_N, help='vecinos por fuente')
+    parser.add_argument('--workers', type=int, default=1, help='procesos de cálculo (1 = serie)')
+    parser.add_argument('--block-cells', type=int, default=BLOCK_CELLS,
+                        help='celdas de la matriz densa de cada bloque (fuentes del bloque × fuentes)')
+    parser.add_argument('--sources', type=int, nargs='+', default=None,
+                        help='solo poner al día las vecindades de estas fuentes')
+    parser.add_argument('--pending', action='store_true',
+                        help='poner al día las fuentes indexadas o retiradas desde la última vez')
+    parser.add_argument('--batch', type=int, default=PENDING_BATCH, help='cambios por transacción (--pending)')
+    args = parser.parse_args()
+    if args.pending:
+        db = get_db()
+        started = time.perf_counter()
+        stats = refresh_pending(db, max(1, args.batch))
+        db.close()
+        stats['total_s'] = round(time.perf_counter() - started, 3)
+        print(json.dumps({'status': 'ok', **stats}))
+    elif args.sources:
+        db = get_db()
+        ensure_schema(db)
+        rewritten = refresh_neighbors(db.cursor(), args.sources)
+        db.commit()
+        db.close()
+        print(json.dumps({'status': 'ok', 'lists': rewritten}))
+    else:
+        build_related(max(1, args.top_n), max(1, args.workers), max(1, args.block_cells))
@@ -0,0 +1,76 @@
+"""Caché LRU de resultados de búsqueda con límite de tamaño y TTL.
+
+La clave es el multiconjunto de términos ya preprocesados (ordenados), de modo
+que "Análisis de datos" y "analisis datos" comparten entrada, junto con el
+top_k, los filtros y la versión del índice (generación + último cambio
+registrado): al reindexar cambia la versión y las entradas anteriores dejan de
+coincidir sin tener que vaciar nada a mano.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+DEFAULT_SIZE = int(os.environ.get('TFIDF_CACHE_SIZE', 1024))
+DEFAULT_TTL = float(os.environ.get('TFIDF_CACHE_TTL', 300))
+
+
+def cache_key(terms, top_k, version, filters=None, options=None):
+    # filters: representación estable de los filtros (source_attrs.filter_key);
+    # options: lo que distinga otro tipo de respuesta (p. ej. con facetas)
+    return (version, top_k, tuple(sorted(terms)), filters, options)
+
+
+class ResultCache:
+    def __init__(self, max_entries=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()      # clave -> (caduca_en, resultados)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, results):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
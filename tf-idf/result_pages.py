@@ -0,0 +1,106 @@
+"""Paginación profunda con conjuntos de resultados guardados y cursores opacos.
+
+La primera página de una consulta puntúa el ranking completo hasta `depth`
+resultados (una sola vez) y lo guarda con un identificador aleatorio durante
+`ttl` segundos; la respuesta incluye un cursor opaco que codifica ese
+identificador, la posición y el tamaño de página. Las páginas siguientes se
+sirven recortando el ranking guardado, sin volver a puntuar. Con `page` se
+salta a cualquier página del mismo ranking (la paginación numerada de /search).
+
+El conjunto guardado es una foto del ranking: aunque el índice se reindexe o
+se recargue a mitad de la sesión, las páginas de un mismo cursor siguen
+saliendo del ranking original (sin repetir ni saltarse fuentes). La respuesta
+lleva la versión del índice con la que se puntuó.
+"""
+import os
+import json
+import base64
+import secrets
+from result_cache import ResultCache
+
+DEFAULT_DEPTH = int(os.environ.get('TFIDF_PAGE_DEPTH', 1000))
+DEFAULT_SETS = int(os.environ.get('TFIDF_PAGE_SETS', 128))
+DEFAULT_TTL = float(os.environ.get('TFIDF_PAGE_TTL', 600))
+MAX_PAGE_SIZE = 200
+
+
+class CursorError(ValueError):
+    """Cursor mal formado o cuyo conjunto de resultados ya caducó."""
+
+
+def encode_cursor(set_id, offset, page_size):
+    raw = json.dumps([set_id, offset, page_size], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        set_id, offset, page_size = json.loads(raw)
+        if not isinstance(set_id, str) or int(offset) < 0 or int(page_size) <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        raise CursorError('cursor no válido')
+    return set_id, int(offset), int(page_size)
+
+
+def check_page(page):
+    page = int(page)
+    if page < 1:
+        raise ValueError('page debe ser 1 o mayor')
+    return page
+
+
+def check_page_size(page_size):
+    page_size = int(page_size or 20)
+    if not 0 < page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f'page_size debe estar entre 1 y {MAX_PAGE_SIZE}')
+    return page_size
+
+
+class ResultPages:
+    """Conjuntos de resultados por cursor (LRU con TTL, ver result_cache.py)."""
+
+    def __init__(self, max_sets=DEFAULT_SETS, ttl=DEFAULT_TTL, depth=DEFAULT_DEPTH):
+        self.depth = depth
+        self._sets = ResultCache(max_sets, ttl)
+
+    def open(self, ranking, page_size, version=None, page=1, extra=None):
+        """Guarda el ranking completo y devuelve su página `page`. `extra` (p. ej.
+        las facetas) se guarda con él y se devuelve con cada página."""
+        set_id = secrets.token_urlsafe(12)
+        self._sets.put(set_id, (ranking, version, extra))
+        return self._page(set_id, ranking, version, extra, (check_page(page) - 1) * page_size, page_size)
+
+    def page(self, cursor, page=None):
+        """Página del cursor o, con `page`, esa página del mismo ranking."""
+        set_id, offset, page_size = decode_cursor(cursor)
+        entry = self._sets.get(set_id)
+        if entry is None:
+            raise CursorError('cursor caducado: repite la búsqueda')
+        ranking, version, extra = entry
+        if page is not None:
+            offset = (check_page(page) - 1) * page_size
+        return self._page(set_id, ranking, version, extra, offset, page_size)
+
+    def _page(self, set_id, ranking, version, extra, offset, page_size):
+        end = offset + page_size
+        # sin conjunto guardado (tamaño 0) no hay cursor que ofrecer
+        stored = self._sets.max_entries > 0
+        more = end < len(ranking) and stored
+        reply = {
+            'results': ranking[offset:end],
+            'offset': offset,
+            'total': len(ranking),
+            'cursor': encode_cursor(set_id, offset, page_size) if stored else None,
+            'next_cursor': encode_cursor(set_id, end, page_size) if more else None,
+            'version': list(version) if version is not None else None,
+        }
+        if extra:
+            reply.update(extra)
+        return reply
+
+    def stats(self):
+        stats = self._sets.stats()
+        stats['depth'] = self.depth
+        return stats
@@ -1,78 +1,736 @@
+import os
 import sys
 import json
 import math
-from db_utils import get_db
-from preprocess import preprocess
+import heapq
+import argparse
+import sqlite3
+from bisect import bisect_left
+from itertools import islice
+from db_utils import get_db, read_generation, index_version, fetch_idf, term_ids, SNAPSHOT_PATH
+from postings_index import InvertedIndex
+from preprocess import preprocess, preprocess_batch
+from result_cache import cache_key
+from result_pages import ResultPages, check_page_size
+from source_attrs import (SourceAttributes, FacetCounter, YEAR_BUCKET, normalize_filters, resolve_filters,
+                          filter_key, filter_sql)
 
-def search(query, top_k=20):
-    db = get_db()
-    cursor = db.cursor()
-    
-    # 1. Preprocesar consulta
-    terms = preprocess(query)
-    if not terms:
-        return []
-    
-    # 2. Obtener IDF actuales
-    cursor.execute('SELECT term, idf FROM global_idf')
-    idf_map = {row[0]: row[1] for row in cursor.fetchall()}
-    default_idf = math.log(1000)
-    
-    # 3. Calcular vector de consulta (TF normalizado)
+DEFAULT_IDF = math.log(1000)
+
+# 'inverted': listas de postings en Python con poda MaxScore
+# 'numpy': matriz CSR y producto disperso vectorizado (sparse_index.py)
+ENGINES = ('inverted', 'numpy')
+DEFAULT_ENGINE = os.environ.get('TFIDF_ENGINE', 'inverted')
+
+
+def _check_engine(engine):
+    engine = engine or DEFAULT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f'motor desconocido: {engine} (opciones: {", ".join(ENGINES)})')
+    return engine
+
+
+def load_index(db=None, engine=None, snapshot=SNAPSHOT_PATH):
+    """Carga en memoria los IDF globales y las listas de postings de todos los
+    términos, para reutilizarlos entre consultas (ver search_server.py).
+
+    Los dos motores abren la instantánea mmap si existe (snapshot=None la
+    ignora) y solo leen de SQLite las fuentes reindexadas después de generarla:
+    el numpy como matriz CSR (index_snapshot.py) y el inverted como
+    InvertedIndex sobre las mismas páginas, sin importar NumPy
+    (postings_snapshot.py). Sin instantánea utilizable, todo se lee de SQLite.
+
+    Los atributos de las fuentes (source_attrs.py) se cargan a la vez para
+    aplicar los filtros durante la puntuación.
+
+    Todo se lee en una única transacción de lectura, así que el índice
+    corresponde a una sola generación aunque recalc_idf.py cambie de generación
+    mientras tanto."""
+    engine = _check_engine(engine)
+    own_db = db is None
+    if own_db:
+        db = get_db()
+        db.execute('BEGIN')
+    generation = read_generation(db)
+    version = index_version(db)
+    attrs = SourceAttributes.from_db(db)
+    if engine == 'numpy':
+        from sparse_index import SparseIndex
+        from index_snapshot import SnapshotError, open_index
+        index = None
+        if snapshot and os.path.exists(snapshot):
+            try:
+                index = open_index(snapshot, db)
+            except (SnapshotError, sqlite3.OperationalError) as e:
+                print(f'Instantánea no utilizable ({e}); se carga desde SQLite', file=sys.stderr)
+        if index is None:
+            index = SparseIndex.from_db(db)
+            index.generation = generation
+        index.version = version
+        index.attrs = attrs
+        if own_db:
+            db.close()
+        return index
+    index = None
+    if snapshot and os.path.exists(snapshot):
+        from snapshot_format import SnapshotError
+        from postings_snapshot import open_index
+        try:
+            index = open_index(snapshot, db)
+        except (SnapshotError, sqlite3.OperationalError) as e:
+            print(f'Instantánea no utilizable ({e}); se carga desde SQLite', file=sys.stderr)
+    if index is None:
+        index = InvertedIndex.from_db(db, fetch_idf(db.cursor()))
+        index.generation = generation
+    index.version = version
+    index.attrs = attrs
+    if own_db:
+        db.close()
+    return index
+
+
+def build_query_vector(terms, idf_map):
+    """Vector de consulta (TF normalizado × IDF) dividido por su norma, de modo
+    que el coseno sea la suma de qw × idf × tf / norm de la fuente."""
     total_terms = len(terms)
     tf_map = {}
     for t in terms:
         tf_map[t] = tf_map.get(t, 0) + 1
     for t in tf_map:
         tf_map[t] /= total_terms
-    
+
     query_vector = {}
     norm_q_sq = 0.0
     for t, tf in tf_map.items():
-        idf = idf_map.get(t, default_idf)
+        idf = idf_map.get(t, DEFAULT_IDF)
         w = tf * idf
         query_vector[t] = w
         norm_q_sq += w * w
     norm_q = math.sqrt(norm_q_sq)
-    
     if norm_q == 0:
+        return {}
+    return {t: w / norm_q for t, w in query_vector.items() if w != 0}
+
+
+def term_weights(query_vector, idf_map):
+    """Factor de cada término sobre los postings tf / norm: el IDF del lado
+    de la fuente se aplica aquí, al consultar, con su valor actual."""
+    return {t: qw * idf_map.get(t, DEFAULT_IDF) for t, qw in query_vector.items()}
+
+
+def top_k_maxscore(term_lists, top_k, accept=None):
+    """Recorrido documento a documento (DAAT) con poda MaxScore.
+
+    term_lists: [(qw, cota, [source_id, ...], [peso, ...])], con ids ordenados
+    y cota >= |qw × peso| para cualquier posting de la lista. Las listas cuya
+    suma de cotas no alcanza el umbral del top_k actual dejan de generar
+    candidatos y solo se consultan (por búsqueda binaria) para completar la
+    puntuación de documentos que aún pueden entrar.
+
+    accept: función source_id -> bool (filtros); los candidatos que no la
+    cumplen se saltan sin puntuarlos, así que el top_k es el de después de filtrar.
+    """
+    if top_k <= 0 or not term_lists:
         return []
-    
-    # 4. Obtener todas las normas y pesos de fuentes
-    #    (Para eficiencia, podríamos iterar sobre vectores)
+    lists = sorted(term_lists, key=lambda l: l[1])
+    n = len(lists)
+    bounds = []
+    acc = 0.0
+    for l in lists:
+        acc += l[1]
+        # pequeño margen para que el redondeo nunca pode un documento que sí entra
+        bounds.append(acc * (1 + 1e-9))
+
+    pos = [0] * n
+    heap = []           # (score, -source_id): el peor resultado del top_k arriba
+    threshold = 0.0
+    first = 0           # listas [0, first) son no esenciales
+    while first < n:
+        doc = None
+        for i in range(first, n):
+            ids = lists[i][2]
+            if pos[i] < len(ids) and (doc is None or ids[pos[i]] < doc):
+                doc = ids[pos[i]]
+        if doc is None:
+            break
+        if accept is not None and not accept(doc):
+            for i in range(first, n):
+                ids = lists[i][2]
+                if pos[i] < len(ids) and ids[pos[i]] == doc:
+                    pos[i] += 1
+            continue
+
+        score = 0.0
+        for i in range(first, n):
+            qw, _, ids, weights = lists[i]
+            p = pos[i]
+            if p < len(ids) and ids[p] == doc:
+                score += qw * weights[p]
+                pos[i] = p + 1
+        for i in range(first - 1, -1, -1):
+            if score + bounds[i] <= threshold:
+                break
+            qw, _, ids, weights = lists[i]
+            p = bisect_left(ids, doc, pos[i])
+            pos[i] = p
+            if p < len(ids) and ids[p] == doc:
+                score += qw * weights[p]
+
+        if score <= threshold:
+            continue
+        if len(heap) < top_k:
+            heapq.heappush(heap, (score, -doc))
+        else:
+            heapq.heapreplace(heap, (score, -doc))
+        if len(heap) == top_k:
+            threshold = heap[0][0]
+            while first < n and bounds[first] <= threshold:
+                first += 1
+
+    ranked = sorted(heap, key=lambda x: (-x[0], -x[1]))
+    return [{'source_id': -neg_id, 'score': score} for score, neg_id in ranked]
+
+
+def loaded_version(index):
+    return index.version
+
+
+def index_stats(index):
+    return {'engine': index.engine, 'sources': index.n_sources, 'terms': len(index.idf),
+            'generation': index.generation, 'change_seq': index.version[1]}
+
+
+def _matcher(index, filters):
+    # Filtros y, en un InvertedIndex con fuentes ocultas (postings_snapshot.py), esas fuentes
+    excluded = getattr(index, 'excluded', None)
+    match = None
+    if filters:
+        if index.attrs is None:
+            raise ValueError('el índice no tiene atributos de las fuentes: no admite filtros')
+        match = index.attrs.matcher(filters)
+    if not excluded:
+        return match
+    if match is None:
+        return lambda source_id: source_id not in excluded
+    return lambda source_id: source_id not in excluded and match(source_id)
+
+
+def merge_top_k(partials, top_k):
+    """Top_k global a partir de varios top_k parciales de fuentes disjuntas, ya
+    ordenados por puntuación descendente y después source_id (el orden de
+    top_k_maxscore): shards (shards.py) o instantánea y cambios (postings_snapshot.py)."""
+    return list(islice(heapq.merge(*partials, key=lambda r: (-r['score'], r['source_id'])), top_k))
+
+
+def score_index(index, terms, top_k=20, filters=None):
+    """Similitud de coseno de los términos ya preprocesados contra un índice
+    cargado con load_index(); solo recorre las listas de los términos de la
+    consulta. filters: filtros normalizados de source_attrs."""
+    idf_map = index.idf
+    return score_index_weights(index, term_weights(build_query_vector(terms, idf_map), idf_map), top_k, filters)
+
+
+def score_index_weights(index, weights, top_k=20, filters=None):
+    """Top_k para un vector de factores ya calculado ({término: factor sobre
+    tf / norm}, ver term_weights) contra un índice cargado."""
+    if not isinstance(index, InvertedIndex):
+        return index.score(weights, top_k, filters=filters)
+    term_lists = []
+    for term, tw in weights.items():
+        entry = index.entry(term)
+        if entry is not None and entry.end > entry.start:
+            term_lists.append((tw, abs(tw) * entry.max_weight) + index.slice(entry))
+    return top_k_maxscore(term_lists, top_k, _matcher(index, filters))
+
+
+def score_db(db, terms, top_k=20, filters=None):
+    """Igual que score_index, pero leyendo de SQLite solo los IDF, cotas y
+    postings de los términos de la consulta (clave (term_id, source_id) de tfidf_postings).
+    Los filtros se empujan a la consulta de postings (JOIN con sources)."""
+    cursor = db.cursor()
+    unique_terms = sorted(set(terms))
+
+    idf_map = fetch_idf(cursor, unique_terms)
+    query_vector = build_query_vector(terms, idf_map)
+    if not query_vector:
+        return []
+    return score_db_weights(cursor, term_weights(query_vector, idf_map), top_k, filters)
+
+
+def score_db_weights(cursor, weights, top_k=20, filters=None):
+    """Como score_index_weights, leyendo de SQLite las cotas y postings de los
+    términos del vector de factores."""
+    unique_terms = sorted(weights)
+    if not unique_terms:
+        return []
+    placeholders = ','.join('?' * len(unique_terms))
+    try:
+        cursor.execute(f'SELECT term, max_weight FROM term_max_weights WHERE term IN ({placeholders})',
+                       unique_terms)
+        max_weight = dict(cursor.fetchall())
+    except sqlite3.OperationalError:
+        # Base sin la tabla de cotas todavía: sin poda, todas las listas son esenciales
+        max_weight = {}
+
+    join, where, filter_params = _filter_join(filters)
+    ids = term_ids(cursor, unique_terms)
+    term_lists = []
+    for term, tw in weights.items():
+        if term not in ids:
+            continue
+        cursor.execute(f'''
+            SELECT p.source_id, p.tf / n.norm
+            FROM tfidf_postings p
+            JOIN source_norms n ON p.source_id = n.source_id
+            {join}
+            WHERE p.term_id = ? AND n.norm > 0 {where}
+            ORDER BY p.source_id
+        ''', [ids[term]] + filter_params)
+        rows = cursor.fetchall()
+        if not rows:
+            continue
+        bound = abs(tw) * max_weight[term] if term in max_weight else math.inf
+        term_lists.append((tw, bound, [r[0] for r in rows], [r[1] for r in rows]))
+    return top_k_maxscore(term_lists, top_k)
+
+
+def _filter_join(filters):
+    # JOIN y condiciones para aplicar los filtros en la consulta de postings
+    if not filters:
+        return '', '', []
+    clause, params = filter_sql(filters)
+    return 'JOIN sources s ON s.id = p.source_id', f'AND {clause}', params
+
+
+def _top_k(acc, top_k, accept=None):
+    # Mismo orden que top_k_maxscore: puntuación descendente y después source_id
+    best = heapq.nsmallest(top_k, ((-score, source_id) for source_id, score in acc.items()
+                                   if score > 0 and (accept is None or accept(source_id))))
+    return [{'source_id': source_id, 'score': -neg_score} for neg_score, source_id in best]
+
+
+def score_lists_batch(weights_list, postings, top_k=20, accept=None):
+    """Puntúa varias consultas a la vez término a término: la lista de postings
+    de cada término se recorre una sola vez y suma en los acumuladores de todas
+    las consultas que lo contienen. weights_list: un {término: factor} por
+    consulta (term_weights); postings: término -> ([source_id, ...], [peso, ...]);
+    accept: filtro opcional source_id -> bool aplicado antes de elegir el top_k."""
+    by_term = {}
+    for j, weights in enumerate(weights_list):
+        for term, tw in weights.items():
+            by_term.setdefault(term, []).append((j, tw))
+    accumulators = [{} for _ in weights_list]
+    for term, users in by_term.items():
+        entry = postings.get(term)
+        if not entry:
+            continue
+        ids, weights = entry
+        if len(users) == 1:
+            j, tw = users[0]
+            acc = accumulators[j]
+            for source_id, w in zip(ids, weights):
+                acc[source_id] = acc.get(source_id, 0.0) + tw * w
+            continue
+        targets = [(accumulators[j], tw) for j, tw in users]
+        for source_id, w in zip(ids, weights):
+            for acc, tw in targets:
+                acc[source_id] = acc.get(source_id, 0.0) + tw * w
+    return [_top_k(acc, top_k, accept) if top_k > 0 else [] for acc in accumulators]
+
+
+def score_index_batch(index, terms_list, top_k=20, filters=None):
+    """score_index para varias consultas (listas de términos) en una sola pasada."""
+    if not isinstance(index, InvertedIndex):
+        return index.score_batch([term_weights(build_query_vector(terms, index.idf), index.idf)
+                                  for terms in terms_list], top_k, filters=filters)
+    weights_list = [term_weights(build_query_vector(terms, index.idf), index.idf) for terms in terms_list]
+    return score_lists_batch(weights_list, index.postings, top_k, _matcher(index, filters))
+
+
+def score_db_batch(db, terms_list, top_k=20, filters=None):
+    """score_db para varias consultas: los IDF y las listas de postings de todos
+    sus términos se leen de SQLite una sola vez."""
+    cursor = db.cursor()
+    unique_terms = sorted({t for terms in terms_list for t in terms})
+    if not unique_terms:
+        return [[] for _ in terms_list]
+    idf_map = fetch_idf(cursor, unique_terms)
+    weights_list = [term_weights(build_query_vector(terms, idf_map), idf_map) for terms in terms_list]
+    return score_lists_batch(weights_list, fetch_postings(cursor, unique_terms, filters), top_k)
+
+
+def fetch_postings(cursor, terms, filters=None):
+    """Listas de postings (término -> ([source_id, ...], [tf / norm, ...])) de
+    los términos dados, leídas en una sola consulta y con los filtros aplicados."""
+    unique_terms = sorted(set(terms))
+    if not unique_terms:
+        return {}
+    join, where, filter_params = _filter_join(filters)
+    cursor.execute(f'''
+        SELECT t.term, p.source_id, p.tf / n.norm
+        FROM tfidf_terms t
+        JOIN tfidf_postings p ON p.term_id = t.term_id
+        JOIN source_norms n ON p.source_id = n.source_id
+        {join}
+        WHERE t.term IN ({','.join('?' * len(unique_terms))}) AND n.norm > 0 {where}
+        ORDER BY p.term_id, p.source_id
+    ''', unique_terms + filter_params)
+    postings = {}
+    for term, source_id, weight in cursor:
+        entry = postings.get(term)
+        if entry is None:
+            entry = postings[term] = ([], [])
+        entry[0].append(source_id)
+        entry[1].append(weight)
+    return postings
+
+
+def fetch_source_vector(cursor, source_id):
+    """Vector guardado de una fuente (término -> tf / norm), leído por el índice
+    de tfidf_postings por fuente; vacío si no está indexada."""
     cursor.execute('''
-        SELECT v.source_id, v.term, v.weight, n.norm
-        FROM tfidf_vectors v
-        JOIN source_norms n ON v.source_id = n.source_id
-    ''')
-    rows = cursor.fetchall()
-    
-    # Agrupar por source_id
-    sources = {}
-    for source_id, term, weight, norm in rows:
-        if source_id not in sources:
-            sources[source_id] = {'norm': norm, 'vector': {}}
-        sources[source_id]['vector'][term] = weight
-    
-    # 5. Calcular similitud de coseno con cada fuente
-    results = []
-    for source_id, data in sources.items():
-        dot = 0.0
-        for term, qw in query_vector.items():
-            if term in data['vector']:
-                dot += qw * data['vector'][term]
-        if data['norm'] > 0:
-            sim = dot / (norm_q * data['norm'])
-            results.append((source_id, sim))
-    
-    # 6. Ordenar y tomar top_k
-    results.sort(key=lambda x: x[1], reverse=True)
-    top = [{'source_id': r[0], 'score': r[1]} for r in results[:top_k]]
-    
-    db.close()
-    return top
+        SELECT t.term, p.tf / n.norm FROM tfidf_postings p
+        JOIN source_norms n ON p.source_id = n.source_id
+        JOIN tfidf_terms t ON t.term_id = p.term_id
+        WHERE p.source_id = ? AND n.norm > 0
+    ''', (source_id,))
+    return dict(cursor.fetchall())
+
+
+def source_weights(vector, idf_map):
+    """Factores de consulta de un vector guardado: la fuente aporta tf / norm × idf
+    y cada posting se multiplica por su idf, así que el factor es tf / norm × idf²
+    (el coseno entre las dos fuentes, igual que related_sources.py)."""
+    return {t: w * idf_map.get(t, DEFAULT_IDF) ** 2 for t, w in vector.items()}
+
+
+def score_index_facets(index, terms, top_k=20, filters=None, min_score=0.0, year_bucket=YEAR_BUCKET):
+    """Top_k y conteos de facetas (source_attrs.FacetCounter) de todas las
+    fuentes que cumplen los filtros con puntuación >= min_score, en la misma
+    pasada que las puntúa. Sin poda MaxScore: las facetas necesitan la
+    puntuación de todo el conjunto que coincide, no solo la del top_k."""
+    weights = term_weights(build_query_vector(terms, index.idf), index.idf)
+    return score_index_weights_facets(index, weights, top_k, filters, min_score, year_bucket)
+
+
+def score_index_weights_facets(index, weights, top_k=20, filters=None, min_score=0.0, year_bucket=YEAR_BUCKET):
+    """score_index_facets para un vector de factores ya calculado (term_weights)."""
+    counter = FacetCounter(index.attrs, year_bucket)
+    if not isinstance(index, InvertedIndex):
+        results = index.score(weights, top_k, filters=filters, min_score=min_score, counter=counter)
+        return {'results': results, 'facets': counter.result()}
+
+    accept = _matcher(index, filters)
+    acc = {}
+    for term, tw in weights.items():
+        entry = index.postings.get(term)
+        if entry:
+            for source_id, w in zip(entry[0], entry[1]):
+                acc[source_id] = acc.get(source_id, 0.0) + tw * w
+    matched = []
+    for source_id, score in acc.items():
+        if score > 0 and score >= min_score and (accept is None or accept(source_id)):
+            counter.add(source_id)
+            matched.append((-score, source_id))
+    best = heapq.nsmallest(top_k, matched) if top_k > 0 else []
+    return {'results': [{'source_id': source_id, 'score': -neg_score} for neg_score, source_id in best],
+            'facets': counter.result()}
+
+
+def prepare_filters(filters):
+    """Valida y normaliza los filtros (source_attrs) y resuelve exclude_list
+    con una lectura de list_sources; None si no hay filtros."""
+    filters = normalize_filters(filters)
+    if not filters or 'exclude_list' not in filters:
+        return filters
+    db = get_db()
+    try:
+        return resolve_filters(filters, db)
+    finally:
+        db.close()
+
+
+def search(query, top_k=20, index=None, engine=None, cache=None, filters=None):
+    # 0. Filtros (tipo, categoría, subcategoría, años, valoración, activa, listas):
+    #    se aplican durante la puntuación, así que top_k es el de después de filtrar
+    filters = prepare_filters(filters)
+
+    # 1. Preprocesar consulta
+    terms = preprocess(query)
+    if not terms:
+        return []
+
+    # 2. Índice residente en memoria (search_server.py); el motor es el del índice.
+    #    Con caché (result_cache.ResultCache) se reutilizan los resultados de la
+    #    misma consulta preprocesada sobre la misma versión del índice
+    if index is not None:
+        if cache is None:
+            return score_index(index, terms, top_k, filters)
+        key = cache_key(terms, top_k, loaded_version(index), filter_key(filters))
+        results = cache.get(key)
+        if results is None:
+            results = score_index(index, terms, top_k, filters)
+            cache.put(key, results)
+        return results
+
+    # 3. Sin índice residente: leer de SQLite solo las listas de la consulta,
+    #    en una transacción de lectura para no mezclar dos generaciones del índice
+    engine = _check_engine(engine)
+    db = get_db()
+    try:
+        db.execute('BEGIN')
+        if engine == 'numpy':
+            from sparse_index import SparseIndex
+            return score_index(SparseIndex.from_db(db, terms, filters=filters), terms, top_k)
+        return score_db(db, terms, top_k, filters)
+    finally:
+        db.close()
+
+def search_batch(queries, top_k=20, index=None, engine=None, cache=None, filters=None):
+    """Varias consultas en una llamada: se preprocesan juntas y se puntúan en una
+    sola pasada sobre las listas de sus términos (motor numpy: un único producto
+    matriz de consultas × índice). Devuelve una lista de resultados por
+    consulta, en el mismo orden. Las consultas con los mismos términos se
+    puntúan una vez y, con índice residente y caché, se consulta la caché antes.
+    Los filtros son los mismos para todas las consultas."""
+    filters = prepare_filters(filters)
+    fkey = filter_key(filters)
+    terms_list = preprocess_batch([str(q or '') for q in queries])
+    results = [[] for _ in terms_list]
+    # términos ordenados -> posiciones de las consultas que los comparten
+    pending = {}
+    for j, terms in enumerate(terms_list):
+        if not terms:
+            continue
+        if index is not None and cache is not None:
+            cached = cache.get(cache_key(terms, top_k, loaded_version(index), fkey))
+            if cached is not None:
+                results[j] = cached
+                continue
+        pending.setdefault(tuple(sorted(terms)), []).append(j)
+    if not pending:
+        return results
+
+    batch = [list(terms) for terms in pending]
+    if index is not None:
+        scored = score_index_batch(index, batch, top_k, filters)
+    else:
+        engine = _check_engine(engine)
+        db = get_db()
+        try:
+            db.execute('BEGIN')
+            if engine == 'numpy':
+                from sparse_index import SparseIndex
+                sub_index = SparseIndex.from_db(db, [t for terms in batch for t in terms], filters=filters)
+                scored = score_index_batch(sub_index, batch, top_k)
+            else:
+                scored = score_db_batch(db, batch, top_k, filters)
+        finally:
+            db.close()
+
+    for terms, positions, hits in zip(batch, pending.values(), scored):
+        if index is not None and cache is not None:
+            cache.put(cache_key(terms, top_k, loaded_version(index), fkey), hits)
+        for j in positions:
+            results[j] = hits
+    return results
+
+def search_facets(query, top_k=20, index=None, engine=None, cache=None, filters=None,
+                  min_score=0.0, year_bucket=YEAR_BUCKET):
+    """Como search, pero devuelve {'results': top_k, 'facets': conteos} con las
+    facetas de todas las fuentes que coinciden (filtros y puntuación >= min_score):
+    por category_id, subcategory_id, source_type_id y tramo de año de
+    year_bucket años, además de 'matched' (total de fuentes que coinciden)."""
+    filters = prepare_filters(filters)
+    min_score = float(min_score or 0.0)
+    empty = {'results': [], 'facets': FacetCounter(SourceAttributes(0), year_bucket).result()}
+    terms = preprocess(query)
+    if not terms:
+        return empty
+
+    if index is not None:
+        if cache is None:
+            return score_index_facets(index, terms, top_k, filters, min_score, year_bucket)
+        key = cache_key(terms, top_k, loaded_version(index), filter_key(filters),
+                        ('facets', min_score, year_bucket))
+        results = cache.get(key)
+        if results is None:
+            results = score_index_facets(index, terms, top_k, filters, min_score, year_bucket)
+            cache.put(key, results)
+        return results
+
+    # Sin índice residente: índice mínimo con las listas de la consulta (ya
+    # filtradas en SQL) y los atributos de las fuentes que aparecen en ellas
+    engine = _check_engine(engine)
+    db = get_db()
+    try:
+        db.execute('BEGIN')
+        if engine == 'numpy':
+            from sparse_index import SparseIndex
+            sub_index = SparseIndex.from_db(db, terms, filters=filters)
+            sub_index.attrs = SourceAttributes.from_db(db, sub_index.source_ids.tolist())
+        else:
+            cursor = db.cursor()
+            postings = fetch_postings(cursor, terms, filters)
+            sub_index = InvertedIndex.from_postings(fetch_idf(cursor, terms), postings)
+            sub_index.attrs = SourceAttributes.from_db(db, {i for ids, _ in postings.values() for i in ids})
+        return score_index_facets(sub_index, terms, top_k, None, min_score, year_bucket)
+    finally:
+        db.close()
+
+def search_page(query='', page_size=20, cursor=None, index=None, engine=None, cache=None, pages=None,
+                filters=None, page=None, facets=False, min_score=0.0, year_bucket=YEAR_BUCKET):
+    """Paginación profunda (result_pages.py). Sin cursor, puntúa el ranking hasta
+    pages.depth resultados con puntuación >= min_score, lo guarda en `pages` y
+    devuelve la página `page` (la primera por defecto) con 'cursor' y
+    'next_cursor'; con cursor, devuelve la página siguiente, o la página `page`,
+    recortando el ranking guardado (query, filters, facets y min_score se
+    ignoran). Con facets, el ranking sale de la pasada de search_facets y cada
+    página lleva sus conteos en 'facets'. Las páginas de un cursor no cambian
+    aunque el índice se recargue entre una y otra. Sin `pages` (un solo proceso
+    por consulta) solo hay primera página y los cursores son None."""
+    if cursor:
+        if pages is None:
+            raise ValueError('la paginación con cursor necesita el servidor de búsqueda')
+        return pages.page(str(cursor), page)
+    page_size = check_page_size(page_size)
+    if pages is None:
+        pages = ResultPages(max_sets=0)
+    depth = max(pages.depth, page_size)
+    extra = None
+    if facets:
+        reply = search_facets(query, depth, index=index, engine=engine, cache=cache, filters=filters,
+                              min_score=min_score, year_bucket=year_bucket)
+        ranking, extra = reply['results'], {'facets': reply['facets']}
+    else:
+        ranking = search(query, depth, index=index, engine=engine, cache=cache, filters=filters)
+    min_score = float(min_score or 0.0)
+    if min_score:
+        ranking = [r for r in ranking if r['score'] >= min_score]
+    return pages.open(ranking, page_size, loaded_version(index) if index is not None else None,
+                      page or 1, extra)
+
+def _without_source(results, source_id, top_k):
+    return [r for r in results if r['source_id'] != source_id][:top_k]
+
+
+def _index_has_vector(db, index, source_id):
+    """True si el vector que la fuente tiene ahora en la base es el que cargó el
+    índice residente: misma generación (las normas dependen de ella) y ningún
+    cambio de la fuente después del último cambio cargado. Si el registro ya se
+    purgó por encima de ese punto, no se sabe y cuenta como cambiada."""
+    generation, change_seq = index_version(db)
+    loaded_generation, loaded_seq = loaded_version(index)
+    if generation != loaded_generation:
+        return False
+    if change_seq == loaded_seq:
+        return True
+    first = db.execute('SELECT MIN(seq) FROM tfidf_changes WHERE seq > ?', (loaded_seq,)).fetchone()[0]
+    if first != loaded_seq + 1:
+        return False
+    return db.execute('SELECT 1 FROM tfidf_changes WHERE seq > ? AND source_id = ? LIMIT 1',
+                      (loaded_seq, source_id)).fetchone() is None
+
+
+def _score_source_db(db, vector, source_id, top_k, engine, filters):
+    # Puntúa el vector contra la base, dentro de la transacción de lectura del llamante
+    if not vector:
+        return []
+    if engine == 'numpy':
+        from sparse_index import SparseIndex
+        sub_index = SparseIndex.from_db(db, vector, filters=filters)
+        results = sub_index.score(source_weights(vector, sub_index.idf), top_k + 1)
+    else:
+        cursor = db.cursor()
+        results = score_db_weights(cursor, source_weights(vector, fetch_idf(cursor, vector)), top_k + 1, filters)
+    return _without_source(results, source_id, top_k)
+
+
+def search_by_source(source_id, top_k=20, index=None, engine=None, cache=None, filters=None, db=None):
+    """Fuentes más parecidas a una fuente ya indexada ("más como esta"). La
+    consulta es el vector que la fuente ya tiene en tfidf_postings: no se
+    tokeniza ni se lematiza nada, y con índice residente se usan sus IDF en
+    memoria (sin leer global_idf); sin él, solo los IDF de los términos de la
+    fuente. La propia fuente no aparece en los resultados. db: conexión abierta
+    con la que leer el vector cuando hay índice residente (search_server.py).
+
+    El vector se lee de la base, que puede ir por delante del índice residente
+    (la recarga llega con el siguiente sondeo). Si el índice no tiene ese
+    vector (otra generación o la fuente cambió después de cargarlo), la
+    consulta se puntúa contra la base en la misma transacción de lectura, como
+    sin índice residente, y no se guarda en la caché."""
+    source_id = int(source_id)
+    filters = prepare_filters(filters)
+
+    # 1. Índice residente: una lectura por clave primaria del vector de la fuente
+    if index is not None:
+        key = None
+        if cache is not None:
+            key = cache_key((), top_k, loaded_version(index), filter_key(filters), ('source', source_id))
+            results = cache.get(key)
+            if results is not None:
+                return results
+        own_db = db is None
+        if own_db:
+            db = get_db()
+        try:
+            db.execute('BEGIN')
+            vector = fetch_source_vector(db.cursor(), source_id)
+            if vector and not _index_has_vector(db, index, source_id):
+                return _score_source_db(db, vector, source_id, top_k, _check_engine(engine), filters)
+        finally:
+            db.rollback()
+            if own_db:
+                db.close()
+        idf_map = index.idf
+        # se pide uno más por si la propia fuente (coseno ~1) ocupa un puesto
+        results = _without_source(score_index_weights(index, source_weights(vector, idf_map), top_k + 1, filters),
+                                  source_id, top_k) if vector else []
+        if key is not None:
+            cache.put(key, results)
+        return results
+
+    # 2. Sin índice residente: vector, IDF y listas de sus términos en una transacción de lectura
+    engine = _check_engine(engine)
+    db = get_db()
+    try:
+        db.execute('BEGIN')
+        return _score_source_db(db, fetch_source_vector(db.cursor(), source_id), source_id, top_k, engine, filters)
+    finally:
+        db.close()
+
 
 if __name__ == '__main__':
-    query = sys.argv[1] if len(sys.argv) > 1 else ''
-    top = search(query)
-    print(json.dumps(top))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Búsqueda TF-IDF por similitud de coseno')
+    parser.add_argument('query', nargs='*', default=[])
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--engine', choices=ENGINES, default=None,
+                        help='motor de puntuación (por defecto TFIDF_ENGINE o inverted)')
+    parser.add_argument('--filters', type=json.loads, default=None,
+                        help='filtros en JSON, p. ej. \'{"category_id": [2], "year_from": 2015}\' (ver source_attrs.py)')
+    parser.add_argument('--facets', action='store_true',
+                        help='devolver también las facetas del conjunto que coincide ({"results", "facets"})')
+    parser.add_argument('--min-score', type=float, default=0.0,
+                        help='umbral de similitud del conjunto sobre el que se cuentan las facetas')
+    parser.add_argument('--page-size', type=int, default=None,
+                        help='devolver la primera página del ranking profundo ({"results", "total", ...})')
+    parser.add_argument('--source', type=int, default=None, metavar='SOURCE_ID',
+                        help='fuentes parecidas a una fuente ya indexada (su vector guardado es la consulta)')
+    parser.add_argument('--batch', action='store_true',
+                        help='cada argumento es una consulta (sin argumentos, una por línea en stdin); '
+                             'imprime una lista de resultados por consulta')
+    args = parser.parse_args()
+    if args.source is not None:
+        print(json.dumps(search_by_source(args.source, args.top_k, engine=args.engine, filters=args.filters)))
+    elif args.batch:
+        queries = args.query or [line.rstrip('\n') for line in sys.stdin if line.strip()]
+        print(json.dumps(search_batch(queries, args.top_k, engine=args.engine, filters=args.filters)))
+    elif args.page_size:
+        print(json.dumps(search_page(' '.join(args.query), args.page_size, engine=args.engine,
+                                     filters=args.filters)))
+    elif args.facets:
+        print(json.dumps(search_facets(' '.join(args.query), args.top_k, engine=args.engine,
+                                       filters=args.filters, min_score=args.min_score)))
+    else:
+        top = search(' '.join(args.query), args.top_k, engine=args.engine, filters=args.filters)
+        print(json.dumps(top))
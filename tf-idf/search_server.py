@@ -0,0 +1,441 @@
+"""Servidor residente de búsqueda TF-IDF.
+
+Carga el índice una sola vez (ver search.load_index) y responde peticiones
+JSON por líneas, de modo que cada búsqueda se resuelve con estructuras ya
+calientes en memoria en lugar de lanzar un proceso nuevo por consulta.
+
+Transportes:
+  python3 tf-idf/search_server.py                  stdin/stdout (modo por defecto)
+  python3 tf-idf/search_server.py --socket RUTA    socket Unix, varias conexiones
+
+El motor de puntuación se elige con --engine (inverted | numpy) o con la
+variable de entorno TFIDF_ENGINE. Con --shards N (TFIDF_SHARDS) las fuentes se
+reparten en N procesos que puntúan en paralelo con el motor inverted y el
+servidor mezcla sus top_k (shards.py). Los resultados se guardan en una caché LRU
+(result_cache.py) de --cache-size entradas (TFIDF_CACHE_SIZE, 0 la desactiva)
+que caducan a los --cache-ttl segundos (TFIDF_CACHE_TTL); las entradas llevan
+la versión del índice, así que una recarga tras reindexar las invalida.
+
+Recarga en caliente: cada --watch segundos (TFIDF_RELOAD_INTERVAL, 0 lo
+desactiva) un hilo compara la versión del índice en la base (generación y
+último cambio de tfidf_changes) con la cargada y, si difiere, construye el
+índice nuevo en segundo plano mientras el anterior sigue respondiendo; lo
+publica con un único cambio de referencia y las consultas en curso terminan
+con el que empezaron. Con shards se reutilizan los procesos de los shards sin
+cambios y los que cambiaron se cargan en procesos nuevos. "reload" pide lo
+mismo sin esperar al siguiente sondeo. Cada recarga deja en "stats" un
+informe (last_reload: duración, generación, memoria residente y pico del
+proceso) y en stdin/stdout emite además una línea {"event": "reloaded", ...}.
+
+Protocolo: cada petición y cada respuesta es un objeto JSON en una sola línea
+(UTF-8, terminada en '\\n'). La respuesta repite el "id" de la petición; en
+stdin/stdout las respuestas salen en el mismo orden que las peticiones.
+
+  -> {"id": 1, "op": "search", "query": "análisis de datos", "top_k": 20}
+  <- {"id": 1, "ok": true, "results": [{"source_id": 3, "score": 0.41}, ...]}
+
+  -> {"id": 5, "op": "search_batch", "queries": ["redes neuronales", "deep learning"], "top_k": 5}
+  <- {"id": 5, "ok": true, "results": [[{"source_id": 3, "score": 0.41}, ...], [...]]}
+
+  -> {"id": 2, "op": "reload"}
+  <- {"id": 2, "ok": true, "reloading": true, "engine": "inverted", "sources": 120, "generation": 4, ...}
+  <- {"event": "reloaded", "ok": true, "trigger": "request", "generation": 4, "change_seq": 1190,
+        "previous_generation": 4, "previous_change_seq": 1187, "load_ms": 212.4,
+        "rss_mb": 96.1, "max_rss_mb": 131.7}
+  -> {"id": 12, "op": "reload", "wait": true}
+  <- {"id": 12, "ok": true, "engine": "inverted", "sources": 120, "terms": 950, "load_ms": 35.2, ...}
+
+  -> {"id": 3, "op": "ping"}
+  <- {"id": 3, "ok": true}
+
+  -> {"id": 4, "op": "stats"}
+  <- {"id": 4, "ok": true, "sources": 120, "terms": 950, "queries": 87,
+        "cache": {"hits": 40, "misses": 47, "hit_rate": 0.4598, ...}, ...}
+
+  -> {"id": 6, "query": "redes", "filters": {"category_id": [2], "year_from": 2015, "exclude_list": 7}}
+
+Si falta "op" se asume "search"; "top_k" es opcional (20). "filters" (opcional
+en search y search_batch) restringe las fuentes durante la puntuación, de modo
+que top_k es el de después de filtrar: source_type_id, category_id,
+subcategory_id (id o lista), year_from/year_to, rating_min/rating_max,
+is_active, exclude_ids y exclude_list (ver source_attrs.py).
+
+Con "facets": true, search devuelve además las facetas de todas las fuentes
+que coinciden (filtros y puntuación >= "min_score"), contadas en la misma
+pasada que las puntúa; "year_bucket" (10) es el tamaño en años de los tramos:
+
+  -> {"id": 7, "query": "redes", "facets": true, "min_score": 0.1}
+  <- {"id": 7, "ok": true, "results": [...], "facets": {"category_id": {"2": 31},
+        "subcategory_id": {...}, "source_type_id": {...}, "year": {"2010": 12},
+        "matched": 57, "year_bucket": 10}}
+
+"search_page" pagina en profundidad (result_pages.py): la primera petición
+puntúa el ranking hasta --page-depth resultados, lo guarda --page-ttl segundos
+y devuelve la primera página con un cursor opaco; con "cursor" se sirve la
+página siguiente del ranking guardado, que no cambia aunque se recargue el
+índice entre páginas. Un cursor caducado o no válido responde con un error:
+
+  -> {"id": 8, "op": "search_page", "query": "redes", "page_size": 10, "filters": {...}}
+  <- {"id": 8, "ok": true, "results": [...], "offset": 0, "total": 230,
+        "next_cursor": "WyJx...", "version": [4, 1187]}
+  -> {"id": 9, "op": "search_page", "cursor": "WyJx..."}
+  <- {"id": 9, "ok": true, "results": [...], "offset": 10, "total": 230, "next_cursor": "..."}
+
+"cursor" es el de la página devuelta; con "page" (desde 1) se sirve esa página
+del ranking guardado, y en la primera petición, esa página en vez de la
+primera. "facets", "min_score" y "year_bucket" (como en search) en la primera
+petición guardan las facetas con el ranking y las devuelven en cada página.
+
+"search_by_source" busca las fuentes más parecidas a una fuente ya indexada
+usando como consulta su vector guardado en tfidf_postings (sin preprocesar
+texto y con los IDF del índice en memoria); la propia fuente no aparece y
+admite "top_k" y "filters" como search. Si la fuente cambió después de
+cargar el índice, se puntúa contra la base hasta la siguiente recarga:
+
+  -> {"id": 11, "op": "search_by_source", "source_id": 42, "top_k": 5}
+  <- {"id": 11, "ok": true, "results": [{"source_id": 57, "score": 0.63}, ...]}
+
+Con "hydrate": true (en search, search_page, search_by_source y search_batch)
+cada resultado lleva además "display", el registro de presentación de la
+fuente (título, autores en orden, año, tipo, quién la subió y valoración; ver
+display_records.py), leído de source_display en una sola consulta:
+
+  -> {"id": 10, "query": "redes", "top_k": 2, "hydrate": true}
+  <- {"id": 10, "ok": true, "results": [{"source_id": 3, "score": 0.41, "display":
+        {"title": "...", "authors": ["Ana Pérez", "Luis Gil"], "year": 2019, "type": "Libro",
+         "uploader_id": 7, "uploader": "María López", "rating": 4.2, "ratings": 5}}, ...]}
+
+"search_batch"
+puntúa todas las consultas en una sola pasada (search.search_batch) y
+devuelve una lista de resultados por consulta, en el mismo orden. Un error se
+responde como {"id": ..., "ok": false, "error": "mensaje"} y el servidor sigue
+atendiendo. Al terminar la carga inicial se emite una línea {"event": "ready", ...}
+sin "id", y tras cada recarga una {"event": "reloaded", ...} (en el socket, el
+informe va a stderr). Los mensajes de diagnóstico van a stderr.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import socketserver
+from search import (ENGINES, DEFAULT_ENGINE, load_index, loaded_version, index_stats, search, search_batch,
+                    search_facets, search_page, search_by_source)
+from result_cache import ResultCache, DEFAULT_SIZE, DEFAULT_TTL
+from result_pages import ResultPages, DEFAULT_DEPTH, DEFAULT_SETS, DEFAULT_TTL as DEFAULT_PAGE_TTL
+from source_attrs import YEAR_BUCKET
+from display_records import hydrate, hydrate_many
+from db_utils import get_db, index_version
+from shards import ShardedIndex, DEFAULT_SHARDS
+from process_stats import memory_usage
+
+# Segundos entre comprobaciones de una versión nueva del índice (0 = solo con "reload")
+RELOAD_INTERVAL = float(os.environ.get('TFIDF_RELOAD_INTERVAL', 10))
+
+
+class SearchServer:
+    def __init__(self, engine=None, cache_size=DEFAULT_SIZE, cache_ttl=DEFAULT_TTL,
+                 page_depth=DEFAULT_DEPTH, page_sets=DEFAULT_SETS, page_ttl=DEFAULT_PAGE_TTL, shards=0):
+        if shards and (engine or DEFAULT_ENGINE) != 'inverted':
+            raise ValueError('los shards usan el motor inverted')
+        self.engine = engine
+        self.shards = shards
+        self.cache = ResultCache(cache_size, cache_ttl)
+        # conjuntos de resultados paginados: no se vacían al recargar el índice
+        self.pages = ResultPages(page_sets, page_ttl, page_depth)
+        self.index = None
+        self.loaded_at = None
+        self.load_ms = 0.0
+        self.last_reload = None
+        self.queries = 0
+        # los hilos del socket atienden peticiones a la vez: el contador va con su propio cerrojo
+        self._queries_lock = threading.Lock()
+        # recibe el informe de cada recarga en segundo plano (ver serve_stdio)
+        self.on_reload = None
+        self._reload_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._reloading = False
+        self._reload_again = False
+        self._local = threading.local()
+
+    def reload(self, trigger='request'):
+        """Construye el índice nuevo sin tocar el publicado y lo publica con un
+        único cambio de referencia: cada petición lee self.index una sola vez,
+        así que las que están en curso terminan con el índice anterior, que se
+        libera (con shards, los procesos que ya no usa) cuando acaban. Si la
+        carga falla se conserva el índice anterior."""
+        with self._reload_lock:
+            previous = self.index
+            start = time.perf_counter()
+            report = {'event': 'reloaded', 'trigger': trigger}
+            if previous is not None:
+                report['previous_generation'], report['previous_change_seq'] = loaded_version(previous)
+            try:
+                if self.shards:
+                    index = ShardedIndex.load(self.shards, previous)
+                else:
+                    index = load_index(engine=self.engine)
+            except Exception as e:
+                report.update({'ok': False, 'error': str(e)})
+                self.last_reload = report
+                raise
+            self.load_ms = (time.perf_counter() - start) * 1000
+            self.loaded_at = time.time()
+            self.index = index
+            report.update({'ok': True, 'generation': index.generation, 'change_seq': index.version[1],
+                           'load_ms': round(self.load_ms, 1), **memory_usage()})
+            if self.shards:
+                report['reloaded_shards'] = index.reloaded
+                report['shard_max_rss_mb'] = max(info['max_rss_mb'] or 0 for info in index.shards)
+            self.last_reload = report
+        return self.describe(index)
+
+    def reload_async(self, trigger='request'):
+        """Recarga en un hilo aparte. Si ya hay una en curso, se repite una vez
+        al acabar para recoger los cambios que llegaron mientras; devuelve
+        False en ese caso."""
+        with self._pending_lock:
+            if self._reloading:
+                self._reload_again = True
+                return False
+            self._reloading = True
+        threading.Thread(target=self._reload_loop, args=(trigger,), daemon=True).start()
+        return True
+
+    def _reload_loop(self, trigger):
+        while True:
+            try:
+                self.reload(trigger)
+            except Exception as e:
+                print(f'Error al recargar el índice: {e}', file=sys.stderr)
+            if self.on_reload is not None:
+                self.on_reload(self.last_reload)
+            else:
+                print(json.dumps(self.last_reload), file=sys.stderr)
+            with self._pending_lock:
+                # la repetición sobra si la recarga ya recogió la última versión
+                if self._reload_again and self._is_stale():
+                    self._reload_again = False
+                    continue
+                self._reload_again = self._reloading = False
+                return
+
+    def _is_stale(self):
+        db = get_db()
+        try:
+            return index_version(db) != loaded_version(self.index)
+        except Exception:
+            return True
+        finally:
+            db.close()
+
+    def watch(self, interval):
+        """Comprueba cada `interval` segundos si la versión del índice en la
+        base difiere de la cargada y, si es así, recarga en segundo plano."""
+        def loop():
+            db = get_db()
+            while True:
+                time.sleep(interval)
+                try:
+                    index = self.index
+                    if index is not None and index_version(db) != loaded_version(index):
+                        self.reload_async('watch')
+                except Exception as e:
+                    print(f'Error al comprobar la versión del índice: {e}', file=sys.stderr)
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def describe(self, index=None):
+        if index is None:
+            index = self.index
+        info = index_stats(index) if index is not None else {'sources': 0, 'terms': 0}
+        info['load_ms'] = round(self.load_ms, 1)
+        if self.shards:
+            info['shards'] = self.shards
+            info['reloaded_shards'] = index.reloaded if index is not None else []
+        return info
+
+    def close(self):
+        if isinstance(self.index, ShardedIndex):
+            self.index.close()
+
+    def handle(self, request):
+        response = self._handle(request)
+        if request.get('hydrate') and 'results' in response:
+            # registros de presentación (display_records.py) leídos en una sola consulta;
+            # la respuesta puede venir de la caché, así que se copia en vez de modificarla
+            response = dict(response)
+            if request.get('op') == 'search_batch':
+                response['results'] = hydrate_many(response['results'], self._read_db())
+            else:
+                response['results'] = hydrate(response['results'], self._read_db())
+        return response
+
+    def _read_db(self):
+        # una conexión de lectura por hilo (socket: un hilo por conexión), abierta una vez
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = get_db()
+        return db
+
+    def _count(self, n):
+        with self._queries_lock:
+            self.queries += n
+
+    def _handle(self, request):
+        op = request.get('op', 'search')
+        # una sola lectura de la referencia: una recarga a mitad de petición no la cambia
+        index = self.index
+        if op == 'search' and request.get('facets'):
+            self._count(1)
+            return search_facets(str(request.get('query') or ''),
+                                 int(request.get('top_k') or 20),
+                                 index=index, cache=self.cache, filters=request.get('filters'),
+                                 min_score=float(request.get('min_score') or 0.0),
+                                 year_bucket=int(request.get('year_bucket') or YEAR_BUCKET))
+        if op == 'search':
+            self._count(1)
+            results = search(str(request.get('query') or ''),
+                             int(request.get('top_k') or 20),
+                             index=index, cache=self.cache, filters=request.get('filters'))
+            return {'results': results}
+        if op == 'search_page':
+            if not request.get('cursor'):
+                self._count(1)
+            return search_page(str(request.get('query') or ''), request.get('page_size') or 20,
+                               cursor=request.get('cursor'), index=index, cache=self.cache,
+                               pages=self.pages, filters=request.get('filters'), page=request.get('page'),
+                               facets=bool(request.get('facets')),
+                               min_score=float(request.get('min_score') or 0.0),
+                               year_bucket=int(request.get('year_bucket') or YEAR_BUCKET))
+        if op == 'search_by_source':
+            if request.get('source_id') is None:
+                raise ValueError('falta "source_id"')
+            self._count(1)
+            results = search_by_source(int(request['source_id']), int(request.get('top_k') or 20),
+                                       index=index, cache=self.cache, filters=request.get('filters'),
+                                       db=self._read_db())
+            return {'results': results}
+        if op == 'search_batch':
+            queries = request.get('queries')
+            if not isinstance(queries, list):
+                raise ValueError('"queries" debe ser una lista de consultas')
+            self._count(len(queries))
+            results = search_batch([str(q or '') for q in queries],
+                                   int(request.get('top_k') or 20),
+                                   index=index, cache=self.cache, filters=request.get('filters'))
+            return {'results': results}
+        if op == 'reload':
+            if request.get('wait'):
+                return self.reload()
+            started = self.reload_async()
+            return {'reloading': True if started else 'queued', **self.describe(index)}
+        if op == 'ping':
+            return {}
+        if op == 'stats':
+            stats = self.describe(index)
+            stats.update({'queries': self.queries, 'loaded_at': self.loaded_at, 'pid': os.getpid(),
+                          'cache': self.cache.stats(), 'pages': self.pages.stats(),
+                          'last_reload': self.last_reload})
+            return stats
+        raise ValueError(f'operación desconocida: {op}')
+
+    def handle_line(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('la petición debe ser un objeto JSON')
+            request_id = request.get('id')
+            response = {'id': request_id, 'ok': True}
+            response.update(self.handle(request))
+        except Exception as e:
+            response = {'id': request_id, 'ok': False, 'error': str(e)}
+        return json.dumps(response)
+
+
+def serve_stdio(server):
+    out = sys.stdout
+    # las respuestas y los eventos de recarga (otro hilo) no deben mezclarse en una línea
+    lock = threading.Lock()
+
+    def write(line):
+        with lock:
+            out.write(line + '\n')
+            out.flush()
+
+    server.on_reload = lambda report: write(json.dumps(report))
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        write(server.handle_line(line))
+
+
+def serve_socket(server, path):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                line = raw.decode('utf-8')
+                if not line.strip():
+                    continue
+                self.wfile.write((server.handle_line(line) + '\n').encode('utf-8'))
+                self.wfile.flush()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as srv:
+        srv.daemon_threads = True
+        print(f'Escuchando en {path}', file=sys.stderr)
+        srv.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor residente de búsqueda TF-IDF (JSON por líneas)')
+    parser.add_argument('--socket', help='ruta de un socket Unix; por defecto se usa stdin/stdout')
+    parser.add_argument('--engine', choices=ENGINES, default=None,
+                        help='motor de puntuación (por defecto TFIDF_ENGINE o inverted)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_SIZE,
+                        help='entradas de la caché de resultados (0 = sin caché)')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL,
+                        help='segundos de vida de cada entrada de la caché')
+    parser.add_argument('--page-depth', type=int, default=DEFAULT_DEPTH,
+                        help='resultados que se puntúan y guardan para paginar con cursor')
+    parser.add_argument('--page-sets', type=int, default=DEFAULT_SETS,
+                        help='conjuntos de resultados paginados que se conservan (0 = sin cursores)')
+    parser.add_argument('--page-ttl', type=float, default=DEFAULT_PAGE_TTL,
+                        help='segundos de vida de cada conjunto paginado')
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS,
+                        help='procesos entre los que se reparten las fuentes (0 = un solo índice)')
+    parser.add_argument('--watch', type=float, default=RELOAD_INTERVAL,
+                        help='segundos entre comprobaciones de una versión nueva del índice (0 = no comprobar)')
+    args = parser.parse_args(argv)
+    if args.shards < 0:
+        parser.error('--shards no puede ser negativo')
+    if args.shards and (args.engine or DEFAULT_ENGINE) != 'inverted':
+        parser.error('--shards solo funciona con el motor inverted')
+
+    server = SearchServer(engine=args.engine, cache_size=args.cache_size, cache_ttl=args.cache_ttl,
+                          page_depth=args.page_depth, page_sets=args.page_sets, page_ttl=args.page_ttl,
+                          shards=args.shards)
+    info = server.reload('startup')
+    ready = {'event': 'ready', 'pid': os.getpid()}
+    ready.update(info)
+    ready.update(memory_usage())
+    print(json.dumps(ready), flush=True)
+    if args.watch > 0:
+        server.watch(args.watch)
+
+    try:
+        if args.socket:
+            serve_socket(server, args.socket)
+        else:
+            serve_stdio(server)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""Búsqueda repartida en shards entre procesos (scatter-gather).
+
+Las fuentes se reparten por hash de su id (source_id % n) en n shards. Cada
+shard es un proceso que carga con postings_index.InvertedIndex solo las
+listas y los atributos (source_attrs.py) de sus fuentes, y las puntúa con las
+mismas funciones que el índice residente de un solo proceso (MaxScore para
+una consulta, score_lists_batch para un lote, la pasada completa para las
+facetas). ShardedIndex, en el proceso del servidor, guarda los IDF globales:
+calcula el vector de la consulta una vez, lo envía a la vez a todos los
+shards por su pipe y mezcla sus top_k, ya ordenados, con un heap
+(heapq.merge). La puntuación de una fuente solo depende de sus postings, su
+norma y los IDF globales, así que el resultado es el mismo que con un único
+índice (salvo el orden en que se suman los float).
+
+ShardedIndex tiene la interfaz de SparseIndex (score, score_batch, idf,
+version...), así que search(), search_batch(), search_facets(),
+search_page() y search_by_source() lo usan sin cambios.
+
+Recarga: ShardedIndex.load(n, previous) relee los IDF y crea un índice nuevo
+que reutiliza los procesos de `previous` salvo los de los shards con fuentes
+en tfidf_changes desde el change_seq que cargó cada proceso (tras un
+reindexado completo, o si el registro se purgó entre medias, todos). La
+versión, los IDF y esos shards se leen en la misma transacción, así que un
+cambio registrado después queda para la recarga siguiente. Los shards que cambian se cargan en
+procesos nuevos, en paralelo, mientras `previous` sigue respondiendo; los
+procesos que ya no usa ningún índice se paran solos.
+
+Uso: python3 tf-idf/shards.py [--shards 4] [--queries 200] [--top-k 10]
+     compara carga, latencia y resultados con el índice de un solo proceso.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import weakref
+import threading
+import multiprocessing
+
+import db_utils
+from db_utils import get_db, index_version, fetch_idf
+from postings_index import InvertedIndex
+from source_attrs import SourceAttributes
+from search import (score_index_weights, score_index_weights_facets, score_lists_batch, merge_top_k, _matcher,
+                    load_index, search, search_batch)
+from preprocess import preprocess_batch
+from process_stats import memory_usage
+
+DEFAULT_SHARDS = int(os.environ.get('TFIDF_SHARDS', 0))
+# Intentos de carga si un reindexado cambia de generación mientras cargan los shards
+LOAD_ATTEMPTS = 3
+# Los shards se crean también desde el hilo de recarga del servidor: forkserver
+# evita hacer fork de un proceso con varios hilos
+_CONTEXT = multiprocessing.get_context('forkserver')
+
+
+def shard_of(source_id, n_shards):
+    return source_id % n_shards
+
+
+def load_shard(shard, n_shards):
+    """Índice del shard: listas y atributos de sus fuentes, en una transacción
+    de lectura (una sola generación). No carga IDF: los aplica el coordinador."""
+    started = time.perf_counter()
+    db = get_db()
+    try:
+        db.execute('BEGIN')
+        version = index_version(db)
+        index = InvertedIndex.from_db(db, {}, shard=(shard, n_shards))
+        index.attrs = SourceAttributes.from_db(db, shard=(shard, n_shards))
+    finally:
+        db.close()
+    index.generation, index.version = version[0], version
+    info = {'shard': shard, 'pid': os.getpid(), 'sources': index.n_sources, 'terms': index.n_terms,
+            'postings': index.n_postings, 'bytes': index.nbytes(), 'generation': version[0],
+            'change_seq': version[1], 'load_ms': round((time.perf_counter() - started) * 1000, 1),
+            **memory_usage()}
+    return index, info
+
+
+def _serve_shard(conn, shard, n_shards, db_path):
+    # Bucle del proceso de un shard: (operación, argumentos) -> (ok, respuesta)
+    db_utils.DB_PATH = db_path
+    index = None
+    while True:
+        try:
+            op, args = conn.recv()
+        except EOFError:
+            break
+        if op == 'stop':
+            break
+        try:
+            if op == 'load':
+                index, reply = load_shard(shard, n_shards)
+            elif index is None:
+                raise ValueError('shard sin cargar')
+            elif op == 'score':
+                weights, top_k, filters = args
+                reply = score_index_weights(index, weights, top_k, filters)
+            elif op == 'batch':
+                weights_list, top_k, filters = args
+                reply = score_lists_batch(weights_list, index.postings, top_k, _matcher(index, filters))
+            elif op == 'facets':
+                reply = score_index_weights_facets(index, *args)
+            else:
+                raise ValueError(f'operación desconocida: {op}')
+            conn.send((True, reply))
+        except Exception as e:
+            conn.send((False, f'shard {shard}: {e}'))
+    conn.close()
+
+
+def stale_shards(workers, db):
+    """Shards cuyo proceso no tiene ya las últimas fuentes de su parte: con
+    cambios en tfidf_changes posteriores al change_seq que ese proceso cargó
+    (worker.info), no al del coordinador, que se lee después."""
+    n_shards = len(workers)
+    generation, change_seq = index_version(db)
+    loaded = [worker.info for worker in workers]
+    if any(info['generation'] != generation for info in loaded):
+        return list(range(n_shards))
+    since = min(info['change_seq'] for info in loaded)
+    if change_seq == since:
+        return []
+    rows = db.execute('SELECT seq, source_id FROM tfidf_changes WHERE seq > ? ORDER BY seq', (since,)).fetchall()
+    # seq es AUTOINCREMENT: un hueco significa que el registro se purgó
+    # (index_snapshot.py) y ya no se sabe qué fuentes cambiaron
+    if not rows or rows[0][0] != since + 1:
+        return list(range(n_shards))
+    stale = set()
+    for seq, source_id in rows:
+        shard = shard_of(source_id, n_shards)
+        if seq > loaded[shard]['change_seq']:
+            stale.add(shard)
+    return sorted(stale)
+
+
+def _stop_worker(process, conn):
+    try:
+        conn.send(('stop', None))
+    except (BrokenPipeError, OSError):
+        pass
+    conn.close()
+    process.join(timeout=5)
+
+
+class ShardWorker:
+    """Proceso de un shard y su pipe. Lo comparten los ShardedIndex que lo
+    usan (una recarga reutiliza los de los shards sin cambios) y el proceso
+    se para cuando ninguno lo referencia ya, así que una consulta en curso
+    sobre un índice anterior termina con sus procesos."""
+
+    def __init__(self, shard, n_shards):
+        parent, child = _CONTEXT.Pipe()
+        process = _CONTEXT.Process(target=_serve_shard, args=(child, shard, n_shards, db_utils.DB_PATH),
+                                   daemon=True)
+        process.start()
+        child.close()
+        self.shard = shard
+        self.conn = parent
+        self.lock = threading.Lock()
+        self.info = None                 # último informe de carga (load_shard)
+        self.stop = weakref.finalize(self, _stop_worker, process, parent)
+
+
+def _scatter(workers, op, args):
+    # Envía la operación a todos los shards antes de esperar a ninguno; cada
+    # pipe se bloquea en orden de shard para no cruzar peticiones de dos hilos
+    for worker in workers:
+        worker.lock.acquire()
+    try:
+        for worker in workers:
+            worker.conn.send((op, args))
+        replies, errors = [], []
+        for worker in workers:
+            ok, reply = worker.conn.recv()
+            replies.append(reply)
+            if not ok:
+                errors.append(reply)
+    finally:
+        for worker in workers:
+            worker.lock.release()
+    if errors:
+        raise RuntimeError('; '.join(errors))
+    return replies
+
+
+class ShardedIndex:
+    engine = 'inverted'
+
+    def __init__(self, workers, idf, version, reloaded=()):
+        self.workers = workers
+        self.n_shards = len(workers)
+        self.idf = idf
+        self.version = version
+        self.generation = version[0]
+        self.reloaded = list(reloaded)   # shards cargados al crear este índice
+        # Los atributos están en los shards: el FacetCounter del coordinador
+        # (search.score_index_weights_facets) solo suma los conteos de cada uno
+        self.attrs = SourceAttributes(0)
+
+    @classmethod
+    def load(cls, n_shards, previous=None):
+        """Índice en n_shards procesos. Con `previous` (un ShardedIndex con el
+        mismo número de shards) reutiliza sus procesos salvo los de los shards
+        que cambiaron (stale_shards), que se sustituyen por procesos nuevos
+        cargados en paralelo mientras `previous` sigue respondiendo."""
+        if n_shards < 1:
+            raise ValueError('hace falta al menos un shard')
+        if previous is not None and previous.n_shards == n_shards:
+            workers = list(previous.workers)
+        else:
+            workers = [None] * n_shards
+        fresh = set()
+        for _ in range(LOAD_ATTEMPTS):
+            db = get_db()
+            try:
+                # Versión, IDF y shards a recargar en una sola transacción de
+                # lectura: un cambio registrado después no lleva esta versión
+                db.execute('BEGIN')
+                version = index_version(db)
+                idf = fetch_idf(db.cursor())
+                stale = list(range(n_shards)) if None in workers else stale_shards(workers, db)
+            finally:
+                db.close()
+            for shard in stale:
+                if shard not in fresh:
+                    workers[shard] = ShardWorker(shard, n_shards)
+                    fresh.add(shard)
+            loading = [workers[shard] for shard in stale]
+            for worker, info in zip(loading, _scatter(loading, 'load', None)):
+                worker.info = info
+            # Un shard de otra generación (reindexado a mitad de carga) no se
+            # puede combinar con estos IDF: se recargan todos
+            if all(worker.info['generation'] == version[0] for worker in workers):
+                return cls(workers, idf, version, sorted(fresh))
+        raise RuntimeError('el índice cambió de generación en cada intento de carga')
+
+    @property
+    def shards(self):
+        return [worker.info for worker in self.workers]
+
+    @property
+    def n_sources(self):
+        return sum(worker.info['sources'] for worker in self.workers)
+
+    def stale_shards(self, db):
+        """Shards con fuentes indexadas o retiradas desde que su proceso cargó."""
+        return stale_shards(self.workers, db)
+
+    def score(self, weights, top_k=20, filters=None, min_score=0.0, counter=None):
+        """Misma interfaz que SparseIndex.score: weights es {término: factor}
+        (search.term_weights); con counter, cada shard cuenta sus facetas y
+        aquí se suman."""
+        if counter is None:
+            partials = _scatter(self.workers, 'score', (weights, top_k, filters))
+        else:
+            replies = _scatter(self.workers, 'facets', (weights, top_k, filters, min_score, counter.year_bucket))
+            for reply in replies:
+                counter.merge(reply['facets'])
+            partials = [reply['results'] for reply in replies]
+        return merge_top_k(partials, top_k)
+
+    def score_batch(self, weights_list, top_k=20, filters=None):
+        partials = _scatter(self.workers, 'batch', (weights_list, top_k, filters))
+        return [merge_top_k(per_query, top_k) for per_query in zip(*partials)]
+
+    def close(self):
+        """Para los procesos de este índice, también los que comparta con otro."""
+        for worker in self.workers:
+            with worker.lock:
+                worker.stop()
+
+
+def compare(n_shards, queries, top_k=10):
+    """Carga y latencia del índice en shards frente al de un solo proceso, y
+    número de consultas cuyos resultados difieren."""
+    started = time.perf_counter()
+    single = load_index(engine='inverted')
+    single_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    sharded = ShardedIndex.load(n_shards)
+    sharded_ms = (time.perf_counter() - started) * 1000
+    try:
+        preprocess_batch(queries)       # caché de raíces caliente para los dos
+        timings, outputs = {}, {}
+        for name, index in (('single', single), ('sharded', sharded)):
+            started = time.perf_counter()
+            outputs[name] = [search(q, top_k, index=index) for q in queries]
+            timings[name] = round((time.perf_counter() - started) * 1000 / max(len(queries), 1), 3)
+            started = time.perf_counter()
+            outputs[name + '_batch'] = search_batch(queries, top_k, index=index)
+            timings[name + '_batch'] = round((time.perf_counter() - started) * 1000, 1)
+
+        def same(a, b):
+            return ([r['source_id'] for r in a] == [r['source_id'] for r in b]
+                    and all(abs(x['score'] - y['score']) < 1e-9 for x, y in zip(a, b)))
+        mismatches = sum(not same(a, b) for a, b in zip(outputs['single'], outputs['sharded']))
+        mismatches += sum(not same(a, b) for a, b in zip(outputs['single_batch'], outputs['sharded_batch']))
+        return {'shards': sharded.shards, 'load_ms': {'single': round(single_ms, 1), 'sharded': round(sharded_ms, 1)},
+                'query_ms': {'single': timings['single'], 'sharded': timings['sharded']},
+                'batch_ms': {'single': timings['single_batch'], 'sharded': timings['sharded_batch']},
+                'queries': len(queries), 'mismatches': mismatches}
+    finally:
+        sharded.close()
+
+
+def sample_queries(n, seed=0):
+    # Dos o tres palabras de títulos del corpus
+    db = get_db()
+    try:
+        titles = [r[0] for r in db.execute('SELECT title FROM sources WHERE title IS NOT NULL')]
+    finally:
+        db.close()
+    rng = random.Random(seed)
+    out = []
+    for title in rng.sample(titles, min(n, len(titles))):
+        words = title.split()
+        out.append(' '.join(rng.sample(words, min(len(words), rng.choice((2, 3))))))
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Índice TF-IDF en shards frente a un solo proceso')
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS or 4)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    args = parser.parse_args()
+    if args.shards < 1:
+        print('--shards debe ser al menos 1', file=sys.stderr)
+        sys.exit(2)
+    print(json.dumps(compare(args.shards, sample_queries(args.queries), args.top_k), ensure_ascii=False))
@@ -0,0 +1,164 @@
+"""Formato de la instantánea mmap del índice (index_snapshot.py), sin NumPy.
+
+Aquí está todo lo que necesita quien solo la lee: la cabecera, la posición de
+cada sección y las vistas término -> fila e IDF. index_snapshot.py la escribe
+y la abre como matriz CSR para el motor numpy; postings_snapshot.py la abre
+como InvertedIndex para el motor inverted, con vistas memoryview de cero
+copias, de modo que el servidor arranca sin importar NumPy.
+
+Formato (little-endian, versión 3):
+  cabecera de 64 bytes: magic b'ATFIDX\\0\\0', versión u32, generación u32,
+      n_terms u64, n_sources u64, n_postings u64, bytes del diccionario u64,
+      change_seq i64 (último tfidf_changes.seq incluido), total_docs i64
+  y a continuación, cada sección alineada a 8 bytes:
+      term_offsets  uint64[n_terms + 1]  inicio de cada término en el diccionario
+      term_blob     bytes                términos UTF-8 ordenados, concatenados
+      idf           float64[n_terms]     NaN si el término no está en global_idf
+      indptr        int64[n_terms + 1]   filas CSR
+      indices       int32[n_postings]    columna (posición en source_ids)
+      data          float32[n_postings]  tf / norm (el IDF se aplica al consultar)
+      source_ids    int64[n_sources]     ordenados
+      posting_ids   int32[n_postings]    source_id de cada posting (motor inverted)
+      max_weights   float32[n_terms]     cota MaxScore: máximo |tf / norm| del término
+"""
+import sys
+import mmap
+import struct
+from bisect import bisect_left
+
+MAGIC = b'ATFIDX\x00\x00'
+VERSION = 3
+HEADER = struct.Struct('<8sIIQQQQqq')
+HEADER_SIZE = 64
+
+# (sección, código de tipo de array/memoryview, tamaño en función de la cabecera)
+SECTIONS = (
+    ('term_offsets', 'Q', lambda h: h['terms'] + 1),
+    ('term_blob', 'B', lambda h: h['blob_len']),
+    ('idf', 'd', lambda h: h['terms']),
+    ('indptr', 'q', lambda h: h['terms'] + 1),
+    ('indices', 'i', lambda h: h['postings']),
+    ('data', 'f', lambda h: h['postings']),
+    ('source_ids', 'q', lambda h: h['sources']),
+    ('posting_ids', 'i', lambda h: h['postings']),
+    ('max_weights', 'f', lambda h: h['terms']),
+)
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def layout(header):
+    """Desplazamiento, código de tipo y número de elementos de cada sección,
+    derivados solo de los tamaños de la cabecera; y el tamaño total."""
+    sections = {}
+    offset = HEADER_SIZE
+    for name, code, count in SECTIONS:
+        offset = _align(offset)
+        n = count(header)
+        sections[name] = (offset, code, n)
+        offset += struct.calcsize(code) * n
+    return sections, offset
+
+
+def read_header(mm):
+    if len(mm) < HEADER_SIZE:
+        raise SnapshotError('instantánea truncada')
+    (magic, version, generation, n_terms, n_sources, n_postings, blob_len,
+     change_seq, total_docs) = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC:
+        raise SnapshotError('no es una instantánea de índice TF-IDF')
+    if version != VERSION:
+        raise SnapshotError(f'versión de instantánea {version} no soportada (se espera {VERSION})')
+    return {'version': version, 'generation': generation, 'terms': n_terms, 'sources': n_sources, 'postings': n_postings,
+            'blob_len': blob_len, 'change_seq': change_seq, 'total_docs': total_docs}
+
+
+def map_snapshot(path):
+    """Mapea la instantánea en solo lectura: (mmap, cabecera, secciones)."""
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    header = read_header(mm)
+    sections, total = layout(header)
+    if len(mm) < total:
+        raise SnapshotError('instantánea truncada')
+    return mm, header, sections
+
+
+def section_view(mm, sections, name):
+    """memoryview tipado de una sección (sin copia). Los datos son little-endian."""
+    if sys.byteorder != 'little':
+        raise SnapshotError('la instantánea solo se puede mapear en máquinas little-endian')
+    offset, code, count = sections[name]
+    return memoryview(mm)[offset:offset + struct.calcsize(code) * count].cast(code)
+
+
+class TermDictionary:
+    """Diccionario término -> fila sobre el bloque ordenado de la instantánea
+    (búsqueda binaria, sin decodificar el diccionario completo)."""
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self._blob[int(self._offsets[i]):int(self._offsets[i + 1])])
+
+    def get(self, term, default=None):
+        key = term.encode('utf-8')
+        i = bisect_left(self, key)
+        if i < len(self) and self[i] == key:
+            return i
+        return default
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+
+class SnapshotIdf:
+    """Vista término -> idf con la misma interfaz .get() que un dict."""
+
+    def __init__(self, vocabulary, idf):
+        self._vocabulary = vocabulary
+        self._idf = idf
+
+    def __len__(self):
+        return len(self._idf)
+
+    def get(self, term, default=None):
+        row = self._vocabulary.get(term)
+        if row is None:
+            return default
+        value = float(self._idf[row])
+        return default if value != value else value
+
+
+class OverlayIdf:
+    """IDF de la instantánea al día: los términos de las fuentes cambiadas se
+    leen de SQLite y al resto se les suma log(N actual / N de la instantánea),
+    que es lo único que cambia en log(N / (1 + doc_freq)) si doc_freq no cambió."""
+
+    def __init__(self, base, fresh, shift):
+        self._base = base
+        self._fresh = fresh
+        self._shift = shift
+
+    def __len__(self):
+        return len(self._base)
+
+    def get(self, term, default=None):
+        if term in self._fresh:
+            idf = self._fresh[term]
+        else:
+            idf = self._base.get(term)
+            if idf is not None:
+                idf += self._shift
+        return default if idf is None else idf
@@ -0,0 +1,303 @@
+"""Atributos de las fuentes en memoria para filtrar dentro del motor de búsqueda.
+
+Se leen de `sources` al cargar el índice (search.load_index, en la misma
+transacción de lectura) y se guardan por columnas: un array compacto por
+atributo indexado por source_id. Así un filtro se comprueba por candidato en el
+motor inverted (matcher) o como una máscara vectorizada sobre las columnas de
+la matriz en el motor numpy (column_mask), y el top_k que devuelve la búsqueda
+ya es el top_k después de filtrar.
+
+Filtros admitidos (todos opcionales, se combinan con AND):
+  source_type_id, category_id, subcategory_id   id o lista de ids
+  year_from, year_to                             publication_year dentro del rango
+  rating_min, rating_max                         overall_rating dentro del rango
+  is_active                                      true / false
+  exclude_ids                                    ids que no deben aparecer
+  exclude_list                                   id de una lista curatorial cuyas
+                                                 fuentes se excluyen (se resuelve
+                                                 en SQLite en cada consulta)
+
+Como en SQL, un atributo NULL no cumple ningún filtro sobre ese atributo.
+
+Las mismas columnas sirven para contar facetas (FacetCounter) de todas las
+fuentes que superan el umbral de similitud, en la misma pasada que las puntúa.
+"""
+import json
+from array import array
+
+# Valor de los atributos enteros NULL (o de ids sin fila en sources)
+MISSING = -2 ** 31
+
+ID_FILTERS = ('source_type_id', 'category_id', 'subcategory_id')
+RANGE_FILTERS = {
+    'year_from': ('publication_year', '>='),
+    'year_to': ('publication_year', '<='),
+    'rating_min': ('overall_rating', '>='),
+    'rating_max': ('overall_rating', '<='),
+}
+FILTER_KEYS = ID_FILTERS + tuple(RANGE_FILTERS) + ('is_active', 'exclude_ids', 'exclude_list')
+
+ATTRS_SQL = '''
+    SELECT id, source_type_id, category_id, subcategory_id, publication_year, overall_rating, is_active
+    FROM sources
+'''
+CHUNK_SIZE = 500
+
+# Facetas por id y tamaño (años) de los tramos de la faceta de año de publicación
+FACETS = ('category_id', 'subcategory_id', 'source_type_id')
+YEAR_BUCKET = 10
+
+
+def _id_list(value, key):
+    values = value if isinstance(value, (list, tuple)) else [value]
+    try:
+        return sorted({int(v) for v in values if v is not None and v != ''})
+    except (TypeError, ValueError):
+        raise ValueError(f'filtro {key}: se esperaba un id o una lista de ids')
+
+
+def normalize_filters(filters):
+    """Valida los filtros y los deja en forma canónica (listas de ids ordenadas,
+    números); None si no hay ninguno. Lanza ValueError ante una clave o un
+    valor no válidos."""
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError('los filtros deben ser un objeto')
+    unknown = sorted(set(filters) - set(FILTER_KEYS))
+    if unknown:
+        raise ValueError(f'filtros desconocidos: {", ".join(unknown)}')
+    out = {}
+    for key, value in filters.items():
+        if value is None or value == '' or value == []:
+            continue
+        if key in ID_FILTERS or key == 'exclude_ids':
+            ids = _id_list(value, key)
+            if ids:
+                out[key] = ids
+        elif key in RANGE_FILTERS:
+            try:
+                out[key] = float(value) if key.startswith('rating') else int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'filtro {key}: se esperaba un número')
+        elif key == 'is_active':
+            out[key] = bool(value)
+        else:
+            try:
+                out[key] = int(value)
+            except (TypeError, ValueError):
+                raise ValueError('filtro exclude_list: se esperaba el id de una lista')
+    return out or None
+
+
+def resolve_filters(filters, db):
+    """Sustituye exclude_list por los ids actuales de esa lista (exclude_ids),
+    de modo que la caché de resultados distinga los cambios de la lista."""
+    if not filters or 'exclude_list' not in filters:
+        return filters
+    filters = dict(filters)
+    list_id = filters.pop('exclude_list')
+    rows = db.execute('SELECT source_id FROM list_sources WHERE list_id = ?', (list_id,)).fetchall()
+    excluded = sorted(set(filters.get('exclude_ids', [])) | {r[0] for r in rows})
+    if excluded:
+        filters['exclude_ids'] = excluded
+    return filters or None
+
+
+def filter_key(filters):
+    # Representación estable para la clave de la caché de resultados
+    return json.dumps(filters, sort_keys=True) if filters else None
+
+
+def filter_sql(filters, alias='s'):
+    """Cláusula WHERE (sin la palabra WHERE) y parámetros equivalentes a los
+    filtros, para empujarlos a la consulta de postings cuando no hay índice
+    residente. exclude_list debe estar ya resuelto (resolve_filters)."""
+    clauses = []
+    params = []
+    for key in ID_FILTERS:
+        if key in filters:
+            ids = filters[key]
+            clauses.append(f"{alias}.{key} IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+    for key, (column, op) in RANGE_FILTERS.items():
+        if key in filters:
+            clauses.append(f'{alias}.{column} {op} ?')
+            params.append(filters[key])
+    if 'is_active' in filters:
+        clauses.append(f'{alias}.is_active = ?')
+        params.append(int(filters['is_active']))
+    if filters.get('exclude_ids'):
+        ids = filters['exclude_ids']
+        clauses.append(f"{alias}.id NOT IN ({','.join('?' * len(ids))})")
+        params.extend(ids)
+    return ' AND '.join(clauses) or '1', params
+
+
+class SourceAttributes:
+    """Columnas de atributos indexadas por source_id."""
+
+    def __init__(self, size):
+        self.size = size
+        self.source_type_id = array('i', [MISSING]) * size
+        self.category_id = array('i', [MISSING]) * size
+        self.subcategory_id = array('i', [MISSING]) * size
+        self.publication_year = array('i', [MISSING]) * size
+        self.overall_rating = array('d', [float('nan')]) * size
+        self.is_active = array('b', [0]) * size
+
+    @classmethod
+    def from_db(cls, db, source_ids=None, shard=None):
+        """Todas las fuentes, o solo `source_ids` (búsqueda sin índice residente),
+        o solo las del shard (i, n): id % n == i (shards.py)."""
+        if shard is not None:
+            rows = db.execute(f'{ATTRS_SQL} WHERE id % ? = ?', (shard[1], shard[0])).fetchall()
+        elif source_ids is None:
+            rows = db.execute(ATTRS_SQL).fetchall()
+        else:
+            source_ids = sorted(set(source_ids))
+            rows = []
+            for i in range(0, len(source_ids), CHUNK_SIZE):
+                chunk = source_ids[i:i + CHUNK_SIZE]
+                rows.extend(db.execute(f"{ATTRS_SQL} WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+        attrs = cls(max((r[0] for r in rows), default=0) + 1)
+        for source_id, type_id, category_id, subcategory_id, year, rating, active in rows:
+            if type_id is not None:
+                attrs.source_type_id[source_id] = type_id
+            if category_id is not None:
+                attrs.category_id[source_id] = category_id
+            if subcategory_id is not None:
+                attrs.subcategory_id[source_id] = subcategory_id
+            if year is not None:
+                attrs.publication_year[source_id] = year
+            if rating is not None:
+                attrs.overall_rating[source_id] = rating
+            attrs.is_active[source_id] = 1 if active else 0
+        return attrs
+
+    def matcher(self, filters):
+        """Función source_id -> bool que aplica los filtros a un candidato."""
+        checks = []
+        for key in ID_FILTERS:
+            if key in filters:
+                column, allowed = getattr(self, key), set(filters[key])
+                checks.append(lambda i, column=column, allowed=allowed: column[i] in allowed)
+        year = self.publication_year
+        if 'year_from' in filters:
+            low = filters['year_from']
+            checks.append(lambda i: year[i] != MISSING and year[i] >= low)
+        if 'year_to' in filters:
+            high = filters['year_to']
+            checks.append(lambda i: year[i] != MISSING and year[i] <= high)
+        rating = self.overall_rating
+        if 'rating_min' in filters:
+            low_rating = filters['rating_min']
+            checks.append(lambda i: rating[i] >= low_rating)   # NaN (NULL) nunca cumple
+        if 'rating_max' in filters:
+            high_rating = filters['rating_max']
+            checks.append(lambda i: rating[i] <= high_rating)
+        if 'is_active' in filters:
+            active, wanted = self.is_active, int(filters['is_active'])
+            checks.append(lambda i: active[i] == wanted)
+        if filters.get('exclude_ids'):
+            excluded = set(filters['exclude_ids'])
+            checks.append(lambda i: i not in excluded)
+        size = self.size
+
+        def accept(source_id):
+            if source_id >= size:
+                return False
+            for check in checks:
+                if not check(source_id):
+                    return False
+            return True
+        return accept
+
+    def column_mask(self, filters, source_ids):
+        """Máscara booleana (NumPy) de las posiciones de `source_ids` que
+        cumplen los filtros."""
+        import numpy as np
+        ids = np.asarray(source_ids, dtype=np.int64)
+        mask = ids < self.size
+        at = np.where(mask, ids, 0)
+        for key in ID_FILTERS:
+            if key in filters:
+                column = np.frombuffer(getattr(self, key), dtype=np.int32)[at]
+                mask &= np.isin(column, np.asarray(filters[key], dtype=np.int32))
+        if 'year_from' in filters or 'year_to' in filters:
+            year = np.frombuffer(self.publication_year, dtype=np.int32)[at]
+            mask &= year != MISSING
+            if 'year_from' in filters:
+                mask &= year >= filters['year_from']
+            if 'year_to' in filters:
+                mask &= year <= filters['year_to']
+        if 'rating_min' in filters or 'rating_max' in filters:
+            rating = np.frombuffer(self.overall_rating, dtype=np.float64)[at]
+            if 'rating_min' in filters:
+                mask &= rating >= filters['rating_min']
+            if 'rating_max' in filters:
+                mask &= rating <= filters['rating_max']
+        if 'is_active' in filters:
+            mask &= np.frombuffer(self.is_active, dtype=np.int8)[at] == int(filters['is_active'])
+        if filters.get('exclude_ids'):
+            mask &= ~np.isin(ids, np.asarray(filters['exclude_ids'], dtype=np.int64))
+        return mask
+
+
+class FacetCounter:
+    """Conteos de facetas (categoría, subcategoría, tipo y tramo de año) de las
+    fuentes que el motor acepta mientras puntúa. Los valores NULL no cuentan
+    en su faceta, pero sí en `matched`."""
+
+    def __init__(self, attrs, year_bucket=YEAR_BUCKET):
+        if attrs is None:
+            raise ValueError('el índice no tiene atributos de las fuentes: no admite facetas')
+        self.attrs = attrs
+        self.year_bucket = max(1, int(year_bucket))
+        self.matched = 0
+        self.counts = {name: {} for name in FACETS + ('year',)}
+
+    def add(self, source_id):
+        self.matched += 1
+        attrs = self.attrs
+        if source_id >= attrs.size:
+            return
+        for name in FACETS:
+            value = getattr(attrs, name)[source_id]
+            if value != MISSING:
+                counts = self.counts[name]
+                counts[value] = counts.get(value, 0) + 1
+        year = attrs.publication_year[source_id]
+        if year != MISSING:
+            bucket = year - year % self.year_bucket
+            counts = self.counts['year']
+            counts[bucket] = counts.get(bucket, 0) + 1
+
+    def add_many(self, source_ids):
+        """Versión vectorizada de add para un array NumPy de source_ids."""
+        import numpy as np
+        ids = np.asarray(source_ids, dtype=np.int64)
+        self.matched += len(ids)
+        ids = ids[ids < self.attrs.size]
+        columns = {name: np.frombuffer(getattr(self.attrs, name), dtype=np.int32)[ids] for name in FACETS}
+        year = np.frombuffer(self.attrs.publication_year, dtype=np.int32)[ids]
+        year = year[year != MISSING]
+        columns['year'] = year - year % self.year_bucket
+        for name, values in columns.items():
+            values, counts = np.unique(values[values != MISSING], return_counts=True)
+            target = self.counts[name]
+            for value, count in zip(values.tolist(), counts.tolist()):
+                target[value] = target.get(value, 0) + count
+
+    def merge(self, facets):
+        """Suma los conteos de otro result() (los de cada shard, ver shards.py)."""
+        self.matched += facets['matched']
+        for name, counts in self.counts.items():
+            for value, count in facets[name].items():
+                counts[value] = counts.get(value, 0) + count
+
+    def result(self):
+        facets = {name: dict(sorted(counts.items())) for name, counts in self.counts.items()}
+        facets['matched'] = self.matched
+        facets['year_bucket'] = self.year_bucket
+        return facets
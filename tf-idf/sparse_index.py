@@ -0,0 +1,188 @@
+"""Motor de puntuación vectorizado con NumPy.
+
+El corpus se guarda como una matriz CSR términos × fuentes: la fila de cada
+término es su lista de postings (posiciones de columna en `source_ids`) y los
+valores son el TF en float32 ya dividido por la norma de la fuente; el IDF se
+aplica al consultar (search.term_weights). Una consulta se puntúa como un único
+producto matriz dispersa × vector sobre las filas de sus términos (y un lote de
+consultas, como matriz de consultas × matriz dispersa), y el top_k se
+selecciona con argpartition.
+"""
+import numpy as np
+from db_utils import fetch_idf
+from source_attrs import filter_sql
+
+# Celdas (consultas × fuentes) de la matriz densa de puntuaciones de score_batch
+BATCH_CELLS = 1 << 22
+
+
+class SparseIndex:
+    engine = 'numpy'
+    change_seq = 0
+    generation = 0
+    version = (0, 0)
+    attrs = None                        # source_attrs.SourceAttributes, para filtrar
+
+    def __init__(self, vocabulary, idf, indptr, indices, data, source_ids):
+        self.vocabulary = vocabulary    # término -> fila
+        self.idf = idf                  # término -> idf
+        self.indptr = indptr            # int64, n_terms + 1
+        self.indices = indices          # int32, columna (posición en source_ids) de cada posting
+        self.data = data                # float32, tf / norm de cada posting
+        self.source_ids = source_ids    # int64, source_id de cada columna
+
+    @classmethod
+    def from_db(cls, db, terms=None, source_ids=None, filters=None):
+        """Construye la matriz desde SQLite; con `terms` solo carga esas filas
+        (suficiente para responder una única consulta), con `source_ids` solo
+        esas columnas y con `filters` (source_attrs) solo las fuentes que los
+        cumplen."""
+        cursor = db.cursor()
+        join = ''
+        where = ''
+        params = []
+        if filters:
+            clause, filter_params = filter_sql(filters)
+            join = 'JOIN sources s ON s.id = p.source_id'
+            where += f'AND {clause} '
+            params.extend(filter_params)
+        if terms is not None:
+            terms = sorted(set(terms))
+            where += f"AND t.term IN ({','.join('?' * len(terms))}) "
+            params.extend(terms)
+        if source_ids is not None:
+            source_ids = list(source_ids)
+            where += f"AND p.source_id IN ({','.join('?' * len(source_ids))}) "
+            params.extend(source_ids)
+
+        # Filas agrupadas por término en el orden de la clave (term_id, source_id)
+        cursor.execute(f'''
+            SELECT t.term, p.source_id, p.tf / n.norm
+            FROM tfidf_postings p
+            JOIN tfidf_terms t ON t.term_id = p.term_id
+            JOIN source_norms n ON p.source_id = n.source_id
+            {join}
+            WHERE n.norm > 0 {where}
+            ORDER BY p.term_id, p.source_id
+        ''', params)
+        rows = cursor.fetchall()
+        # Con solo `source_ids`, basta el IDF de los términos de esas fuentes
+        if terms is None and source_ids is not None:
+            idf = fetch_idf(cursor, [r[0] for r in rows])
+        else:
+            idf = fetch_idf(cursor, terms)
+
+        if terms is None and source_ids is None and not filters:
+            cursor.execute('SELECT source_id FROM source_norms WHERE norm > 0 ORDER BY source_id')
+            source_ids = np.array([r[0] for r in cursor.fetchall()], dtype=np.int64)
+        else:
+            source_ids = np.unique(np.array([r[1] for r in rows], dtype=np.int64))
+
+        vocabulary = {}
+        counts = []
+        for term, _, _ in rows:
+            if term not in vocabulary:
+                vocabulary[term] = len(counts)
+                counts.append(0)
+            counts[-1] += 1
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        posting_ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        indices = np.searchsorted(source_ids, posting_ids).astype(np.int32)
+        data = np.fromiter((r[2] for r in rows), dtype=np.float32, count=len(rows))
+        return cls(vocabulary, idf, indptr, indices, data, source_ids)
+
+    @property
+    def n_terms(self):
+        return len(self.indptr) - 1
+
+    @property
+    def n_sources(self):
+        return len(self.source_ids)
+
+    def filter_exclude(self, filters, exclude=None):
+        """Añade a `exclude` las columnas que no cumplen los filtros."""
+        if not filters:
+            return exclude
+        if self.attrs is None:
+            raise ValueError('el índice no tiene atributos de las fuentes: no admite filtros')
+        rejected = ~self.attrs.column_mask(filters, self.source_ids)
+        return rejected if exclude is None else rejected | exclude
+
+    def score(self, query_vector, top_k=20, exclude=None, filters=None, min_score=0.0, counter=None):
+        """query_vector: {término: factor sobre tf / norm} (search.term_weights).
+        exclude: máscara booleana opcional de columnas que no deben puntuarse;
+        filters: filtros de source_attrs, aplicados antes de elegir el top_k;
+        counter: source_attrs.FacetCounter al que se añaden todas las fuentes
+        aceptadas con puntuación >= min_score."""
+        exclude = self.filter_exclude(filters, exclude)
+        columns = []
+        values = []
+        for term, qw in query_vector.items():
+            row = self.vocabulary.get(term)
+            if row is None:
+                continue
+            start, end = self.indptr[row], self.indptr[row + 1]
+            columns.append(self.indices[start:end])
+            values.append(np.multiply(self.data[start:end], qw, dtype=np.float64))
+        if not columns or (top_k <= 0 and counter is None):
+            return []
+
+        # Producto disperso: solo se suman las columnas que aparecen en las filas de la consulta
+        touched, inverse = np.unique(np.concatenate(columns), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(values), minlength=len(touched))
+        return self._select(touched, scores, top_k, exclude, min_score, counter)
+
+    def score_batch(self, query_vectors, top_k=20, exclude=None, filters=None):
+        """Varias consultas como un producto matriz de consultas × índice: las
+        puntuaciones de un bloque de consultas se acumulan con un único bincount
+        sobre una matriz densa consultas × fuentes (acotada a BATCH_CELLS
+        celdas). Devuelve una lista de resultados por consulta, iguales a los
+        de score()."""
+        exclude = self.filter_exclude(filters, exclude)
+        n_sources = self.n_sources
+        step = max(1, BATCH_CELLS // max(n_sources, 1))
+        results = []
+        for first in range(0, len(query_vectors), step):
+            block = query_vectors[first:first + step]
+            columns = []
+            values = []
+            for j, query_vector in enumerate(block):
+                for term, qw in query_vector.items():
+                    row = self.vocabulary.get(term)
+                    if row is None:
+                        continue
+                    start, end = self.indptr[row], self.indptr[row + 1]
+                    # columna de la matriz densa: consulta j × n_sources + fuente
+                    columns.append(self.indices[start:end] + j * n_sources)
+                    values.append(np.multiply(self.data[start:end], qw, dtype=np.float64))
+            if not columns or top_k <= 0:
+                results.extend([] for _ in block)
+                continue
+            scores = np.bincount(np.concatenate(columns), weights=np.concatenate(values),
+                                 minlength=len(block) * n_sources).reshape(len(block), n_sources)
+            for row in scores:
+                touched = np.flatnonzero(row)
+                results.append(self._select(touched, row[touched], top_k, exclude) if len(touched) else [])
+        return results
+
+    def _select(self, touched, scores, top_k, exclude=None, min_score=0.0, counter=None):
+        # top_k de las columnas puntuadas, por puntuación y después por source_id
+        positive = scores > 0
+        if min_score > 0:
+            positive &= scores >= min_score
+        if exclude is not None:
+            positive &= ~exclude[touched]
+        touched = touched[positive]
+        scores = scores[positive]
+        if counter is not None:
+            counter.add_many(self.source_ids[touched])
+        if top_k <= 0:
+            return []
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            touched = touched[best]
+            scores = scores[best]
+        ids = self.source_ids[touched]
+        order = np.lexsort((ids, -scores))
+        return [{'source_id': int(ids[i]), 'score': float(scores[i])} for i in order]
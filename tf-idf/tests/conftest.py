@@ -0,0 +1,37 @@
+"""Fixtures de los tests de tf-idf/: los módulos se importan planos, como los
+importan los scripts entre sí, y cada test trabaja sobre su propia base."""
+import os
+import sys
+import sqlite3
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# preprocess.py lee TFIDF_LEXICON al importarse: un léxico que aún no existe
+os.environ['TFIDF_LEXICON'] = os.path.join(tempfile.mkdtemp(prefix='tfidf-tests-'), 'tfidf_lexicon.json')
+
+import db_utils  # noqa: E402
+import preprocess  # noqa: E402
+import recalc_idf  # noqa: E402
+from corpus import create_corpus  # noqa: E402
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """Ruta de una base con el corpus de prueba ya indexado por recalc_idf.py;
+    la instantánea y el léxico quedan en el mismo directorio temporal."""
+    path = str(tmp_path / 'articora.db')
+    create_corpus(path)
+    monkeypatch.setattr(db_utils, 'DB_PATH', path)
+    monkeypatch.setattr(recalc_idf, 'SNAPSHOT_PATH', str(tmp_path / 'tfidf_index.bin'))
+    monkeypatch.setattr(preprocess, 'LEXICON_PATH', str(tmp_path / 'tfidf_lexicon.json'))
+    recalc_idf.recalc_idf()
+    return path
+
+
+@pytest.fixture
+def db(corpus):
+    connection = sqlite3.connect(corpus)
+    yield connection
+    connection.close()
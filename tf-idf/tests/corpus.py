@@ -0,0 +1,93 @@
+"""Corpus de prueba del índice TF-IDF: una base SQLite creada con
+database/init.sql e indexes.sql, con un conjunto fijo de fuentes, y utilidades
+para leer el estado del índice y compararlo con un reindexado completo."""
+import os
+import random
+import shutil
+import sqlite3
+
+TFIDF_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_DIR = os.path.join(os.path.dirname(TFIDF_DIR), 'database')
+
+VOCABULARY = ('análisis datos investigación aprendizaje automático redes neuronales historia méxico economía '
+              'política educación superior salud pública biología molecular química orgánica física cuántica '
+              'matemáticas estadística bayesiana literatura española filosofía moderna sociología urbana '
+              'psicología cognitiva ingeniería software sistemas distribuidos bases relacionales teoría grafos '
+              'algoritmos genéticos clima cambio energía renovable agricultura sostenible derecho '
+              'constitucional arte contemporáneo').split()
+AUTHORS = ('García López', 'María Pérez', 'Juan Hernández', 'Ana Martínez', 'Luis Rodríguez', 'Sofía Torres')
+N_SOURCES = 60
+
+
+def create_corpus(path, n_sources=N_SOURCES, seed=7):
+    """Base nueva con n_sources fuentes (una de cada 13 inactiva) y sus autores."""
+    db = sqlite3.connect(path)
+    for name in ('init.sql', 'indexes.sql'):
+        with open(os.path.join(DATABASE_DIR, name), encoding='utf-8') as f:
+            db.executescript(f.read())
+    db.execute('PRAGMA foreign_keys = OFF')     # sin usuarios: uploaded_by no apunta a nadie
+    rng = random.Random(seed)
+    db.executemany('INSERT INTO authors (id, full_name) VALUES (?, ?)', list(enumerate(AUTHORS, 1)))
+    subcategories = db.execute('SELECT id, category_id FROM subcategories ORDER BY id').fetchall()
+    for source_id in range(1, n_sources + 1):
+        title = ' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 7)))
+        keywords = ', '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(0, 3)))
+        subcategory_id, category_id = rng.choice(subcategories)
+        add_source(db, title, source_id=source_id, keywords=keywords, year=rng.randint(1990, 2024),
+                   category_id=category_id, subcategory_id=subcategory_id, rating=round(rng.random() * 5, 2),
+                   authors=rng.sample(range(1, len(AUTHORS) + 1), rng.randint(1, 2)),
+                   is_active=int(source_id % 13 != 0))
+    db.commit()
+    db.close()
+
+
+def add_source(db, title, source_id=None, keywords='', year=2020, category_id=None, subcategory_id=None,
+               rating=0.0, authors=(1,), is_active=1, edition=None):
+    cursor = db.execute('''
+        INSERT INTO sources (id, title, publication_year, source_type_id, keywords, category_id, subcategory_id,
+                             uploaded_by, is_active, overall_rating, edition)
+        VALUES (?, ?, ?, 1, ?, ?, ?, 1, ?, ?, ?)
+    ''', (source_id, title, year, keywords, category_id, subcategory_id, is_active, rating, edition))
+    source_id = cursor.lastrowid
+    db.executemany('INSERT INTO source_authors (source_id, author_id, sort_order) VALUES (?, ?, ?)',
+                   [(source_id, author_id, order) for order, author_id in enumerate(authors, 1)])
+    return source_id
+
+
+def source_document(db, source_id):
+    """(título, autores, keywords) tal como los lee recalc_idf.py: lo que Node
+    pasa a index_source.py."""
+    from recalc_idf import SOURCES_SQL
+    row = db.execute(SOURCES_SQL.format(where='AND s.id = ?'), (source_id,)).fetchone()
+    return row[1], row[2] or '', row[3] or ''
+
+
+def counters(db):
+    """doc_freq por término, total_docs y fuentes indexadas."""
+    doc_freq = dict(db.execute('SELECT term, doc_freq FROM global_idf'))
+    total_docs = db.execute("SELECT value FROM tfidf_meta WHERE key = 'total_docs'").fetchone()[0]
+    indexed = {r[0] for r in db.execute('SELECT source_id FROM source_norms')}
+    return doc_freq, total_docs, indexed
+
+
+def postings(db):
+    return {(term, source_id): tf for term, source_id, tf in db.execute('''
+        SELECT t.term, p.source_id, p.tf FROM tfidf_postings p JOIN tfidf_terms t ON t.term_id = p.term_id
+    ''')}
+
+
+def recalculated(path, directory, monkeypatch):
+    """Estado de un reindexado completo hecho sobre una copia de la base."""
+    import db_utils
+    import recalc_idf
+    copy = os.path.join(directory, 'recalc.db')
+    shutil.copy(path, copy)
+    with monkeypatch.context() as m:
+        m.setattr(db_utils, 'DB_PATH', copy)
+        m.setattr(recalc_idf, 'SNAPSHOT_PATH', os.path.join(directory, 'recalc.bin'))
+        recalc_idf.recalc_idf()
+    db = sqlite3.connect(copy)
+    try:
+        return counters(db), postings(db)
+    finally:
+        db.close()
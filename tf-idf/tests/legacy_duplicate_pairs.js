@@ -0,0 +1,77 @@
+// Reglas de casi duplicado de lib/duplicate_checker.js antes de
+// tf-idf/near_duplicates.py (comparación de todos los pares), sin cambios:
+// tests/test_near_duplicates.py las compara con el scan. Lee de stdin
+// [{id, title, year}] y escribe los pares [a, b] que daban una arista.
+const normalize = (s) => {
+  if (!s) return '';
+  try {
+    return s.toString().toLowerCase()
+      .normalize('NFD')
+      .replace(/\p{Diacritic}/gu, '')
+      .replace(/[^a-z0-9\s]/g, ' ')
+      .replace(/\s+/g, ' ')
+      .trim();
+  } catch (e) {
+    // fallback for environments without \p{Diacritic}
+    return s.toString().toLowerCase()
+      .normalize('NFD')
+      .replace(/[\u0300-\u036f]/g, '')
+      .replace(/[^a-z0-9\s]/g, ' ')
+      .replace(/\s+/g, ' ')
+      .trim();
+  }
+};
+
+function tokensFromTitle(title) {
+  const n = normalize(title);
+  if (!n) return new Set();
+  const parts = n.split(' ').filter(Boolean).filter(w => w.length > 2);
+  return new Set(parts);
+}
+
+function jaccard(aSet, bSet) {
+  if (!aSet.size || !bSet.size) return 0;
+  let inter = 0;
+  aSet.forEach(v => { if (bSet.has(v)) inter++; });
+  const uni = new Set([...aSet, ...bSet]).size;
+  return uni === 0 ? 0 : (inter / uni);
+}
+
+function levenshtein(a, b) {
+  const la = a.length, lb = b.length;
+  if (la === 0) return lb;
+  if (lb === 0) return la;
+  const dp = Array(la + 1).fill(null).map(() => Array(lb + 1).fill(0));
+  for (let i = 0; i <= la; i++) dp[i][0] = i;
+  for (let j = 0; j <= lb; j++) dp[0][j] = j;
+  for (let i = 1; i <= la; i++) {
+    for (let j = 1; j <= lb; j++) {
+      const cost = a[i - 1] === b[j - 1] ? 0 : 1;
+      dp[i][j] = Math.min(dp[i-1][j] + 1, dp[i][j-1] + 1, dp[i-1][j-1] + cost);
+    }
+  }
+  return dp[la][lb];
+}
+
+const items = JSON.parse(require('fs').readFileSync(0, 'utf8'))
+  .map(r => ({ id: r.id, title: r.title || '', year: r.year || null, tokens: tokensFromTitle(r.title) }));
+const pairEdges = [];
+for (let i = 0; i < items.length; i++) {
+  for (let j = i + 1; j < items.length; j++) {
+    const a = items[i];
+    const b = items[j];
+    const score = jaccard(a.tokens, b.tokens);
+    const normA = normalize(a.title || '');
+    const normB = normalize(b.title || '');
+    const lev = levenshtein(normA, normB);
+    const maxL = Math.max(1, Math.max(normA.length, normB.length));
+    const levSim = 1 - (lev / maxL);
+
+    // Heuristics for an edge
+    const isEdge = ((a.year && b.year && a.year === b.year && (score >= 0.35 || levSim >= 0.75)) || score >= 0.70);
+    if (isEdge) {
+      pairEdges.push([Math.min(a.id, b.id), Math.max(a.id, b.id)]);
+    }
+  }
+}
+console.log(JSON.stringify(pairEdges));
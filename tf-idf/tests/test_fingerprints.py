@@ -0,0 +1,42 @@
+"""Huellas de duplicado exacto (fingerprints.py) y su gemela en Node
+(sourceFingerprint de lib/duplicate_checker.js)."""
+import os
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from fingerprints import canonical_edition, fingerprint
+
+DUPLICATE_CHECKER = os.path.join(os.path.dirname(__file__), '..', '..', 'lib', 'duplicate_checker.js')
+
+CASES = [
+    ('Análisis de Datos', ['María Pérez', 'Juan Hernández'], None),
+    ('Análisis de datos', ['juan hernandez', 'MARÍA PÉREZ', 'María Pérez'], ''),
+    ('Redes neuronales', ['Ana Martínez'], 3),
+    ('Redes neuronales', ['Ana Martínez'], ' 007 '),
+    ('Redes neuronales', ['Ana Martínez'], '²'),
+    ('Redes neuronales', ['Ana Martínez'], '٣'),
+    ('Redes neuronales', ['Ana Martínez'], '2ª'),
+    ('Redes neuronales', [], 'segunda edición'),
+]
+
+
+def test_canonical_edition_only_strips_ascii_numbers():
+    assert canonical_edition(None) == ''
+    assert canonical_edition(' 007 ') == '7'
+    assert canonical_edition(12) == '12'
+    assert canonical_edition('²') == '²'
+    assert canonical_edition('٣') == '٣'
+    assert canonical_edition('2ª') == '2ª'
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='sin Node')
+def test_python_and_node_fingerprints_agree():
+    script = ('const { sourceFingerprint } = require(process.argv[1]);'
+              'const cases = JSON.parse(process.argv[2]);'
+              'console.log(JSON.stringify(cases.map(c => String(sourceFingerprint(...c)))));')
+    out = subprocess.run(['node', '-e', script, os.path.abspath(DUPLICATE_CHECKER), json.dumps(CASES)],
+                         capture_output=True, text=True, check=True)
+    assert json.loads(out.stdout) == [str(fingerprint(*case)) for case in CASES]
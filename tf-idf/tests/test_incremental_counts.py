@@ -0,0 +1,117 @@
+"""Los contadores incrementales de index_source.py / unindex_source.py
+(doc_freq, total_docs) coinciden con los de un reindexado completo."""
+import os
+import sys
+import runpy
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import db_utils
+import index_source
+import recalc_idf
+from corpus import add_source, counters, postings, recalculated, source_document
+from unindex_source import unindex_source
+
+
+def index(db, source_id):
+    index_source.index_source(source_id, *source_document(db, source_id))
+
+
+def test_index_reindex_unindex_match_full_recalc(corpus, db, tmp_path, monkeypatch):
+    new_id = add_source(db, 'Redes neuronales para el análisis del clima', keywords='clima, energía',
+                        authors=(2, 3))
+    db.execute("UPDATE sources SET title = 'Historia económica de México' WHERE id = 4")
+    db.execute('UPDATE sources SET is_active = 0 WHERE id = 7')
+    db.execute('DELETE FROM sources WHERE id = 8')
+    db.commit()
+    index(db, new_id)
+    index(db, 4)
+    index(db, 5)                # reindexar sin cambios no mueve nada
+    unindex_source([7, 8])
+    unindex_source([7])         # retirar dos veces tampoco
+
+    assert recalc_idf.check_counts()['consistent']
+    assert (counters(db), postings(db)) == recalculated(corpus, tmp_path, monkeypatch)
+
+
+def test_check_counts_reports_drift(corpus, db):
+    assert recalc_idf.check_counts()['consistent']
+    db.execute("UPDATE global_idf SET doc_freq = doc_freq + 2 WHERE term = (SELECT MIN(term) FROM global_idf)")
+    db.execute("UPDATE tfidf_meta SET value = value - 1 WHERE key = 'total_docs'")
+    db.commit()
+    report = recalc_idf.check_counts()
+    assert not report['consistent']
+    assert (report['drifted_terms'], report['doc_freq_drift']) == (1, 2)
+    assert report['total_docs'] == report['indexed_sources'] - 1
+
+
+def test_check_exit_code_separates_drift_from_failures(corpus, db, monkeypatch):
+    def check():
+        monkeypatch.setattr(sys, 'argv', ['recalc_idf.py', '--check'])
+        with pytest.raises(SystemExit) as exit_info:
+            runpy.run_path(os.path.join(os.path.dirname(recalc_idf.__file__), 'recalc_idf.py'), run_name='__main__')
+        return exit_info.value.code
+
+    assert check() == 0
+    db.execute("UPDATE tfidf_meta SET value = value + 1 WHERE key = 'total_docs'")
+    db.commit()
+    assert check() == recalc_idf.DRIFT_EXIT == 3
+
+
+def test_refresh_norms_matches_full_recalc(corpus, db, tmp_path, monkeypatch):
+    # Muchas fuentes nuevas mueven el IDF de casi todos los términos
+    for i in range(15):
+        source_id = add_source(db, f'Redes neuronales y aprendizaje automático {"clima " * (i % 3)}')
+        db.commit()
+        index(db, source_id)
+    recalc_idf.refresh_norms(tolerance=0.0)
+    recalculated(corpus, tmp_path, monkeypatch)
+    full = sqlite3.connect(os.path.join(tmp_path, 'recalc.db'))
+    try:
+        for table in ('source_norms', 'term_max_weights'):
+            got = dict(db.execute(f'SELECT * FROM {table}'))
+            expected = dict(full.execute(f'SELECT * FROM {table}'))
+            assert sorted(got) == sorted(expected)
+            assert [got[k] for k in sorted(got)] == pytest.approx([expected[k] for k in sorted(got)], rel=1e-9)
+    finally:
+        full.close()
+
+
+def test_generation_swap_waits_for_index_source(corpus, db, tmp_path, monkeypatch):
+    """El cambio de generación de recalc_idf.py intenta confirmarse entre las
+    lecturas de update_doc_freq y sus escrituras: debe esperar al bloqueo de
+    escritura de index_source.py en lugar de dejar deltas calculados con la
+    generación anterior."""
+    db.execute("UPDATE sources SET title = 'Teoría de grafos y algoritmos genéticos' WHERE id = 3")
+    db.commit()
+    generation = db_utils.read_generation(db)
+    recalc = threading.Thread(target=recalc_idf.recalc_idf)
+    real_get_db = index_source.get_db
+
+    def wait_for_swap(seconds=1.5):
+        observer = sqlite3.connect(corpus)
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and db_utils.read_generation(observer) == generation:
+            time.sleep(0.02)
+        observer.close()
+
+    def get_db():
+        connection = real_get_db()
+
+        def trace(sql):
+            if not recalc.is_alive() and recalc.ident is None and 'FROM source_norms WHERE source_id' in sql:
+                recalc.start()
+                wait_for_swap()
+        connection.set_trace_callback(trace)
+        return connection
+
+    monkeypatch.setattr(index_source, 'get_db', get_db)
+    index(db, 3)
+    recalc.join()
+
+    assert db_utils.read_generation(db) == generation + 1
+    assert recalc_idf.check_counts()['consistent']
+    assert (counters(db), postings(db)) == recalculated(corpus, tmp_path, monkeypatch)
@@ -0,0 +1,83 @@
+"""La poda MaxScore (search.top_k_maxscore) devuelve el mismo top_k que
+puntuar exhaustivamente todos los documentos."""
+import random
+
+import pytest
+
+import search
+from postings_index import InvertedIndex
+
+
+def exhaustive(term_lists, top_k, accept=None):
+    scores = {}
+    for qw, _, ids, weights in term_lists:
+        for source_id, weight in zip(ids, weights):
+            scores[source_id] = scores.get(source_id, 0.0) + qw * weight
+    ranked = sorted((-score, source_id) for source_id, score in scores.items()
+                    if score > 0 and (accept is None or accept(source_id)))
+    return [(source_id, -neg_score) for neg_score, source_id in ranked[:top_k]]
+
+
+def random_lists(rng, n_terms, n_docs, weights=None):
+    term_lists = []
+    for _ in range(n_terms):
+        ids = sorted(rng.sample(range(1, n_docs + 1), rng.randint(1, n_docs // 2)))
+        values = [rng.choice(weights) if weights else rng.random() for _ in ids]
+        qw = rng.choice(weights) if weights else rng.uniform(0.05, 2.0)
+        term_lists.append((qw, qw * max(values), ids, values))
+    return term_lists
+
+
+def as_pairs(results):
+    return [(r['source_id'], r['score']) for r in results]
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_maxscore_matches_exhaustive(seed):
+    rng = random.Random(seed)
+    term_lists = random_lists(rng, rng.randint(1, 6), rng.randint(5, 300))
+    for top_k in (1, 3, 10, 50):
+        got = as_pairs(search.top_k_maxscore(term_lists, top_k))
+        expected = exhaustive(term_lists, top_k)
+        assert [source_id for source_id, _ in got] == [source_id for source_id, _ in expected]
+        assert [score for _, score in got] == pytest.approx([score for _, score in expected], rel=1e-12)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_maxscore_breaks_ties_by_source_id(seed):
+    # pesos diádicos: las sumas son exactas en cualquier orden y los empates, reales
+    rng = random.Random(seed)
+    term_lists = random_lists(rng, rng.randint(2, 5), rng.randint(20, 120), weights=(0.25, 0.5, 1.0))
+    for top_k in (1, 5, 20):
+        assert as_pairs(search.top_k_maxscore(term_lists, top_k)) == exhaustive(term_lists, top_k)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_maxscore_with_filter_matches_exhaustive(seed):
+    rng = random.Random(seed)
+    term_lists = random_lists(rng, rng.randint(1, 5), rng.randint(20, 200))
+    accept = {source_id for source_id in range(1, 201) if rng.random() < 0.3}.__contains__
+    got = as_pairs(search.top_k_maxscore(term_lists, 10, accept))
+    expected = exhaustive(term_lists, 10, accept)
+    assert [source_id for source_id, _ in got] == [source_id for source_id, _ in expected]
+    assert [score for _, score in got] == pytest.approx([score for _, score in expected], rel=1e-12)
+
+
+def test_index_bounds_are_valid_for_maxscore(corpus, db):
+    # Con las cotas que guarda el índice (term_max_weights), el top_k del índice
+    # residente y el de SQLite son el exhaustivo de las listas de la consulta
+    index = InvertedIndex.from_db(db, search.fetch_idf(db.cursor()))
+    for query in ('redes neuronales', 'análisis de datos del clima', 'teoría de grafos y algoritmos',
+                  'energía renovable y agricultura sostenible', 'García López'):
+        terms = search.preprocess(query)
+        weights = search.term_weights(search.build_query_vector(terms, index.idf), index.idf)
+        term_lists = []
+        for term, tw in weights.items():
+            entry = index.entry(term)
+            if entry is not None and entry.end > entry.start:
+                ids, values = index.slice(entry)
+                term_lists.append((tw, abs(tw) * entry.max_weight, list(ids), list(values)))
+        expected = exhaustive(term_lists, 10)
+        for results in (search.score_index(index, terms, 10), search.score_db(db, terms, 10)):
+            assert [r['source_id'] for r in results] == [source_id for source_id, _ in expected]
+            assert [r['score'] for r in results] == pytest.approx([score for _, score in expected], rel=1e-6)
@@ -0,0 +1,93 @@
+"""Casi duplicados por título (near_duplicates.py) sobre la base de ejemplo
+database/articora-data.db con variantes añadidas: el scan y la comprobación
+de una fuente encuentran lo mismo que comparar todos los pares, y solo se
+apartan de las reglas anteriores de lib/duplicate_checker.js donde cambia el
+Jaccard al no contar las stopwords."""
+import os
+import json
+import shutil
+import sqlite3
+import subprocess
+from itertools import combinations
+
+import pytest
+
+import db_utils
+import near_duplicates
+from corpus import DATABASE_DIR, add_source
+
+LEGACY_SCRIPT = os.path.join(os.path.dirname(__file__), 'legacy_duplicate_pairs.js')
+
+VARIANTS = {
+    # erratas en casi todas las palabras: Jaccard bajo, solo la regla de edición
+    'typo': ('Atention Is Al You Ned', 2017),
+    'typos': ('Generativ Adversarial Netwroks', 2014),
+    'reordered': ('Distributed Storage System for Structured Data: Bigtable', 2006),
+    'other_year': ('Random Forests', 2002),
+    # solo cambian stopwords: Jaccard 0,6 con ellas, 1 sin ellas
+    'stopwords_a': ('Cartas para una joven poeta', 1929),
+    'stopwords_b': ('Cartas a un joven poeta', 1930),
+    # solo comparten stopwords: Jaccard 0,56 con ellas, 0 sin ellas
+    'shared_stopwords_a': ('Lo que hay entre nosotros y ellos: historia', 1985),
+    'shared_stopwords_b': ('Lo que hay entre nosotros y ellos: economía política moderna', 1985),
+}
+
+
+@pytest.fixture
+def sample(tmp_path):
+    """Copia de la base de ejemplo con las variantes; devuelve (conexión, id de cada variante)."""
+    path = str(tmp_path / 'articora-data.db')
+    shutil.copy(os.path.join(DATABASE_DIR, 'articora-data.db'), path)
+    db = sqlite3.connect(path)
+    db_utils.ensure_schema(db)
+    ids = {name: add_source(db, title, year=year) for name, (title, year) in VARIANTS.items()}
+    db.commit()
+    yield db, ids
+    db.close()
+
+
+def id_of(db, title):
+    return db.execute('SELECT id FROM sources WHERE title = ?', (title,)).fetchone()[0]
+
+
+def scanned(db):
+    return {(p['a'], p['b']) for p in near_duplicates.scan(db)['pairs']}
+
+
+def exhaustive(db):
+    rows = db.execute('SELECT id, title, publication_year FROM sources WHERE is_active = 1 ORDER BY id').fetchall()
+    rows = [(i, near_duplicates.normalize_title(t), y) for i, t, y in rows]
+    return {(a[0], b[0]) for a, b in combinations(rows, 2)
+            if near_duplicates.title_tokens(a[1]) and near_duplicates.title_tokens(b[1])
+            and near_duplicates.compare(a[1], b[1], a[2], b[2])}
+
+
+def test_scan_matches_all_pairs(sample):
+    db, ids = sample
+    pairs = scanned(db)
+    assert pairs == exhaustive(db)
+    assert (id_of(db, 'Attention Is All You Need'), ids['typo']) in pairs
+    assert (id_of(db, 'Generative Adversarial Networks'), ids['typos']) in pairs
+
+
+def test_typo_variant_found_by_single_checks(sample):
+    db, ids = sample
+    near_duplicates.sync_signatures(db)
+    original = id_of(db, 'Attention Is All You Need')
+    assert original in [m['source_id'] for m in near_duplicates.check_source(db.cursor(), ids['typo'])]
+    matches = near_duplicates.check_title(db.cursor(), 'Atencion Is All Yuo Need', 2017)
+    assert {m['source_id'] for m in matches} == {original, ids['typo']}
+    assert near_duplicates.check_title(db.cursor(), 'Atencion Is All Yuo Need', 2018) == []
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='sin Node')
+def test_differences_with_legacy_rules(sample):
+    db, ids = sample
+    items = [{'id': i, 'title': t, 'year': y}
+             for i, t, y in db.execute('SELECT id, title, publication_year FROM sources WHERE is_active = 1')]
+    out = subprocess.run(['node', LEGACY_SCRIPT], input=json.dumps(items), capture_output=True, text=True, check=True)
+    legacy = {tuple(pair) for pair in json.loads(out.stdout)}
+    pairs = scanned(db)
+    assert legacy - pairs == {(ids['shared_stopwords_a'], ids['shared_stopwords_b'])}
+    assert pairs - legacy == {(ids['stopwords_a'], ids['stopwords_b'])}
+    assert len(legacy & pairs) == 4
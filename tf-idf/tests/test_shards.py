@@ -0,0 +1,101 @@
+"""Índice repartido en shards (shards.py): mismo resultado que un único
+índice, también después de recargar con cambios."""
+from types import SimpleNamespace
+
+import pytest
+
+import search
+import shards
+from corpus import source_document
+from unindex_source import unindex_source
+
+
+QUERIES = ('redes neuronales', 'análisis de datos del clima', 'historia de méxico', 'teoría de grafos',
+           'energía renovable y agricultura sostenible', 'María Pérez', 'física cuántica y matemáticas')
+FILTERS = {'year_from': 2000, 'category_id': [1, 2, 3]}
+
+
+def ranking(results):
+    return [(r['source_id'], round(r['score'], 9)) for r in results]
+
+
+@pytest.fixture
+def sharded():
+    """Carga índices en shards y para sus procesos al terminar el test."""
+    loaded = []
+
+    def load(n_shards, previous=None):
+        loaded.append(shards.ShardedIndex.load(n_shards, previous))
+        return loaded[-1]
+    yield load
+    for index in loaded:
+        index.close()
+
+
+@pytest.mark.parametrize('n_shards', [1, 2, 3])
+def test_sharded_merge_matches_single_index(corpus, sharded, n_shards):
+    single = search.load_index(snapshot=None)
+    index = sharded(n_shards)
+    assert index.n_sources == single.n_sources
+    for filters in (None, FILTERS):
+        for query in QUERIES:
+            assert (ranking(search.search(query, 10, index=index, filters=filters))
+                    == ranking(search.search(query, 10, index=single, filters=filters)))
+        assert ([ranking(r) for r in search.search_batch(QUERIES, 10, index=index, filters=filters)]
+                == [ranking(r) for r in search.search_batch(QUERIES, 10, index=single, filters=filters)])
+    facets = search.search_facets(QUERIES[0], 10, index=index)
+    assert facets['facets'] == search.search_facets(QUERIES[0], 10, index=single)['facets']
+    assert (ranking(search.search_by_source(5, 10, index=index))
+            == ranking(search.search_by_source(5, 10, index=single)))
+
+
+def worker(change_seq, generation=1):
+    return SimpleNamespace(info={'generation': generation, 'change_seq': change_seq})
+
+
+def test_stale_shards_compare_with_each_worker_load(corpus, db):
+    db.execute('DELETE FROM tfidf_changes')
+    db.execute("UPDATE sqlite_sequence SET seq = 3 WHERE name = 'tfidf_changes'")
+    db.execute("UPDATE tfidf_meta SET value = 1 WHERE key = 'generation'")
+    db.executemany('INSERT INTO tfidf_changes (seq, source_id) VALUES (?, ?)', [(4, 10), (5, 11)])
+    db.commit()
+    # el shard 0 cargó después del cambio 4 (fuente 10); el 1, antes del 5 (fuente 11)
+    assert shards.stale_shards([worker(4), worker(3)], db) == [1]
+    assert shards.stale_shards([worker(5), worker(5)], db) == []
+    assert shards.stale_shards([worker(3), worker(3)], db) == [0, 1]
+    assert shards.stale_shards([worker(5), worker(5, generation=0)], db) == [0, 1]
+    # registro purgado por debajo de lo que cargó un shard: ya no se sabe qué cambió
+    db.execute('DELETE FROM tfidf_changes WHERE seq = 4')
+    db.commit()
+    assert shards.stale_shards([worker(3), worker(5)], db) == [0, 1]
+
+
+def test_change_logged_while_reloading_is_not_lost(corpus, db, sharded, monkeypatch):
+    title = source_document(db, 10)[0]
+    first = sharded(2)
+    assert 10 in [r['source_id'] for r in search.search(title, 10, index=first)]
+
+    # La fuente 10 (shard 0) se retira justo cuando la recarga abre su transacción
+    real_get_db = shards.get_db
+    logged = []
+
+    def get_db():
+        connection = real_get_db()
+
+        def trace(sql):
+            if sql.strip().upper() == 'BEGIN' and not logged:
+                logged.append(sql)
+                unindex_source([10])
+        connection.set_trace_callback(trace)
+        return connection
+
+    monkeypatch.setattr(shards, 'get_db', get_db)
+    second = sharded(2, first)
+    monkeypatch.setattr(shards, 'get_db', real_get_db)
+    assert logged
+    third = sharded(2, second)
+
+    expected = search.search(title, 10, index=search.load_index(snapshot=None))
+    assert 10 not in [r['source_id'] for r in expected]
+    for index in (second, third):
+        assert ranking(search.search(title, 10, index=index)) == ranking(expected)
@@ -0,0 +1,85 @@
+"""La instantánea mmap más las fuentes cambiadas después de generarla
+(postings_snapshot.SnapshotOverlay, index_snapshot.OverlayIndex) devuelve lo
+mismo que leer el índice de SQLite, con los dos motores."""
+import pytest
+
+import search
+from corpus import add_source, source_document
+from index_snapshot import OverlayIndex
+from index_source import index_source
+from postings_snapshot import SnapshotOverlay
+from unindex_source import unindex_source
+
+QUERIES = ('redes neuronales', 'análisis de datos del clima', 'historia económica de méxico',
+           'teoría de grafos y algoritmos genéticos', 'energía renovable', 'García López', 'física cuántica')
+FILTERS = {'year_from': 2000, 'rating_min': 1.0}
+
+
+def ranking(results):
+    return [(r['source_id'], round(r['score'], 6)) for r in results]
+
+
+@pytest.fixture
+def changed(corpus, db, tmp_path):
+    """El corpus con fuentes indexadas, reindexadas y retiradas después de la
+    instantánea que dejó recalc_idf.py; devuelve la ruta de la instantánea."""
+    new_id = add_source(db, 'Redes neuronales para el análisis del clima y la energía', keywords='clima',
+                        authors=(1, 4), year=2021, rating=4.5)
+    db.execute("UPDATE sources SET title = 'Historia económica de México en el siglo XX' WHERE id = 4")
+    db.execute('UPDATE sources SET is_active = 0 WHERE id = 6')
+    db.commit()
+    for source_id in (new_id, 4):
+        index_source(source_id, *source_document(db, source_id))
+    unindex_source([6])
+    return str(tmp_path / 'tfidf_index.bin')
+
+
+@pytest.mark.parametrize('engine, overlay', [('inverted', SnapshotOverlay), ('numpy', OverlayIndex)])
+def test_overlay_matches_sqlite(changed, engine, overlay):
+    index = search.load_index(engine=engine, snapshot=changed)
+    assert isinstance(index, overlay)
+    fresh = search.load_index(engine=engine, snapshot=None)
+    assert index.n_sources == fresh.n_sources
+    for query in QUERIES:
+        expected = ranking(search.search(query, 10, engine=engine))
+        assert ranking(search.search(query, 10, index=index)) == expected
+        assert ranking(search.search(query, 10, index=fresh)) == expected
+        assert (ranking(search.search(query, 10, index=index, filters=FILTERS))
+                == ranking(search.search(query, 10, engine=engine, filters=FILTERS)))
+    assert ([ranking(r) for r in search.search_batch(QUERIES, 10, index=index)]
+            == [ranking(search.search(q, 10, engine=engine)) for q in QUERIES])
+
+
+def test_retired_source_leaves_the_snapshot(changed):
+    index = search.load_index(snapshot=changed)
+    title = 'Historia económica de México en el siglo XX'
+    assert search.search(title, 1, index=index)[0]['source_id'] == 4
+    for query in QUERIES:
+        assert 6 not in [r['source_id'] for r in search.search(query, 50, index=index)]
+
+
+def test_search_by_source_ignores_vectors_newer_than_the_index(corpus, db):
+    """La consulta de search_by_source se lee de la base: si la fuente cambió
+    después de cargar el índice residente, se puntúa contra la base, como sin
+    índice, en lugar de mezclar el vector nuevo con el índice anterior."""
+    import recalc_idf
+    from result_cache import ResultCache
+    index = search.load_index(snapshot=None)
+    cache = ResultCache(64)
+    before = ranking(search.search_by_source(5, 10, index=index, cache=cache))
+    assert before == ranking(search.search_by_source(5, 10))
+
+    db.execute("UPDATE sources SET title = 'Teoría de grafos y redes neuronales para el clima' WHERE id = 4")
+    db.commit()
+    index_source(4, *source_document(db, 4))
+    # la fuente 5 no cambió: sigue saliendo del índice residente (y de la caché)
+    assert ranking(search.search_by_source(5, 10, index=index, cache=cache)) == before
+    expected = ranking(search.search_by_source(4, 10))
+    assert ranking(search.search_by_source(4, 10, index=index, cache=cache)) == expected
+    assert ranking(search.search_by_source(4, 10, index=index, cache=cache)) == expected
+
+    # otra generación: las normas de todas las fuentes cambian
+    recalc_idf.recalc_idf()
+    for source_id in (4, 5):
+        assert (ranking(search.search_by_source(source_id, 10, index=index))
+                == ranking(search.search_by_source(source_id, 10)))
@@ -0,0 +1,36 @@
+import sys
+import json
+from db_utils import get_db
+from index_source import update_doc_freq
+from fingerprints import refresh_fingerprints
+
+def unindex_source(source_ids):
+    """Retira fuentes del índice (borradas o desactivadas): descuenta sus
+    términos de doc_freq y la fuente de total_docs, y elimina vector y norma,
+    todo en una transacción que toma el bloqueo de escritura antes de leer
+    (ver update_doc_freq)."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    removed = []
+    for source_id in source_ids:
+        cursor.execute('SELECT 1 FROM source_norms WHERE source_id = ?', (source_id,))
+        if cursor.fetchone() is not None:
+            removed.append(source_id)
+        update_doc_freq(cursor, source_id, None)
+        cursor.execute('DELETE FROM tfidf_postings WHERE source_id = ?', (source_id,))
+        cursor.execute('DELETE FROM source_norms WHERE source_id = ?', (source_id,))
+        # Registrar el cambio: la instantánea mmap deja de devolver la fuente y las
+        # listas de fuentes relacionadas que la contenían se recalculan sin ella (cron)
+        cursor.execute('INSERT INTO tfidf_changes (source_id) VALUES (?)', (source_id,))
+    db.commit()
+    # Las fuentes borradas pierden su huella; las desactivadas la conservan
+    # (transacción aparte: el índice ya está confirmado)
+    refresh_fingerprints(db, source_ids)
+    db.commit()
+    db.close()
+    print(json.dumps({"status": "ok", "source_ids": removed}))
+
+if __name__ == '__main__':
+    # Esperamos uno o más source_id
+    unindex_source([int(a) for a in sys.argv[1:]])